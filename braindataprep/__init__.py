@@ -2,6 +2,8 @@ import logging
 
 logging.basicConfig(format='%(levelname)s | %(message)s', level=15)
 
+from . import cache  # noqa: E402, F401
+
 
 # discover usable datasets
 try: from .datasets import IXI
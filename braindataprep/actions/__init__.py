@@ -1,7 +1,11 @@
 from . import action        # noqa: F401
 from . import file          # noqa: F401
+from . import locks         # noqa: F401
 from . import writers       # noqa: F401
+from . import scheduler     # noqa: F401
 
 from .action import *       # noqa: F401, F403
 from .file import *         # noqa: F401, F403
+from .locks import *        # noqa: F401, F403
 from .writers import *      # noqa: F401, F403
+from .scheduler import *    # noqa: F401, F403
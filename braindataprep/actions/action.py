@@ -9,6 +9,10 @@ from pathlib import Path
 from types import GeneratorType
 
 from braindataprep.digests import sort_digests, get_digest
+from braindataprep.digests import cache_digests
+from braindataprep.actions.state import record_provenance
+from braindataprep.actions.state import record_build
+from braindataprep.actions.state import get_build_state
 from braindataprep.actions.file import File, Files
 
 lg = getLogger(__name__)
@@ -115,6 +119,7 @@ class Action:
         size: int | None = None,
         mtime: datetime.datetime | None = None,
         digests: dict[str, str] | None = None,
+        member: str | None = None,
     ) -> None:
         """
         Parameters
@@ -146,8 +151,12 @@ class Action:
             Expected digest(s) of the file.
             Keys are algorithm names (e.g. "sha256") and values are the
             digests.
+        member : str | None
+            Name of the archive member (if `src` is an archive) from
+            which the file is extracted. Only used for provenance.
         """
         self.src = src
+        self.member = member
         self.dst = dst
         self.action = action
         self.input = input
@@ -250,8 +259,40 @@ class Action:
 
         return True
 
+    def _is_up_to_date(self) -> bool:
+        # Decide from the build state of the dataset, without touching
+        # the output file.
+        ifexists = IfExists.current or self.ifexists
+        if ifexists not in (
+            IfExists.SKIP, IfExists.DIFFERENT, IfExists.REFRESH
+        ):
+            return False
+        state = get_build_state(self.dst)
+        if state is None:
+            return False
+        if ifexists is IfExists.SKIP:
+            return state.get(self.dst) is not None
+        src = self.src
+        if isinstance(src, (str, Path)):
+            src = [src]
+        return state.is_up_to_date(
+            self.dst, src,
+            member=self.member,
+            mtime=self._fingerprint_mtime,
+            digests=self.digests,
+        )
+
     def __iter__(self) -> Iterator[dict]:
         try:
+            # Expected mtime, before it gets computed from the sources
+            self._fingerprint_mtime = (
+                self.mtime.timestamp() if self.mtime else None
+            )
+            if self._is_up_to_date():
+                lg.info(f'File {self.dst!s} is up to date: skip')
+                yield {'status': 'skipped', 'message': 'up to date'}
+                return
+
             # Protect source files for reading and perform action
             src = self.src
             if isinstance(src, (str, Path)):
@@ -289,21 +330,24 @@ class Action:
         # --------------------------------------------------------------
         try:
             if self.digests:
-                checksum, checkalgo = next(iter(self.digests.items()))
+                checkalgo, checksum = next(iter(self.digests.items()))
             else:
                 checksum = checkalgo = None
 
+            outchecksum = None
             with File(
                 self.dst,
                 self.mode,
             ) as local_file:
 
                 # Action input is an opened file-object
+                # (its digest is computed while it is written)
                 if self.input == 'file':
-                    with local_file.open() as f:
+                    with local_file.open(digest=checkalgo) as f:
                         action = self.action(f)
                         if isinstance(action, GeneratorType):
                             yield from action
+                    outchecksum = f.digest
 
                 # Action input is a path to a file
                 else:
@@ -319,7 +363,11 @@ class Action:
             # ----------------------------------------------------------
 
             if checksum:
-                outchecksum = get_digest(self.dst, checkalgo)
+                if outchecksum is None:
+                    # Fallback: hash the written file
+                    outchecksum = get_digest(
+                        self.dst, checkalgo, cache=False
+                    )
 
                 if outchecksum != checksum:
                     msg = (
@@ -349,6 +397,15 @@ class Action:
             atime = time.time()
             mtime = self.mtime.timestamp() if self.mtime else atime
             os.utime(self.dst, (atime, mtime))
+            if checksum:
+                cache_digests(self.dst, {checkalgo: checksum})
+            record_provenance(self.dst, self.src, self.member)
+            record_build(
+                self.dst, self.src,
+                member=self.member,
+                mtime=self._fingerprint_mtime,
+                digests={checkalgo: outchecksum} if outchecksum else None,
+            )
 
             yield {'status': 'done'}
 
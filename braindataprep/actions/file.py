@@ -1,13 +1,23 @@
+import hashlib
+import threading
 import time
+from collections import Counter
 from pathlib import Path
 from shutil import rmtree, copy2
-from fasteners import InterProcessReaderWriterLock
 from typing import IO, Tuple, Iterable
 from logging import getLogger
 
+from braindataprep.actions.locks import LockHandle, get_lock_manager
+
 lg = getLogger(__name__)
 
 
+# Number of `File` contexts (of this process) that use each temporary
+# folder, so that concurrent readers do not delete it under each other.
+_users: Counter = Counter()
+_users_lock = threading.Lock()
+
+
 class File:
     """
     An object that represents a file in the tree.
@@ -18,6 +28,9 @@ class File:
     file is created first, and only renamed to its final name if
     everything completed properly.
 
+    Locks are provided by the current lock manager
+    (see `braindataprep.actions.locks`).
+
     ```python
     # Open file object for reading
     with File(filename) as file_ref:
@@ -105,10 +118,11 @@ class File:
         self.tempname: Path = self.tempdir / self.filename.name
         self.lockname: Path = self.tempdir / 'lock'
         self.safename = None
-        self.lock: InterProcessReaderWriterLock = None
+        self.lock: LockHandle = None
         self.file: IO[bytes] = None
         self.writable = None
         self.readable = None
+        self._tempdir_used = False
 
     def open(self, mode: str | None = None, **kwargs) -> "OpenedFile":
         r"""
@@ -134,6 +148,10 @@ class File:
             How to handle errors
         newline : {None, '', '\n', '\r', '\r\n'}
             How to parse newline characters from the stream (text mode)
+        digest : str, optional
+            Hashing algorithm. If set (and the file is written from
+            scratch in binary mode), the digest of all written bytes is
+            computed on the fly and exposed by `OpenedFile.digest`.
 
         Returns
         -------
@@ -145,37 +163,35 @@ class File:
         return OpenedFile(self, mode, **kwargs)
 
     def __enter__(self):
+        mode = self.mode
+        if mode:
+            self.writable = 'w' in mode or 'a' in mode or '+' in mode
+            self.readable = 'r' in mode or '+' in mode
+        locks = get_lock_manager()
+
+        # Files that are only read do not need a temporary folder,
+        # unless it holds their lock
+        readonly = self.readable and not self.writable
+        self._tempdir_used = not readonly or locks.uses_tempdir
+        if self._tempdir_used:
+            with _users_lock:
+                _users[self.tempdir] += 1
+                self.tempdir.mkdir(parents=True, exist_ok=True)
 
         # Remove existing file
-        self.tempdir.mkdir(parents=True, exist_ok=True)
-        if self.tempname.is_dir():
-            rmtree(self.tempname)
-        else:
-            self.tempname.unlink(missing_ok=True)
+        if not readonly:
+            if self.tempname.is_dir():
+                rmtree(self.tempname)
+            else:
+                self.tempname.unlink(missing_ok=True)
 
-        if self.mode:
+        if mode:
             # Acquire lock
-            self.lock = InterProcessReaderWriterLock(str(self.lockname))
-
-            mode = self.mode
-            self.writable = 'w' in mode or 'a' in mode or '+' in mode
-            self.readable = 'r' in mode or '+' in mode
-
-            if (
-                self.writable and
-                not (self.lock.acquire_write_lock(blocking=False))
-            ):
-                raise RuntimeError(
-                    f'Could not acquire write lock for {self.filename}'
-                )
-
-            elif (
-                self.readable and
-                not (self.lock.acquire_read_lock(blocking=False))
-            ):
-                raise RuntimeError(
-                    f'Could not acquire read lock for {self.filename}'
-                )
+            try:
+                self.lock = locks.acquire(self.filename, self.writable)
+            except Exception:
+                self._release_tempdir(False)
+                raise
 
         if self.writable:
             self.safename = self.tempname
@@ -183,12 +199,24 @@ class File:
             self.safename = self.filename
 
         # Copy file into temp
-        if 'a' in mode or ('r' in mode and '+' in mode):
+        if mode and ('a' in mode or ('r' in mode and '+' in mode)):
             if self.filename.exists():
                 copy2(self.filename, self.tempname)
 
         return self
 
+    def _release_tempdir(self, success: bool) -> None:
+        # Delete the temporary folder if no one else uses it
+        if not self._tempdir_used:
+            return
+        with _users_lock:
+            _users[self.tempdir] -= 1
+            if not _users[self.tempdir]:
+                del _users[self.tempdir]
+                if success:
+                    rmtree(self.tempdir, ignore_errors=True)
+        self._tempdir_used = False
+
     def __exit__(self, exc_type, exc_val, exc_tb):
         # Rename temporary filename to output filename
         # Note that we only rename the file to its final name and
@@ -204,20 +232,8 @@ class File:
         finally:
             # Release lock and delete existing files
             if self.lock is not None:
-                if self.writable:
-                    try:
-                        self.lock.release_write_lock()
-                    except RuntimeError:
-                        # we were not owning a write lock
-                        pass
-                elif self.readable:
-                    try:
-                        self.lock.release_read_lock()
-                    except RuntimeError:
-                        # we were not owning a read lock
-                        pass
-            if exc_type is None:
-                rmtree(self.tempdir)
+                self.lock.release()
+            self._release_tempdir(exc_type is None)
             self.lock = None
             self.safename = None
             self.writable = None
@@ -300,8 +316,36 @@ class FileObjMixin:
     * total_write: int
     * last_write_speed: float
     * mean_write_speed: float
+    * digester: hashlib object | None
+    * _digest: str | None
     """
 
+    def _init_digester(self, algo: str | None, mode: str) -> None:
+        # Bytes can only be hashed on the fly if the file is written
+        # sequentially, from scratch, in binary mode.
+        self.digester = None
+        self._digest = None
+        if (
+            algo and 'b' in mode and ('w' in mode or 'x' in mode)
+            and '+' not in mode
+        ):
+            self.digester = hashlib.new(algo)
+
+    def _close_digester(self) -> None:
+        if self.digester is not None:
+            self._digest = self.digester.hexdigest()
+        self.digester = None
+
+    @property
+    def digest(self) -> str | None:
+        """
+        Digest of all written bytes, or None if it could not be
+        computed on the fly (no algorithm, text mode, seek, ...)
+        """
+        if self.digester is not None:
+            return self.digester.hexdigest()
+        return self._digest
+
     def error_if_notincontext(self, name: str) -> None:
         if self.fileobj is None:
             raise ValueError(
@@ -314,6 +358,13 @@ class FileObjMixin:
 
     def seek(self, *a, **k):
         self.error_if_notincontext('write')
+        if self.digester is not None:
+            position = self.fileobj.tell()
+            newposition = self.fileobj.seek(*a, **k)
+            if newposition != position:
+                # writes are not sequential anymore
+                self.digester = None
+            return newposition
         return self.fileobj.seek(*a, **k)
 
     def write(self, blob: bytes | str) -> "FileObjMixin":
@@ -321,6 +372,8 @@ class FileObjMixin:
         tic = time.time()
         self.fileobj.write(blob)
         toc = time.time()
+        if self.digester is not None:
+            self.digester.update(blob)
         self._update_write_speed(len(blob), toc-tic)
         return self
 
@@ -451,11 +504,15 @@ class FileObj(FileObjMixin, File):
             self,
             filename: str | Path,
             mode: str | None = 'rb',
+            digest: str | None = None,
     ):
         if mode is None:
             raise ValueError('mode must be provided')
         super().__init__(filename, mode)
         self.fileobj = None
+        self.digestalgo = digest
+        self.digester = None
+        self._digest = None
         self.total_read = 0
         self.last_read_speed = 0
         self.mean_read_speed = 0
@@ -465,17 +522,18 @@ class FileObj(FileObjMixin, File):
 
     def __enter__(self) -> "FileObj":
         super().__enter__()
-        self.tempdir.mkdir(parents=True, exist_ok=True)
         self.fileobj = self.safename.open(self.mode)
         self.total_read = 0
         self.total_write = 0
+        self._init_digester(self.digestalgo, self.mode)
         return self
 
     def __exit__(self, exc_type, exc_val, exc_tb) -> None:
-        assert self.file is not None
+        assert self.fileobj is not None
         self.fileobj.close()
         self.fileobj = None
-        super().__exit__(self, exc_type, exc_val, exc_tb)
+        self._close_digester()
+        super().__exit__(exc_type, exc_val, exc_tb)
 
 
 class OpenedFile(FileObjMixin):
@@ -491,7 +549,9 @@ class OpenedFile(FileObjMixin):
         It should **only** be created inside `File.open()`.
     """
 
-    def __init__(self, file: File, mode: str | None) -> None:
+    def __init__(
+        self, file: File, mode: str | None, digest: str | None = None
+    ) -> None:
         # checks
         if mode is None:
             mode = self.file.mode
@@ -510,6 +570,9 @@ class OpenedFile(FileObjMixin):
         self.total_write = 0
         self.last_write_speed = 0
         self.mean_write_speed = 0
+        self.digestalgo = digest
+        self.digester = None
+        self._digest = None
 
     def __enter__(self) -> "OpenedFile":
         # Acquire lock
@@ -530,21 +593,9 @@ class OpenedFile(FileObjMixin):
                 'so file object cannot be opened in read mode.')
 
         if self.file.lock is None:
-            self.lock = InterProcessReaderWriterLock(str(self.file.lockname))
-            if (
-                self.writable and
-                not self.lock.acquire_write_lock(blocking=False)
-            ):
-                raise RuntimeError(
-                    f'Could not acquire write lock for {self.file.filename}'
-                )
-            elif (
-                self.readable and
-                not self.lock.acquire_read_lock(blocking=False)
-            ):
-                raise RuntimeError(
-                    f'Could not acquire read lock for {self.file.filename}'
-                )
+            self.lock = get_lock_manager().acquire(
+                self.file.filename, self.writable
+            )
 
             # Copy file into temp
             if 'a' in mode or ('r' in mode and '+' in mode):
@@ -552,6 +603,7 @@ class OpenedFile(FileObjMixin):
                     copy2(self.file.filename, self.file.tempname)
 
         self.fileobj = self.file.safename.open(mode)
+        self._init_digester(self.digestalgo, mode)
         return self
 
     def __exit__(self, exc_type, exc_val, exc_tb) -> None:
@@ -559,18 +611,8 @@ class OpenedFile(FileObjMixin):
         assert self.file is not None
         self.fileobj.close()
         self.fileobj = None
+        self._close_digester()
         # Release lock
         if self.lock is not None:
-            if self.writable:
-                try:
-                    self.lock.release_write_lock()
-                except RuntimeError:
-                    # we were not owning a write lock
-                    pass
-            elif self.readable:
-                try:
-                    self.lock.release_read_lock()
-                except RuntimeError:
-                    # we were not owning a read lock
-                    pass
+            self.lock.release()
         self.lock = None
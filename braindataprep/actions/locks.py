@@ -0,0 +1,244 @@
+"""
+Locks that protect files of the tree while they are read or written.
+
+Three backends are available:
+
+* `'file'` : a reader/writer lock stored next to each file, in a
+  `{file}.tmp/lock` file (default);
+* `'dataset'` : reader/writer locks stored in a single folder per
+  dataset (`{dataset}/.bdp/locks`), and named after a hash of the
+  path that they protect. No folder is created or deleted next to
+  the protected files;
+* `'none'` : no inter-process lock. Only safe if a single process
+  works on the tree.
+
+Whatever the backend, a lock on a file that is held by several readers
+of the same process is reference-counted: the inter-process lock is
+acquired by the first reader and released by the last one.
+
+```python
+set_lock_manager('dataset')
+with get_lock_manager().read('path/to/archive.tar'):
+    ...
+```
+"""
+import hashlib
+import os
+import threading
+from contextlib import contextmanager
+from logging import getLogger
+from pathlib import Path
+from typing import Iterator, Literal
+
+from fasteners import InterProcessReaderWriterLock
+
+from braindataprep.actions.state import get_dataset_root
+
+lg = getLogger(__name__)
+
+LockChoice = Literal['file', 'dataset', 'none']
+
+
+class LockHandle:
+    """A lock held by the current process. Release with `release()`."""
+
+    def __init__(self, manager: "LockManager", path: Path, write: bool):
+        self.manager = manager
+        self.path = path
+        self.write = write
+
+    def release(self) -> None:
+        """Release the lock (no-op if already released)"""
+        if self.manager is not None:
+            self.manager.release(self.path)
+        self.manager = None
+
+
+class LockManager:
+    """
+    Base class for lock backends.
+
+    It keeps track of the locks held by the current process, so that
+    concurrent readers share a single inter-process lock, and that a
+    file that is being read is not written by another thread (and
+    vice versa). Backends implement `_acquire` and `_release`.
+    """
+
+    # Whether locks live in the temporary folder of the file
+    uses_tempdir: bool = False
+
+    def __init__(self):
+        # path -> [lock object, write?, number of holders]
+        self._held: dict[Path, list] = {}
+        self._lock = threading.Lock()
+
+    def acquire(self, path: str | Path, write: bool = False) -> LockHandle:
+        """
+        Acquire a (non-blocking) lock on a file.
+
+        Parameters
+        ----------
+        path : str | Path
+            Protected file
+        write : bool
+            Acquire a write (exclusive) lock instead of a read (shared)
+            lock
+
+        Returns
+        -------
+        handle : LockHandle
+
+        Raises
+        ------
+        RuntimeError
+            If the lock could not be acquired
+        """
+        path = Path(os.path.abspath(path))
+        kind = 'write' if write else 'read'
+        with self._lock:
+            held = self._held.get(path)
+            if held:
+                if write or held[1]:
+                    raise RuntimeError(
+                        f'Could not acquire {kind} lock for {path}'
+                    )
+                held[2] += 1
+            else:
+                lock = self._acquire(path, write)
+                if lock is False:
+                    raise RuntimeError(
+                        f'Could not acquire {kind} lock for {path}'
+                    )
+                self._held[path] = [lock, write, 1]
+        return LockHandle(self, path, write)
+
+    def release(self, path: str | Path) -> None:
+        """Release a lock acquired by `acquire`"""
+        path = Path(os.path.abspath(path))
+        with self._lock:
+            held = self._held[path]
+            held[2] -= 1
+            if not held[2]:
+                del self._held[path]
+                self._release(held[0], held[1])
+
+    @contextmanager
+    def read(self, path: str | Path) -> Iterator[LockHandle]:
+        """Context manager that holds a read lock"""
+        handle = self.acquire(path)
+        try:
+            yield handle
+        finally:
+            handle.release()
+
+    @contextmanager
+    def write(self, path: str | Path) -> Iterator[LockHandle]:
+        """Context manager that holds a write lock"""
+        handle = self.acquire(path, write=True)
+        try:
+            yield handle
+        finally:
+            handle.release()
+
+    def _acquire(self, path: Path, write: bool):
+        """Acquire the inter-process lock. Return False on failure."""
+        return None
+
+    def _release(self, lock, write: bool) -> None:
+        """Release the inter-process lock"""
+        pass
+
+
+class NoLocks(LockManager):
+    """Only protect files against other threads of the same process"""
+    pass
+
+
+class FileLocks(LockManager):
+    """Reader/writer lock stored in `{file}.tmp/lock`"""
+
+    uses_tempdir = True
+
+    def lockpath(self, path: Path) -> Path:
+        """Path to the lock file that protects a file"""
+        return path.with_name(path.name + '.tmp') / 'lock'
+
+    def _acquire(self, path: Path, write: bool):
+        lock = InterProcessReaderWriterLock(str(self.lockpath(path)))
+        if write:
+            ok = lock.acquire_write_lock(blocking=False)
+        else:
+            ok = lock.acquire_read_lock(blocking=False)
+        return lock if ok else False
+
+    def _release(self, lock: InterProcessReaderWriterLock, write: bool):
+        try:
+            if write:
+                lock.release_write_lock()
+            else:
+                lock.release_read_lock()
+        except RuntimeError:
+            # we were not owning the lock
+            pass
+
+
+class DatasetLocks(FileLocks):
+    """
+    Reader/writer locks stored in `{dataset}/.bdp/locks`.
+
+    Files that are not in a dataset are protected by locks stored in
+    the user-level cache (`~/.cache/braindataprep/locks`). Lock files
+    are never deleted, since deleting a lock file that another process
+    is about to lock is not safe.
+    """
+
+    uses_tempdir = False
+
+    def lockpath(self, path: Path) -> Path:
+        root = get_dataset_root(path)
+        if root is not None:
+            folder = root / '.bdp' / 'locks'
+        else:
+            cache = os.environ.get('XDG_CACHE_HOME', '')
+            cache = Path(cache or Path.home() / '.cache')
+            folder = cache / 'braindataprep' / 'locks'
+        name = hashlib.sha1(str(path).encode()).hexdigest()
+        return folder / (name + '.lock')
+
+
+LOCK_MANAGERS: dict[str, type] = {
+    'file': FileLocks,
+    'dataset': DatasetLocks,
+    'none': NoLocks,
+}
+
+_manager: LockManager = FileLocks()
+
+
+def get_lock_manager() -> LockManager:
+    """Return the lock manager used by `File` objects"""
+    return _manager
+
+
+def set_lock_manager(manager: LockChoice | LockManager) -> LockManager:
+    """
+    Set the lock manager used by `File` objects.
+
+    Should be called before any file is locked.
+
+    Parameters
+    ----------
+    manager : {'file', 'dataset', 'none'} | LockManager
+        Lock backend
+
+    Returns
+    -------
+    manager : LockManager
+    """
+    global _manager
+    if isinstance(manager, str):
+        manager = LOCK_MANAGERS[manager.lower()]()
+    if manager is not _manager:
+        lg.debug(f'Lock manager: {type(manager).__name__}')
+    _manager = manager
+    return _manager
@@ -0,0 +1,163 @@
+import os
+import queue
+from concurrent.futures import ThreadPoolExecutor
+from logging import getLogger
+from pathlib import Path
+from typing import Iterable, Iterator
+
+from braindataprep.pyout import Status
+from braindataprep.actions.action import Action
+
+lg = getLogger(__name__)
+
+
+class Barrier:
+    """
+    A marker that can be inserted in a stream of actions.
+
+    All actions that precede a barrier are completed before any
+    following action is pulled from the stream. This is required when
+    the generation of later actions depends on files written by earlier
+    ones (e.g., `freesurfer.bidsify` only yields actions for files that
+    exist).
+    """
+    pass
+
+
+class Scheduler:
+    """
+    Run a stream of actions concurrently, while respecting their
+    dependencies.
+
+    An action is only started once all running actions whose output
+    (`dst`) is one of its inputs (`src`), or which read or write its
+    output, have completed. Actions are pulled lazily from the stream,
+    and the status dictionaries that they yield are forwarded to the
+    caller, so that they can be displayed from the main thread.
+
+    Status dictionaries found in the stream (e.g., progress updates)
+    are forwarded as they are pulled, with `action=None`.
+
+    ```python
+    scheduler = Scheduler(jobs=4)
+    for action, status in scheduler.run(actions):
+        print(action.dst if action else '', status)
+    ```
+    """
+
+    def __init__(self, jobs: int = 1, window: int | None = None):
+        """
+        Parameters
+        ----------
+        jobs : int
+            Number of actions run in parallel. If 1, actions are run
+            sequentially in the calling thread.
+        window : int
+            Maximum number of actions that are pulled from the stream
+            but not yet completed (default: `2 * jobs`)
+        """
+        self.jobs = max(1, jobs or 1)
+        self.window = window or 2 * self.jobs
+
+    @staticmethod
+    def _paths(paths) -> list[Path]:
+        if isinstance(paths, (str, Path)):
+            paths = [paths]
+        return [Path(os.path.abspath(path)) for path in paths or []]
+
+    @staticmethod
+    def _overlap(path1: Path, path2: Path) -> bool:
+        return (
+            path1 == path2 or path1 in path2.parents or path2 in path1.parents
+        )
+
+    def _conflicts(self, action: Action, running: dict) -> bool:
+        src = self._paths(action.src)
+        dst = self._paths(action.dst)[0]
+        for other_src, other_dst in running.values():
+            if any(self._overlap(other_dst, path) for path in (*src, dst)):
+                return True
+            if any(self._overlap(path, dst) for path in other_src):
+                return True
+        return False
+
+    def run(
+        self, actions: Iterable[Action | Barrier | Status]
+    ) -> Iterator[tuple[Action | None, Status]]:
+        """
+        Run all actions.
+
+        Parameters
+        ----------
+        actions : iterable[Action | Barrier | dict]
+            Stream of actions
+
+        Yields
+        ------
+        action : Action | None
+            Action that yielded the status
+        status : dict
+            Status dictionary
+        """
+        if self.jobs == 1:
+            yield from self._run_sequential(actions)
+        else:
+            yield from self._run_parallel(actions)
+
+    def _run_sequential(self, actions):
+        for action in actions:
+            if isinstance(action, Barrier):
+                continue
+            if isinstance(action, dict):
+                yield None, action
+                continue
+            for status in action:
+                yield action, status
+
+    def _run_parallel(self, actions):
+        # Messages sent by workers: (action, status) pairs, where
+        # status is None once the action has completed.
+        messages = queue.Queue()
+        # Running actions: id -> (src, dst)
+        running = {}
+
+        def work(action):
+            try:
+                for status in action:
+                    messages.put((action, status))
+            finally:
+                messages.put((action, None))
+
+        def receive():
+            # Wait for one message and forward it
+            action, status = messages.get()
+            if status is None:
+                del running[id(action)]
+            else:
+                yield action, status
+
+        with ThreadPoolExecutor(self.jobs, 'action') as pool:
+            for action in actions:
+                if isinstance(action, dict):
+                    yield None, action
+                    continue
+                if isinstance(action, Barrier):
+                    while running:
+                        yield from receive()
+                    continue
+                while (
+                    len(running) >= self.window or
+                    self._conflicts(action, running)
+                ):
+                    yield from receive()
+                running[id(action)] = (
+                    self._paths(action.src), self._paths(action.dst)[0]
+                )
+                pool.submit(work, action)
+
+                # Forward pending messages without blocking
+                while not messages.empty():
+                    yield from receive()
+
+            while running:
+                yield from receive()
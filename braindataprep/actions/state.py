@@ -0,0 +1,395 @@
+"""
+Persistent state of a dataset, stored under its `.bdp` folder.
+
+* The provenance of each file written by an `Action` (source files
+  and, when extracted from an archive, the archive member) is recorded
+  so that it can be reported in the dataset manifest.
+* The inputs and output of each completed `Action` are recorded in a
+  make-style build state, so that re-runs can skip actions that are
+  up to date without touching the filesystem.
+"""
+import json
+import os
+import sqlite3
+import threading
+from collections import OrderedDict
+from logging import getLogger
+from pathlib import Path
+from typing import Iterable, Iterator, NamedTuple
+
+lg = getLogger(__name__)
+
+
+# Name of the provenance database, under a `.bdp` folder
+PROVENANCE_NAME: str = 'provenance.sqlite'
+# Name of the build state database, under a `.bdp` folder
+BUILD_STATE_NAME: str = 'build.sqlite'
+
+
+class Provenance:
+    """
+    On-disk (SQLite) record of where each file of a dataset comes from.
+
+    Paths are stored relative to the dataset root (sources that live
+    outside of the dataset are stored as absolute paths).
+
+    ```python
+    provenance = Provenance('path/to/dataset')
+    provenance.set('rawdata/sub-01/anat/sub-01_T1w.nii.gz',
+                   ['sourcedata/T1.tar'], 'sub-01/T1.nii.gz')
+    sources, member = provenance.get('rawdata/sub-01/anat/sub-01_T1w.nii.gz')
+    ```
+    """
+
+    def __init__(self, root: str | Path):
+        """
+        Parameters
+        ----------
+        root : str | Path
+            Path to the dataset root
+        """
+        self.root = Path(os.path.abspath(root))
+        self.path = self.root / '.bdp' / PROVENANCE_NAME
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(str(self.path), check_same_thread=False)
+        with self._lock, self._db:
+            self._db.execute('PRAGMA journal_mode=WAL')
+            self._db.execute('PRAGMA synchronous=NORMAL')
+            self._db.execute(
+                'CREATE TABLE IF NOT EXISTS provenance ('
+                'path TEXT PRIMARY KEY, sources TEXT, member TEXT)'
+            )
+
+    def relpath(self, fpath: str | Path) -> str:
+        """Path relative to the dataset root (if it is inside)"""
+        fpath = os.path.abspath(fpath)
+        try:
+            return Path(fpath).relative_to(self.root).as_posix()
+        except ValueError:
+            return fpath
+
+    def get(self, fpath: str | Path) -> tuple[list[str], str | None] | None:
+        """Return the (sources, member) of a file, if known"""
+        with self._lock:
+            row = self._db.execute(
+                'SELECT sources, member FROM provenance WHERE path = ?',
+                (self.relpath(fpath),)
+            ).fetchone()
+        if row is None:
+            return None
+        return json.loads(row[0]), row[1]
+
+    def set(
+        self,
+        fpath: str | Path,
+        sources: Iterable[str | Path],
+        member: str | None = None,
+    ) -> None:
+        """Save (or replace) the provenance of a file"""
+        sources = [self.relpath(src) for src in sources]
+        with self._lock, self._db:
+            self._db.execute(
+                'INSERT OR REPLACE INTO provenance VALUES (?, ?, ?)',
+                (self.relpath(fpath), json.dumps(sources), member)
+            )
+
+    def items(self) -> Iterator[tuple[str, tuple[list[str], str | None]]]:
+        """Iterate over all records, as `(path, (sources, member))`"""
+        with self._lock:
+            rows = self._db.execute(
+                'SELECT path, sources, member FROM provenance'
+            ).fetchall()
+        for path, sources, member in rows:
+            yield path, (json.loads(sources), member)
+
+    def close(self) -> None:
+        with self._lock:
+            self._db.close()
+
+
+_provenances: dict[Path, Provenance] = {}
+_roots: dict[Path, Path | None] = {}
+_provenances_lock = threading.Lock()
+
+
+def get_dataset_root(fpath: str | Path) -> Path | None:
+    """
+    Return the root of the dataset that contains a file, i.e., the
+    nearest parent folder that contains a `.bdp` folder.
+    """
+    folder = Path(os.path.abspath(fpath)).parent
+    with _provenances_lock:
+        if folder not in _roots:
+            _roots[folder] = None
+            for parent in (folder, *folder.parents):
+                if (parent / '.bdp').is_dir():
+                    _roots[folder] = parent
+                    break
+        return _roots[folder]
+
+
+def get_provenance(fpath: str | Path) -> Provenance | None:
+    """
+    Return the provenance record of the dataset that contains a file,
+    or None if the file is not in a dataset.
+    """
+    root = get_dataset_root(fpath)
+    if root is None:
+        return None
+    with _provenances_lock:
+        provenance = _provenances.get(root, None)
+        if provenance is None:
+            provenance = _provenances[root] = Provenance(root)
+    return provenance
+
+
+def record_provenance(
+    fpath: str | Path,
+    sources: Iterable[str | Path] | str | Path,
+    member: str | None = None,
+) -> None:
+    """Save the provenance of a file in the record of its dataset"""
+    if isinstance(sources, (str, Path)):
+        sources = [sources]
+    try:
+        provenance = get_provenance(fpath)
+        if provenance is not None:
+            provenance.set(fpath, sources, member)
+    except (OSError, sqlite3.Error) as e:
+        lg.debug(f'Could not record provenance of {fpath}: {e}')
+
+
+class BuildRecord(NamedTuple):
+    """State of an output file when it was last built"""
+    inputs: tuple[tuple[str, int, int], ...]    # (path, size, mtime_ns)
+    member: str | None          # Archive member
+    mtime: float | None         # Expected mtime of the action (timestamp)
+    digests: dict[str, str]     # Known digests of the output
+    size: int                   # Output size
+    mtime_ns: int               # Output mtime
+
+
+class BuildState:
+    """
+    On-disk (SQLite) record of the inputs and output of each completed
+    action of a dataset, used to decide whether an action is up to date
+    (as `make` does) without touching the filesystem.
+
+    Records are loaded one output folder at a time, and each folder is
+    listed once (without stat-ing its files) to check that outputs
+    still exist. Each input is stat-ed at most once per run.
+
+    ```python
+    state = BuildState('path/to/dataset')
+    if not state.is_up_to_date(dst, src, member=member):
+        ...  # run action
+        state.set(dst, src, member=member)
+    ```
+    """
+
+    # Number of folders whose records are kept in memory
+    CACHE_SIZE = 256
+
+    def __init__(self, root: str | Path):
+        """
+        Parameters
+        ----------
+        root : str | Path
+            Path to the dataset root
+        """
+        self.root = Path(os.path.abspath(root))
+        self.path = self.root / '.bdp' / BUILD_STATE_NAME
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.RLock()
+        self._db = sqlite3.connect(str(self.path), check_same_thread=False)
+        with self._lock, self._db:
+            self._db.execute('PRAGMA journal_mode=WAL')
+            self._db.execute('PRAGMA synchronous=NORMAL')
+            self._db.execute(
+                'CREATE TABLE IF NOT EXISTS build ('
+                'dir TEXT, name TEXT, inputs TEXT, member TEXT, '
+                'mtime REAL, digests TEXT, size INTEGER, mtime_ns INTEGER, '
+                'PRIMARY KEY (dir, name))'
+            )
+        # folder -> (records, names of existing files)
+        self._folders: OrderedDict[str, tuple[dict, set]] = OrderedDict()
+        # input path -> (size, mtime_ns) | None
+        self._stats: dict[str, tuple[int, int] | None] = {}
+
+    def relpath(self, fpath: str | Path) -> str:
+        """Path relative to the dataset root (if it is inside)"""
+        fpath = os.path.abspath(fpath)
+        try:
+            return Path(fpath).relative_to(self.root).as_posix()
+        except ValueError:
+            return fpath
+
+    def _split(self, fpath: str | Path) -> tuple[str, str, str]:
+        fpath = os.path.abspath(fpath)
+        folder, name = os.path.split(fpath)
+        return folder, self.relpath(folder), name
+
+    def _folder(self, folder: str, relfolder: str) -> tuple[dict, set]:
+        """Records and existing file names of a folder (cached)"""
+        with self._lock:
+            if relfolder in self._folders:
+                self._folders.move_to_end(relfolder)
+                return self._folders[relfolder]
+            rows = self._db.execute(
+                'SELECT name, inputs, member, mtime, digests, size, mtime_ns '
+                'FROM build WHERE dir = ?', (relfolder,)
+            ).fetchall()
+            records = {
+                name: BuildRecord(
+                    tuple(map(tuple, json.loads(inputs))), member, mtime,
+                    json.loads(digests), size, mtime_ns
+                )
+                for name, inputs, member, mtime, digests, size, mtime_ns
+                in rows
+            }
+            try:
+                names = set(os.listdir(folder)) if records else set()
+            except OSError:
+                names = set()
+            self._folders[relfolder] = (records, names)
+            while len(self._folders) > self.CACHE_SIZE:
+                self._folders.popitem(last=False)
+            return records, names
+
+    def _stat(self, fpath: str | Path) -> tuple[int, int] | None:
+        """(size, mtime_ns) of an input, stat-ed once per run"""
+        fpath = os.path.abspath(fpath)
+        with self._lock:
+            if fpath in self._stats:
+                return self._stats[fpath]
+        try:
+            stat = os.stat(fpath)
+            value = (stat.st_size, stat.st_mtime_ns)
+        except OSError:
+            value = None
+        with self._lock:
+            self._stats[fpath] = value
+        return value
+
+    def _inputs(self, sources: Iterable[str | Path]) -> tuple | None:
+        inputs = []
+        for src in sources:
+            stat = self._stat(src)
+            if stat is None:
+                return None
+            inputs.append((self.relpath(src), *stat))
+        return tuple(sorted(inputs))
+
+    def get(self, fpath: str | Path) -> BuildRecord | None:
+        """Return the record of an output, if it exists on disk"""
+        folder, relfolder, name = self._split(fpath)
+        records, names = self._folder(folder, relfolder)
+        if name not in names:
+            return None
+        return records.get(name, None)
+
+    def is_up_to_date(
+        self,
+        fpath: str | Path,
+        sources: Iterable[str | Path],
+        *,
+        member: str | None = None,
+        mtime: float | None = None,
+        digests: dict[str, str] | None = None,
+    ) -> bool:
+        """
+        Whether an output was built from the same inputs (with the same
+        size and mtime), the same archive member, and the same expected
+        mtime and digests.
+
+        Outputs that do not depend on any input, expected mtime or
+        expected digest are never considered up to date.
+        """
+        sources = list(sources)
+        if not (sources or mtime or digests):
+            return False
+        record = self.get(fpath)
+        if record is None:
+            return False
+        if record.member != member or record.mtime != mtime:
+            return False
+        for algo, digest in (digests or {}).items():
+            if record.digests.get(algo, None) != digest:
+                return False
+        return self._inputs(sources) == record.inputs
+
+    def set(
+        self,
+        fpath: str | Path,
+        sources: Iterable[str | Path],
+        *,
+        member: str | None = None,
+        mtime: float | None = None,
+        digests: dict[str, str] | None = None,
+    ) -> None:
+        """Save (or replace) the record of an output, in its current state"""
+        fpath = os.path.abspath(fpath)
+        folder, relfolder, name = self._split(fpath)
+        stat = os.stat(fpath)
+        with self._lock:
+            # the output may be the input of another action
+            self._stats[fpath] = (stat.st_size, stat.st_mtime_ns)
+        inputs = self._inputs(sources) or ()
+        record = BuildRecord(
+            inputs, member, mtime, dict(digests or {}),
+            stat.st_size, stat.st_mtime_ns
+        )
+        with self._lock, self._db:
+            self._db.execute(
+                'INSERT OR REPLACE INTO build VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                (relfolder, name, json.dumps(inputs), member, mtime,
+                 json.dumps(record.digests), stat.st_size, stat.st_mtime_ns)
+            )
+            if relfolder in self._folders:
+                records, names = self._folders[relfolder]
+                records[name] = record
+                names.add(name)
+
+    def close(self) -> None:
+        with self._lock:
+            self._db.close()
+
+
+_build_states: dict[Path, BuildState] = {}
+
+
+def get_build_state(fpath: str | Path) -> BuildState | None:
+    """
+    Return the build state of the dataset that contains a file,
+    or None if the file is not in a dataset.
+    """
+    root = get_dataset_root(fpath)
+    if root is None:
+        return None
+    with _provenances_lock:
+        state = _build_states.get(root, None)
+        if state is None:
+            state = _build_states[root] = BuildState(root)
+    return state
+
+
+def record_build(
+    fpath: str | Path,
+    sources: Iterable[str | Path] | str | Path,
+    *,
+    member: str | None = None,
+    mtime: float | None = None,
+    digests: dict[str, str] | None = None,
+) -> None:
+    """Save the inputs and output of an action in its build state"""
+    if isinstance(sources, (str, Path)):
+        sources = [sources]
+    try:
+        state = get_build_state(fpath)
+        if state is not None:
+            state.set(
+                fpath, sources, member=member, mtime=mtime, digests=digests
+            )
+    except (OSError, sqlite3.Error) as e:
+        lg.debug(f'Could not record build state of {fpath}: {e}')
@@ -216,6 +216,7 @@ class WriteBytes(Action):
         size: int = None,
         mtime: datetime = None,
         digests: dict = None,
+        member: str | None = None,
     ):
         """
         Parameters
@@ -239,6 +240,9 @@ class WriteBytes(Action):
             Expected digest(s) of the file.
             Keys are algorithm names (e.g. "sha256") and values are the
             digests.
+        member : str | None
+            Name of the archive member (if `src` is an archive) from
+            which the bytes are read. Only used for provenance.
         """
         self.bytes = bytes
 
@@ -252,6 +256,7 @@ class WriteBytes(Action):
             size=size,
             mtime=mtime,
             digests=digests,
+            member=member,
         )
 
     def action(self, file: BinaryIO):
@@ -374,6 +379,7 @@ class BabelConvert(Action):
         inp_format=None,
         out_format=None,
         affine=None,
+        slab_size: int = None,
         ifexists: str = 'different',
         size: int = None,
         mtime: datetime = None,
@@ -395,6 +401,9 @@ class BabelConvert(Action):
             Output format  (default: guess)
         affine : np.ndarray
             Orientation matrix (default: from input)
+        slab_size : int
+            Largest number of bytes of data decoded at once
+            (default: `braindataprep.utils.io.SLAB_SIZE`)
         ifexists : {'error', 'skip', 'overwrite', 'different', 'refresh'}
             Behaviour if destination file already exists
         size : int
@@ -420,6 +429,7 @@ class BabelConvert(Action):
         self.inp_format = inp_format
         self.out_format = out_format
         self.affine = affine
+        self.slab_size = slab_size
 
     def action(self, path: Path):
         return nibabel_convert(
@@ -427,6 +437,7 @@ class BabelConvert(Action):
             inp_format=self.inp_format,
             out_format=self.out_format,
             affine=self.affine,
+            slab_size=self.slab_size,
         )
 
 
@@ -0,0 +1,55 @@
+from pathlib import Path
+from cyclopts import App
+
+from braindataprep.cli import app
+from braindataprep.digests import DigestCache
+from braindataprep.digests import DIGEST_CACHE_NAME
+from braindataprep.digests import default_cache_path
+from braindataprep.utils.path import get_tree_path
+from braindataprep.utils.log import setup_filelog
+
+from logging import getLogger
+lg = getLogger(__name__)
+
+cache_help = """
+Commands related to the caches of braindataprep
+"""
+
+app.command(cache := App(name="cache", help=cache_help))
+
+
+@cache.command
+def prune(
+    path: str | None = None,
+    *,
+    user: bool = True,
+    log: str | None = None,
+):
+    """
+    Remove stale entries (deleted or modified files) from digest caches.
+
+    Parameters
+    ----------
+    path : str
+        Path to root of all datasets. The digest cache of each dataset
+        (`{dataset}/.bdp/digests.sqlite`) is pruned.
+    user : bool
+        Also prune the user-level digest cache
+    log : str
+        Path to log file
+    """
+    setup_filelog(log)
+    root = Path(get_tree_path(path))
+    paths = sorted(root.glob(f'*/.bdp/{DIGEST_CACHE_NAME}'))
+    if (root / '.bdp' / DIGEST_CACHE_NAME).exists():
+        paths.insert(0, root / '.bdp' / DIGEST_CACHE_NAME)
+    if user and default_cache_path().exists():
+        paths.append(default_cache_path())
+
+    for path in paths:
+        cache = DigestCache(path)
+        try:
+            nb = cache.prune()
+        finally:
+            cache.close()
+        lg.info(f'{path}: removed {nb} stale entries')
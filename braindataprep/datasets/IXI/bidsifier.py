@@ -1,6 +1,3 @@
-import tarfile
-import nibabel as nib
-import numpy as np
 from logging import getLogger
 from functools import partial
 from gzip import GzipFile
@@ -8,14 +5,17 @@ from pathlib import Path, PosixPath
 from typing import Literal, Iterable, Set
 
 from braindataprep.utils.path import fileparts
+from braindataprep.utils.tar import TarIndex
 from braindataprep.utils.io import copy_from_buffer
 from braindataprep.utils.io import write_tsv
+from braindataprep.utils.io import stack_nifti
 from braindataprep.pyout import bidsify_tab
 from braindataprep.actions import Action
 from braindataprep.actions import File
 from braindataprep.actions import CopyBytes
 from braindataprep.actions import CopyJSON
 from braindataprep.actions import WrapAction
+from braindataprep.actions import Scheduler
 
 lg = getLogger(__name__)
 try:
@@ -59,7 +59,9 @@ class Bidsifier:
         subs: Iterable[int] = tuple(),
         exclude_subs: Iterable[int] = tuple(),
         json: Literal["yes", "no", "only"] | bool = True,
-        ifexists: IfExists = "skip"
+        ifexists: IfExists = "skip",
+        jobs: int = 1,
+        channel_jobs: int = 1,
     ):
         self.root = root
         self.keys = keys
@@ -67,6 +69,8 @@ class Bidsifier:
         self.exclude_subs = exclude_subs
         self.json = json
         self.ifexists = ifexists
+        self.jobs = jobs
+        self.channel_jobs = channel_jobs
 
     def init(self):
         """Prepare common stuff"""
@@ -75,6 +79,10 @@ class Bidsifier:
         # Folder
         self.src = self.root / 'sourcedata'
         self.raw = self.root / 'rawdata'
+        # Dataset state (digest cache, provenance of outputs)
+        (self.root / '.bdp').mkdir(parents=True, exist_ok=True)
+        # Scheduler
+        self.scheduler = Scheduler(self.jobs)
         # Track errors
         self.nb_errors = 0
         self.nb_skipped = 0
@@ -122,11 +130,10 @@ class Bidsifier:
         """Get all available sites"""
         sitemap = {}
         with File(tarpath, "r") as f:
-            with tarfile.open(str(f.safename)) as tar:
-                for member in tar.getmembers():
-                    ixi_id, site, *_ = member.name.split('-')
-                    ixi_id = int(ixi_id[3:])
-                    sitemap[ixi_id] = site
+            for name in TarIndex(f.safename):
+                ixi_id, site, *_ = name.split('-')
+                ixi_id = int(ixi_id[3:])
+                sitemap[ixi_id] = site
         return sitemap
 
     def fixstatus(self, status: dict, fname: str):
@@ -139,6 +146,14 @@ class Bidsifier:
             self.nb_skipped += 1
             yield {'skipped': self.nb_skipped}
 
+    def run_actions(self, actions: Iterable[Action | dict]):
+        """Run a stream of actions (in parallel) and yield statuses"""
+        for action, status in self.scheduler.run(actions):
+            if action is None:
+                yield status
+            else:
+                yield from self.fixstatus(status, action.dst.name)
+
     # ------------------------------------------------------------------
     #   Generate root metadata (dataset, participants, etc)
     # ------------------------------------------------------------------
@@ -206,7 +221,7 @@ class Bidsifier:
         if not tarpath.exists():
             lg.warning(f'IXI-{self.BIDS2IXI[key]}.tar not found')
             return
-        with tarfile.open(tarpath) as tar:
+        with TarIndex(tarpath).open() as tar:
             yield from self._make_modality(key, tar)
 
     def _make_modality(self, key: str, tar):
@@ -231,20 +246,19 @@ class Bidsifier:
             # JSON file
             if self.json != 'no':
                 fname = name + '.json'
-                for status in CopyJSON(
+                yield CopyJSON(
                     self.TPLDIR / site / f'{key}.json', dst / fname, **opt
-                ):
-                    yield from self.fixstatus(status, fname)
+                )
 
             # NIFTI file
             if self.json != 'only':
                 fname = name + '.nii.gz'
-                for status in Action(
+                yield Action(
                     tarpath, dst / fname,
                     lambda fp: copy_from_buffer(tar.extractfile(member), fp),
+                    member=member.name,
                     **opt
-                ):
-                    yield from self.fixstatus(status, fname)
+                )
 
         # Count number of subjects
         nsub = 0
@@ -254,16 +268,18 @@ class Bidsifier:
             nsub += not skip_subject(id)
 
         # Process each subject
-        isub = 0
-        for member in tar.getmembers():
-            path = PosixPath(member.name)
-            id = int(path.name.split('-')[0][3:])
-            if skip_subject(id):
-                continue
-            isub += 1
-            yield from parse_member(member)
-            yield {'progress': 100*isub/nsub}
+        def iter_actions():
+            isub = 0
+            for member in tar.getmembers():
+                path = PosixPath(member.name)
+                id = int(path.name.split('-')[0][3:])
+                if skip_subject(id):
+                    continue
+                isub += 1
+                yield from parse_member(member)
+                yield {'progress': 100*isub/nsub}
 
+        yield from self.run_actions(iter_actions())
         yield {'status': 'done', 'message': ''}
 
     # ------------------------------------------------------------------
@@ -275,11 +291,10 @@ class Bidsifier:
         if not tarpath.exists():
             lg.warning('IXI-DTI.tar not found')
             return
-        with tarfile.open(tarpath) as tar:
+        with TarIndex(tarpath).open() as tar:
             yield from self._make_dwi(tar)
 
     def _make_dwi(self, tar):
-        tarpath = self.src / 'IXI-DTI.tar'
         opt = dict(ifexists=self.ifexists)
 
         # First, copy bvals/bvecs.
@@ -353,68 +368,59 @@ class Bidsifier:
         nsub = len(ids)
 
         # Loop through each subject
-        isub = 0
-        for id, site in sts.items():
-            isub += 1
+        def iter_actions():
+            isub = 0
+            for id, site in sts.items():
+                isub += 1
+                yield from self._dwi_get_actions(tar, id, site, ids[id])
+                yield {'progress': 100*isub/nsub}
 
-            dst = self.raw / f'sub-{id:03d}' / 'dwi'
-            basename = f'sub-{id:03d}_dwi'
+        yield from self.run_actions(iter_actions())
+        yield {'status': 'done', 'message': ''}
 
-            # Write JSON
-            if self.json != 'no':
-                name = basename + '.json'
-                lg.info(f'write {name}')
-                for status in CopyJSON(
-                    self.TPLDIR / site / 'dwi.json', dst / name, **opt
-                ):
-                    yield from self.fixstatus(status, name)
-
-            if self.json == 'only':
-                yield {'progress': 100*isub/nsub}
-                continue
+    def _dwi_get_actions(self, tar, id, site, membernames):
+        """Generate actions for a given subject"""
+        tarpath = self.src / 'IXI-DTI.tar'
+        dst = self.raw / f'sub-{id:03d}' / 'dwi'
+        basename = f'sub-{id:03d}_dwi'
+
+        # Write JSON
+        if self.json != 'no':
+            name = basename + '.json'
+            lg.info(f'write {name}')
+            yield CopyJSON(
+                self.TPLDIR / site / 'dwi.json', dst / name,
+                ifexists=self.ifexists,
+            )
 
-            # Now, concatenate volumes
-
-            # ----------------------------------------------------------
-            # This is our (future) concatenatino action for delayed
-            def cat_action(path):
-                # Load all channels
-                membernames = ids[id]
-                dat = []
-                for i, membername in enumerate(membernames):
-                    yield {'status': f'load ch-{i:02d}'}
-                    member = tar.getmember(membername)
-                    nii = nib.Nifti1Image.from_stream(
-                        GzipFile(fileobj=tar.extractfile(member))
-                    )
-                    dat.append(np.asarray(nii.dataobj).squeeze())
-
-                # Fallback (this happened in one of the subjects...)
-                if len(set([tuple(dat1.shape) for dat1 in dat])) > 1:
-                    lg.error(
-                        f'sub-{id:03d}_dwi | incompatible shapes'
-                    )
-                    raise RuntimeError('incompatible shapes')
-
-                # Ensure 4D
-                yield {'status': 'stacking channels'}
-                dat = list(map(lambda x: x[..., None], dat))
-                dat = np.concatenate(dat, axis=3)
-                yield {'status': 'writing stack'}
-                affine, header = nii.affine, nii.header
-                nib.save(nib.Nifti1Image(dat, affine, header), path)
-            # ----------------------------------------------------------
-
-            name = basename + '.nii.gz'
-            for status in Action(
-                tarpath, dst / name, cat_action,
-                ifexists=self.ifexists, input='path',
-            ):
-                yield from self.fixstatus(status, name)
+        if self.json == 'only':
+            return
 
-            yield {'progress': 100*isub/nsub}
+        # Now, concatenate volumes
+        # Channels are decoded (`channel_jobs` at a time) and streamed to
+        # the 4D output, which is never assembled in memory. This is
+        # independent of the number of actions run in parallel (`jobs`),
+        # so that memory use does not grow with `jobs ** 2`.
+        channels = [
+            partial(self._open_channel, tar, membername)
+            for membername in membernames
+        ]
 
-        yield {'status': 'done', 'message': ''}
+        def cat_action(path):
+            # Raises if channels have incompatible shapes
+            # (this happened in one of the subjects...)
+            return stack_nifti(channels, path, jobs=self.channel_jobs)
+
+        name = basename + '.nii.gz'
+        yield Action(
+            tarpath, dst / name, cat_action,
+            ifexists=self.ifexists, input='path',
+        )
+
+    @staticmethod
+    def _open_channel(tar, membername):
+        """Open a (gzip-compressed) channel of a DWI series"""
+        return GzipFile(fileobj=tar.extractfile(tar.getmember(membername)))
 
     # ------------------------------------------------------------------
     #   Generate participant file
@@ -42,6 +42,8 @@ from typing import Literal, Iterable
 from braindataprep.utils.path import get_tree_path
 from braindataprep.utils.log import setup_filelog
 from braindataprep.actions import IfExists
+from braindataprep.actions import LockChoice, set_lock_manager
+from braindataprep.utils.compression import set_compression
 from braindataprep.datasets.IXI.command import ixi
 from braindataprep.datasets.IXI.bidsifier import Bidsifier
 
@@ -57,6 +59,11 @@ def bidsify(
     exclude_subs: Iterable[int] | None = tuple(),
     json: Literal["yes", "no", "only"] | bool = "yes",
     if_exists: IfExists.Choice = "skip",
+    jobs: int = 1,
+    channel_jobs: int = 1,
+    locks: LockChoice = "file",
+    compression_level: int | None = None,
+    compression_threads: int = 1,
     log: str | None = None,
 ):
     """
@@ -76,10 +83,27 @@ def bidsify(
         Whether to write (only) sidecar JSON files
     if_exists : {"error", "skip", "overwrite", "different", "refresh"}
         Behaviour when a file already exists
+    jobs : int
+        Number of actions (e.g., file conversions) run in parallel
+    channel_jobs : int
+        Number of DWI channels decoded in parallel, within each
+        conversion
+    locks : {"file", "dataset", "none"}
+        Where locks that protect files being read or written are kept:
+        next to each file, in a single folder per dataset, or nowhere
+        (only safe if no other process works on the dataset)
+    compression_level : int
+        Gzip compression level of the volumes, from 0 (none) to 9
+        (best). Low levels are faster, e.g., for scratch builds
+        (default: 1).
+    compression_threads : int
+        Number of threads used to compress each volume
     log : str
         Path to log file
     """
     setup_filelog(log)
+    set_lock_manager(locks)
+    set_compression(compression_level, compression_threads)
 
     # Format keys
     if isinstance(keys, str):
@@ -111,4 +135,6 @@ def bidsify(
         exclude_subs=exclude_subs,
         json=json,
         ifexists=if_exists,
+        jobs=jobs,
+        channel_jobs=channel_jobs,
     ).run()
@@ -1,5 +1,6 @@
 from cyclopts import App
 from braindataprep.cli import app
+from braindataprep.manifest import manifest_commands
 
 ixi_help = """
 Commands related to the IXI dataset
@@ -12,3 +13,4 @@ Commands related to the IXI dataset
 """
 
 app.command(ixi := App(name="ixi", help=ixi_help))
+manifest_commands(ixi, 'IXI')
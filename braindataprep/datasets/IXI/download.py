@@ -37,6 +37,9 @@ def download(
     keys: Iterable[KeyChoice] = tuple(URLS.keys()),
     if_exists: IfExists.Choice = "skip",
     packet: int | str = naturalsize(CHUNK_SIZE),
+    jobs: int = 1,
+    segments: int = 1,
+    engine: Literal["requests", "async"] = "requests",
     log: str | None = None,
 ) -> None:
     """
@@ -52,6 +55,14 @@ def download(
         Behaviour if a file already exists
     packet : int
         Packet size to download, in bytes
+    jobs : int
+        Number of files to download in parallel
+    segments : int
+        Number of parallel connections used to download each file
+        (only used if the server accepts range requests)
+    engine : {"requests", "async"}
+        Download engine. With "async", all downloads share a single
+        event loop, which scales to many (`--jobs`) parallel downloads.
     log : str
         Path to log file
     """
@@ -61,12 +72,14 @@ def download(
     path: Path = Path(get_tree_path(path))
     src = path / 'IXI' / 'sourcedata'
     src.mkdir(parents=True, exist_ok=True)
-    DownloadManager(
+    DownloadManager((
         Downloader(
             url,  src / Path(urlparse(url).path).name,
             ifexists=if_exists,
             chunk_size=human2bytes(packet),
+            segments=segments,
+            engine=engine,
         )
         for key in keys
         for url in URLS[key]
-    ).run()
+    ), workers=jobs).run()
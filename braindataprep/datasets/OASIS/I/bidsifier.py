@@ -2,7 +2,6 @@ import tarfile
 import nibabel as nib
 import numpy as np
 import csv
-from tempfile import TemporaryDirectory
 from logging import getLogger
 from pathlib import Path, PosixPath
 from typing import Literal, Iterable, Iterator
@@ -10,10 +9,9 @@ from typing import Literal, Iterable, Iterator
 from braindataprep.freesurfer import bidsify as fs
 from braindataprep.utils.io import read_json
 from braindataprep.utils.io import write_tsv
-from braindataprep.utils.io import write_from_buffer
 from braindataprep.utils.io import nibabel_convert
 from braindataprep.utils.vol import make_affine
-from braindataprep.utils.vol import relabel as vol_relabel
+from braindataprep.utils.tar import TarIndex
 from braindataprep.pyout import bidsify_tab
 from braindataprep.pyout import Status
 from braindataprep.actions import IfExists
@@ -23,6 +21,8 @@ from braindataprep.actions import CopyJSON
 from braindataprep.actions import WriteBytes
 from braindataprep.actions import WriteJSON
 from braindataprep.actions import WrapAction
+from braindataprep.actions import Scheduler
+from braindataprep.actions import Barrier
 
 lg = getLogger(__name__)
 try:
@@ -61,6 +61,7 @@ class Bidsifier:
         exclude_subs: Iterable[int] = tuple(),
         json: Literal["yes", "no", "only"] | bool = True,
         ifexists: IfExists.Choice = "skip",
+        jobs: int = 1,
     ):
         self.root: Path = Path(root)
         self.keys: set[KeyChoice] = set(keys)
@@ -72,6 +73,7 @@ class Bidsifier:
             "no" if json is False else json
         )
         self.ifexists: IfExists.Choice = ifexists
+        self.jobs: int = jobs
 
     def init(self):
         """Prepare common stuff"""
@@ -83,6 +85,10 @@ class Bidsifier:
         self.drv = self.root / 'derivatives'
         self.drvproc = self.drv / 'oasis-processed'
         self.drvfs = self.drv / 'oasis-freesurfer'
+        # Dataset state (digest cache, provenance of outputs)
+        (self.root / '.bdp').mkdir(parents=True, exist_ok=True)
+        # Scheduler
+        self.scheduler = Scheduler(self.jobs)
         # Track errors
         self.nb_errors = 0
         self.nb_skipped = 0
@@ -139,6 +145,16 @@ class Bidsifier:
             self.nb_skipped += 1
             yield {'skipped': self.nb_skipped}
 
+    def run_actions(
+        self, actions: Iterable[Action | Status]
+    ) -> Iterator[Status]:
+        """Run a stream of actions (in parallel) and yield statuses"""
+        for action, status in self.scheduler.run(actions):
+            if action is None:
+                yield status
+            else:
+                yield from self.fixstatus(status, action.dst.name)
+
     def tar2nii(
         self,
         tar: tarfile.TarFile,       # Opened TAR archive
@@ -151,22 +167,22 @@ class Bidsifier:
         tarhdr = str(src.with_suffix('.hdr'))
 
         def img2nii(niipath):
-            with TemporaryDirectory() as tmp:
-                tmp = Path(tmp)
-                imgpath = tmp / 'tmp.img'
-                hdrpath = tmp / 'tmp.hdr'
-                write_from_buffer(tar.extractfile(tarimg), imgpath)
-                write_from_buffer(tar.extractfile(tarhdr), hdrpath)
-                nibabel_convert(imgpath, niipath, affine=affine,
-                                inp_format=nib.AnalyzeImage)
-            if relabel:
-                # Relabel FSL segmentation
-                volf = nib.load(niipath)
-                vold = np.asarray(volf.dataobj)
-                vold = vol_relabel(vold, {1: 2, 2: 3, 3: 1})
-                nib.save(type(volf)(vold, volf.affine, volf.header), dst)
-
-        return Action(Path(tar.name), dst, img2nii, input="path")
+            # Convert straight from the archive members, and relabel
+            # FSL segmentations on the fly
+            nibabel_convert(
+                {
+                    'header': tar.extractfile(tarhdr),
+                    'image': tar.extractfile(tarimg),
+                },
+                niipath,
+                affine=affine,
+                inp_format=nib.AnalyzeImage,
+                relabel={1: 2, 2: 3, 3: 1} if relabel else None,
+            )
+
+        return Action(
+            Path(tar.name), dst, img2nii, input="path", member=tarimg
+        )
 
     # ------------------------------------------------------------------
     #   Write metadata files
@@ -224,22 +240,27 @@ class Bidsifier:
             lg.warning(message)
             yield {'status': 'error', 'message': message}
             return
-        with tarfile.open(tarpath, 'r:gz') as tar:
-            yield from self._make_raw(disc, tar)
+        index = TarIndex(tarpath)
+        with index.open('r:gz') as tar:
+            yield from self._make_raw(disc, tar, index)
 
-    def _make_raw(self, disc: int, tar: tarfile.TarFile) -> Iterator[Status]:
+    def _make_raw(
+        self, disc: int, tar: tarfile.TarFile, index: TarIndex
+    ) -> Iterator[Status]:
         # 1. Find all subjects
         # 2. Iterate across subjects
         # 3. Iterate each subject's action
         # 4. Yield each action's statuses
         subjects = self._raw_get_subjects(tar)
-        yield {'progress': 0}
-        with IfExists(self.ifexists):
+
+        def iter_actions():
             for i, (id, runs) in enumerate(subjects.items()):
-                for action in self._raw_get_actions(disc, tar, id, runs):
-                    for status in action:
-                        yield from self.fixstatus(status, action.dst.name)
+                yield from self._raw_get_actions(disc, tar, index, id, runs)
                 yield {'progress': 100*(i+1)/len(subjects)}
+
+        yield {'progress': 0}
+        with IfExists(self.ifexists):
+            yield from self.run_actions(iter_actions())
         yield {'status': 'done', 'message': ''}
 
     def _raw_get_subjects(self, tar: tarfile.TarFile) -> dict[int, list[int]]:
@@ -271,6 +292,7 @@ class Bidsifier:
         self,
         disc: int,                  # disc number
         tar: tarfile.TarFile,       # opened TAR archive
+        index: TarIndex,            # index of the TAR archive
         id: int,                    # Subject ID
         runs: list[int],            # Runs available in subject
     ) -> Iterator[Action]:
@@ -324,9 +346,9 @@ class Bidsifier:
                       f'/PROCESSED/MPRAGE/SUBJ_111'
                       f'/OAS1_{id:04d}_MR1')
             member += '_mpr_{bias}_anon_sbj_111.img'
-            if member.format(bias='n4') in tar.getnames():
+            if member.format(bias='n4') in index:
                 bias = 'n4'
-            elif member.format(bias='n3') in tar.getnames():
+            elif member.format(bias='n3') in index:
                 bias = 'n3'
             else:
                 lg.error(f'Member not found: {member}')
@@ -373,9 +395,9 @@ class Bidsifier:
                       f'/PROCESSED/MPRAGE/T88_111'
                       f'/OAS1_{id:04d}_MR1')
             member += '_mpr_{bias}_anon_111_t88_gfc'
-            if member.format(bias='n4') in tar.getnames():
+            if member.format(bias='n4') in index:
                 bias = 'n4'
-            elif member.format(bias='n3') in tar.getnames():
+            elif member.format(bias='n3') in index:
                 bias = 'n3'
             else:
                 lg.error(f'Member not found: {member}')
@@ -441,9 +463,9 @@ class Bidsifier:
             member = (f'disc{disc}/OAS1_{id:04d}_MR1/FSL_SEG'
                       f'/OAS1_{id:04d}_MR1')
             member += '_mpr_{bias}_anon_111_t88_masked_gfc_fseg.img'
-            if member.format(bias='n4') in tar.getnames():
+            if member.format(bias='n4') in index:
                 bias = 'n4'
-            elif member.format(bias='n3') in tar.getnames():
+            elif member.format(bias='n3') in index:
                 bias = 'n3'
             else:
                 lg.error(f'Member not found: {member}')
@@ -488,7 +510,7 @@ class Bidsifier:
         if not tarpath.exists():
             lg.warning(f'oasis_cross-sectional_disc{disc}.tar.gz not found')
             return
-        with tarfile.open(tarpath, 'r:gz') as tar:
+        with TarIndex(tarpath).open('r:gz') as tar:
             yield from self._make_freesurfer(tar)
 
     def _make_freesurfer(self, tar: tarfile.TarFile) -> Iterator[dict]:
@@ -497,13 +519,15 @@ class Bidsifier:
         # 3. Iterate each subject's action
         # 4. Yield each action's statuses
         subjects = self._fs_get_subjects(tar)
-        yield {'progress': 0}
-        with IfExists(self.ifexists):
+
+        def iter_actions():
             for i, (id, members) in enumerate(subjects.items()):
-                for action in self._fs_get_actions(tar, id, members):
-                    for status in action:
-                        yield from self.fixstatus(status, action.dst.name)
+                yield from self._fs_get_actions(tar, id, members)
                 yield {'progress': 100*(i+1)/len(subjects)}
+
+        yield {'progress': 0}
+        with IfExists(self.ifexists):
+            yield from self.run_actions(iter_actions())
         yield {'status': 'done', 'message': ''}
 
     def _fs_get_subjects(self, tar: tarfile.TarFile):
@@ -539,7 +563,7 @@ class Bidsifier:
             tar: tarfile.TarFile,
             id: int,
             members: list[str],
-    ) -> Iterator[Action]:
+    ) -> Iterator[Action | Barrier]:
 
         # Unpack raw freesurfer outputs
         # under "derivatives/oasis-freesurfer/sourcedata/sub-{04d}"
@@ -551,8 +575,13 @@ class Bidsifier:
                 tar.extractfile(str(path)),
                 dst,
                 src=tar.name,
+                member=str(path),
             )
 
+        # `fs.bidsify` only yields actions for files that exist, so all
+        # files must be unpacked before it is called.
+        yield Barrier()
+
         # Bidsify under "derivatives/oasis-freesurfer/sub-{04d}"
         src = self.drvfs / 'sourcedata' / f'sub-{id:04d}'
         dst = self.drvfs / f'sub-{id:04d}'
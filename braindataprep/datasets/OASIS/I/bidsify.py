@@ -64,6 +64,8 @@ from typing import Literal, Iterable
 from braindataprep.utils.log import setup_filelog
 from braindataprep.utils.path import get_tree_path
 from braindataprep.actions.action import IfExists
+from braindataprep.actions.locks import LockChoice, set_lock_manager
+from braindataprep.utils.compression import set_compression
 from braindataprep.datasets.OASIS.I.command import oasis1
 from braindataprep.datasets.OASIS.I.bidsifier import Bidsifier
 
@@ -82,6 +84,10 @@ def bidsify(
     exclude_subs: Iterable[int] | None = tuple(),
     json: Literal["yes", "no", "only"] | bool = "yes",
     if_exists: IfExists.Choice = "skip",
+    jobs: int = 1,
+    locks: LockChoice = "file",
+    compression_level: int | None = None,
+    compression_threads: int = 1,
     log: str | None = None,
 ):
     """
@@ -104,10 +110,24 @@ def bidsify(
         Whether to write (only) sidecar JSON files
     if_exists : {"error", "skip", "overwrite", "different", "refresh"}
         Behaviour when a file already exists
+    jobs : int
+        Number of actions (e.g., file conversions) run in parallel
+    locks : {"file", "dataset", "none"}
+        Where locks that protect files being read or written are kept:
+        next to each file, in a single folder per dataset, or nowhere
+        (only safe if no other process works on the dataset)
+    compression_level : int
+        Gzip compression level of the volumes, from 0 (none) to 9
+        (best). Low levels are faster, e.g., for scratch builds
+        (default: 1).
+    compression_threads : int
+        Number of threads used to compress each volume
     log : str
         Path to log file
     """
     setup_filelog(log)
+    set_lock_manager(locks)
+    set_compression(compression_level, compression_threads)
 
     # Format keys
     if isinstance(keys, str):
@@ -145,4 +165,5 @@ def bidsify(
         exclude_subs=exclude_subs,
         json=json,
         ifexists=if_exists,
+        jobs=jobs,
     ).run()
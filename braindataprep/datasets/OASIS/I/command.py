@@ -1,5 +1,6 @@
 from cyclopts import App
 from braindataprep.cli import app
+from braindataprep.manifest import manifest_commands
 
 oasis1_help = """
 Commands related to the OASIS-I dataset
@@ -14,3 +15,4 @@ Commands related to the OASIS-I dataset
 """
 
 app.command(oasis1 := App(name="oasis1", help=oasis1_help))
+manifest_commands(oasis1, 'OASIS-1')
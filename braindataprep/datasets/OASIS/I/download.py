@@ -47,6 +47,9 @@ def download(
     discs: Iterable[int] = tuple(range(1, 13)),
     if_exists: IfExists.Choice = "skip",
     packet: Union[int, str] = naturalsize(CHUNK_SIZE),
+    jobs: int = 1,
+    segments: int = 1,
+    engine: Literal["requests", "async"] = "requests",
     log: Optional[str] = None,
 ):
     """
@@ -71,6 +74,14 @@ def download(
         Behaviour if a file already exists
     packet : int
         Packet size to download, in bytes
+    jobs : int
+        Number of files to download in parallel
+    segments : int
+        Number of parallel connections used to download each file
+        (only used if the server accepts range requests)
+    engine : {"requests", "async"}
+        Download engine. With "async", all downloads share a single
+        event loop, which scales to many (`--jobs`) parallel downloads.
     log : str
         Path to log file
 
@@ -93,6 +104,8 @@ def download(
                     URL1,  src / Path(urlparse(URL1).path).name,
                     ifexists=if_exists,
                     chunk_size=human2bytes(packet),
+                    segments=segments,
+                    engine=engine,
                 ))
         else:
             if key == 'meta':
@@ -107,5 +120,7 @@ def download(
                 URL,  src / basename,
                 ifexists=if_exists,
                 chunk_size=human2bytes(packet),
+                segments=segments,
+                engine=engine,
             ))
-    DownloadManager(downloaders).run()
+    DownloadManager(downloaders, workers=jobs).run()
@@ -1,13 +1,12 @@
 import tarfile
 import nibabel as nib
-from tempfile import TemporaryDirectory
 from logging import getLogger
 from pathlib import Path, PosixPath
 from typing import Literal, Iterable, Iterator
 
 from braindataprep.utils.io import write_tsv
-from braindataprep.utils.io import write_from_buffer
 from braindataprep.utils.io import nibabel_convert
+from braindataprep.utils.tar import TarIndex
 from braindataprep.pyout import bidsify_tab
 from braindataprep.pyout import Status
 from braindataprep.actions import IfExists
@@ -16,6 +15,7 @@ from braindataprep.actions import CopyBytes
 from braindataprep.actions import CopyJSON
 from braindataprep.actions import WriteTSV
 from braindataprep.actions import WrapAction
+from braindataprep.actions import Scheduler
 
 lg = getLogger(__name__)
 try:
@@ -52,6 +52,7 @@ class Bidsifier:
         exclude_subs: Iterable[int] = tuple(),
         json: Literal["yes", "no", "only"] | bool = True,
         ifexists: IfExists.Choice = "skip",
+        jobs: int = 1,
     ):
         self.root: Path = Path(root)
         self.keys: set[KeyChoice] = set(keys)
@@ -63,6 +64,7 @@ class Bidsifier:
             "no" if json is False else json
         )
         self.ifexists: IfExists.Choice = ifexists
+        self.jobs: int = jobs
 
     def init(self):
         """Prepare common stuff"""
@@ -71,6 +73,10 @@ class Bidsifier:
         # Folder
         self.src = self.root / 'sourcedata'
         self.raw = self.root / 'rawdata'
+        # Dataset state (digest cache, provenance of outputs)
+        (self.root / '.bdp').mkdir(parents=True, exist_ok=True)
+        # Scheduler
+        self.scheduler = Scheduler(self.jobs)
         # Track errors
         self.nb_errors = 0
         self.nb_skipped = 0
@@ -116,6 +122,16 @@ class Bidsifier:
             self.nb_skipped += 1
             yield {'skipped': self.nb_skipped}
 
+    def run_actions(
+        self, actions: Iterable[Action | Status]
+    ) -> Iterator[Status]:
+        """Run a stream of actions (in parallel) and yield statuses"""
+        for action, status in self.scheduler.run(actions):
+            if action is None:
+                yield status
+            else:
+                yield from self.fixstatus(status, action.dst.name)
+
     def tar2nii(
         self,
         tar: tarfile.TarFile,       # Opened TAR archive
@@ -126,17 +142,19 @@ class Bidsifier:
         tarhdr = str(src.with_suffix('.hdr'))
 
         def img2nii(niipath):
-            with TemporaryDirectory() as tmp:
-                tmp = Path(tmp)
-                imgpath = tmp / 'tmp.img'
-                hdrpath = tmp / 'tmp.hdr'
-                # !!! we must unpack hdr before img
-                # (that's how they are ordered in the stream)
-                write_from_buffer(tar.extractfile(tarhdr), hdrpath)
-                write_from_buffer(tar.extractfile(tarimg), imgpath)
-                nibabel_convert(imgpath, niipath, inp_format=nib.AnalyzeImage)
-
-        return Action(Path(tar.name), dst, img2nii, input="path")
+            # Convert straight from the archive members
+            nibabel_convert(
+                {
+                    'header': tar.extractfile(tarhdr),
+                    'image': tar.extractfile(tarimg),
+                },
+                niipath,
+                inp_format=nib.AnalyzeImage,
+            )
+
+        return Action(
+            Path(tar.name), dst, img2nii, input="path", member=tarimg
+        )
 
     # ------------------------------------------------------------------
     #   Write metadata files
@@ -194,7 +212,7 @@ class Bidsifier:
             lg.warning(message)
             yield {'status': 'error', 'message': message}
             return
-        with tarfile.open(tarpath, 'r:gz') as tar:
+        with TarIndex(tarpath).open('r:gz') as tar:
             yield from self._make_raw(part, tar)
 
     def _make_raw(self, part: int, tar: tarfile.TarFile) -> Iterator[Status]:
@@ -220,19 +238,21 @@ class Bidsifier:
         # we can follow the gzip stream and be more efficient
         nscans = sum(map((lambda ses: sum(map(len, ses.values()))),
                          subjects.values()))
-        nscan = 0
-        yield {'progress': 0}
-        with IfExists(self.ifexists):
+
+        def iter_actions():
+            nscan = 0
             for member in tar:
                 membername = PosixPath(member.name)
                 if self._raw_skip_path(membername):
                     continue
                 nscan += 1
                 id, ses, run = self._raw_get_id(membername)
-                for action in self._raw_get_actions(part, tar, id, ses, run):
-                    for status in action:
-                        yield from self.fixstatus(status, action.dst.name)
+                yield from self._raw_get_actions(part, tar, id, ses, run)
                 yield {'progress': 100*nscan/nscans}
+
+        yield {'progress': 0}
+        with IfExists(self.ifexists):
+            yield from self.run_actions(iter_actions())
         yield {'status': 'done', 'message': ''}
 
     def _raw_get_id(self, path: PosixPath) -> tuple[int, int, int]:
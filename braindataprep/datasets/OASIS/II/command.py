@@ -1,5 +1,6 @@
 from cyclopts import App
 from braindataprep.cli import app
+from braindataprep.manifest import manifest_commands
 
 oasis2_help = """
 Commands related to the OASIS-II dataset
@@ -14,3 +15,4 @@ Commands related to the OASIS-II dataset
 """  # noqa: E501
 
 app.command(oasis2 := App(name="oasis2", help=oasis2_help))
+manifest_commands(oasis2, 'OASIS-2')
@@ -36,6 +36,9 @@ def download(
     parts: Iterable[int] = (1, 2),
     if_exists: IfExists.Choice = "skip",
     packet: int | str = naturalsize(CHUNK_SIZE),
+    jobs: int = 1,
+    segments: int = 1,
+    engine: Literal["requests", "async"] = "requests",
     log: str | None = None,
 ):
     """
@@ -60,6 +63,14 @@ def download(
         Behaviour if a file already exists
     packet : int
         Packet size to download, in bytes
+    jobs : int
+        Number of files to download in parallel
+    segments : int
+        Number of parallel connections used to download each file
+        (only used if the server accepts range requests)
+    engine : {"requests", "async"}
+        Download engine. With "async", all downloads share a single
+        event loop, which scales to many (`--jobs`) parallel downloads.
     log : str
         Path to log file
 
@@ -77,6 +88,8 @@ def download(
                 URL,  src / Path(urlparse(URL).path).name,
                 ifexists=if_exists,
                 chunk_size=human2bytes(packet),
+                segments=segments,
+                engine=engine,
             ))
     if 'meta' in keys:
         URL = URLS['meta'][0]
@@ -85,5 +98,7 @@ def download(
             URL,  src / basename,
             ifexists=if_exists,
             chunk_size=human2bytes(packet),
+            segments=segments,
+            engine=engine,
         ))
-    DownloadManager(downloaders).run()
+    DownloadManager(downloaders, workers=jobs).run()
@@ -1,3 +1,4 @@
 from .command import oasis3 as _oasis3          # noqa: F401
 from .download import download as _download     # noqa: F401
 from .bidsify import bidsify as _bidsify        # noqa: F401
+from .sync import sync as _sync                 # noqa: F401
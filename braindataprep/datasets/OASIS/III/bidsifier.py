@@ -1,4 +1,5 @@
 import tarfile
+from contextlib import ExitStack
 from logging import getLogger
 from pathlib import Path, PosixPath
 from typing import Iterable, Iterator, Literal
@@ -7,6 +8,7 @@ from braindataprep.pyout import bidsify_tab
 from braindataprep.pyout import Status
 from braindataprep.utils.io import read_json
 from braindataprep.utils.io import write_from_buffer
+from braindataprep.utils.tar import TarIndex
 from braindataprep.freesurfer import bidsify as fs
 from braindataprep.actions import IfExists
 from braindataprep.actions import Action
@@ -14,6 +16,13 @@ from braindataprep.actions import WriteJSON
 from braindataprep.actions import WriteBytes
 from braindataprep.actions import CopyJSON
 from braindataprep.actions import CopyBytes
+from braindataprep.actions import Scheduler
+from braindataprep.actions import Barrier
+from braindataprep.actions.state import record_provenance
+from braindataprep.download import Downloader
+from braindataprep.download import IncompleteFile
+from braindataprep.download import RemoteFile
+from braindataprep.download import RemoteStream
 from braindataprep.datasets.OASIS.III.keys import allleaves
 from braindataprep.datasets.OASIS.III.keys import compat_keys
 from braindataprep.datasets.OASIS.III.keys import lower_keys
@@ -44,6 +53,7 @@ class Bidsifier:
         exclude_subs: Iterable[int] = tuple(),
         json: Literal["yes", "no", "only"] | bool = True,
         ifexists: IfExists.Choice = "skip",
+        jobs: int = 1,
     ):
         self.root: Path = Path(root)
         self.keys: set[str] = set(keys)
@@ -55,6 +65,7 @@ class Bidsifier:
             "no" if json is False else json
         )
         self.ifexists: IfExists.Choice = ifexists
+        self.jobs: int = jobs
 
     def init(self):
         """Prepare common stuff"""
@@ -66,6 +77,10 @@ class Bidsifier:
         self.pheno = self.root / 'phenotypes'
         self.drv = self.root / 'derivatives'
         self.dfs = self.drv / 'oasis-freesurfer'
+        # Dataset state (digest cache, provenance of outputs)
+        (self.root / '.bdp').mkdir(parents=True, exist_ok=True)
+        # Scheduler
+        self.scheduler = Scheduler(self.jobs)
         # Track errors
         self.nb_errors = 0
         self.nb_skipped = 0
@@ -95,22 +110,14 @@ class Bidsifier:
             self.out(status)
 
         # Raw and lightly processed data are stored in the same archive
-        rawkeys = (allleaves - lower_keys('derivatives')) - lower_keys('meta')
-        for key in rawkeys:
-            if not (compat_keys(key) & self.keys):
-                continue
-            if ({key} & self.exclude_keys):
-                continue
+        for key in self.raw_keys():
             self.nb_errors = self.nb_skipped = 0
             for status in self.make_raw(key):
                 status.setdefault('modality', key)
                 self.out(status)
 
         # Freesurfer outputs are stored in their own archive
-        do_fs = bool(compat_keys('fs') & self.keys)
-        do_fs |= bool(compat_keys('fs-all') & self.keys)
-        do_fs &= not bool({'fs', 'fs-all'} & self.exclude_keys)
-        if do_fs:
+        if self.do_freesurfer():
             self.nb_errors = self.nb_skipped = 0
             for status in self.make_freesurfer():
                 status.setdefault('modality', 'fs')
@@ -121,6 +128,22 @@ class Bidsifier:
     # ------------------------------------------------------------------
     #   Helpers
     # ------------------------------------------------------------------
+    def raw_keys(self) -> list[str]:
+        """Selected keys that map to raw (or lightly processed) data"""
+        rawkeys = (allleaves - lower_keys('derivatives')) - lower_keys('meta')
+        return [
+            key for key in rawkeys
+            if (compat_keys(key) & self.keys)
+            and not ({key} & self.exclude_keys)
+        ]
+
+    def do_freesurfer(self) -> bool:
+        """Whether freesurfer derivatives are selected"""
+        do_fs = bool(compat_keys('fs') & self.keys)
+        do_fs |= bool(compat_keys('fs-all') & self.keys)
+        do_fs &= not bool({'fs', 'fs-all'} & self.exclude_keys)
+        return do_fs
+
     def fixstatus(self, status: Status, fname: str | Path) -> Iterator[Status]:
         status.setdefault('path', fname)
         yield status
@@ -131,6 +154,16 @@ class Bidsifier:
             self.nb_skipped += 1
             yield {'skipped': self.nb_skipped}
 
+    def run_actions(
+        self, actions: Iterable[Action | Status]
+    ) -> Iterator[Status]:
+        """Run a stream of actions (in parallel) and yield statuses"""
+        for action, status in self.scheduler.run(actions):
+            if action is None:
+                yield status
+            else:
+                yield from self.fixstatus(status, action.dst.name)
+
     # ------------------------------------------------------------------
     #   Write metadata files
     # ------------------------------------------------------------------
@@ -209,8 +242,14 @@ class Bidsifier:
     # ------------------------------------------------------------------
     #   Write rawdata
     # ------------------------------------------------------------------
-    def make_raw(self, key):
+    def categories(self, key):
+        """
+        Return the OASIS and BIDS categories that correspond to a key.
 
+        Returns
+        -------
+        cat, subcat, bidscat, bidsmod, bidsacq : str
+        """
         # cat:      OASIS category    -- in folder: OAS3{id}_{cat}_{ses}/
         # subcat:   OASIS subcategory -- in filename: {subcat}{n}.nii.gz
         # bidscat:  BIDS category     -- in folder: {bidscat}/
@@ -257,16 +296,21 @@ class Bidsifier:
             bidscat = 'ct'
         else:
             assert False, f"{key} not an MR/PET/CT"
+        return cat, subcat, bidscat, bidsmod, bidsacq
+
+    def make_raw(self, key):
+        cat, subcat, bidscat, bidsmod, bidsacq = self.categories(key)
+
+        def iter_actions():
+            for i, id in enumerate(self.subs):
+                yield from self._make_raw(
+                    cat, subcat, bidscat, bidsmod, bidsacq, id
+                )
+                yield {'progress': 100*(i+1)/len(self.subs)}
 
         # Run actions
         yield {'progress': 0}
-        for i, id in enumerate(self.subs):
-            for action in self._make_raw(
-                cat, subcat, bidscat, bidsmod, bidsacq, id
-            ):
-                for status in action:
-                    yield from self.fixstatus(status, action.dst.name)
-            yield {'progress': 100*(i+1)/len(self.subs)}
+        yield from self.run_actions(iter_actions())
         yield {'status': 'done', 'message': ''}
 
     def _make_raw(self, cat, subcat, bidscat, bidsmod, bidsacq, id):
@@ -274,10 +318,13 @@ class Bidsifier:
         paths = self.src.glob(f'OAS3{id:04d}_{cat}_*/{subcat}*.tar.gz')
         for path in paths:
             try:
-                with tarfile.open(path, 'r:gz') as tar:
+                with TarIndex(path).open('r:gz') as tar:
                     yield from self._make_raw_scan(
                         tar, bidscat, bidsmod, bidsacq, id
                     )
+                    # Wait for all tar-reading actions to complete
+                    # before the archive gets closed
+                    yield Barrier()
             except Exception as e:
                 lg.error(f"{path}: {e}")
 
@@ -288,30 +335,41 @@ class Bidsifier:
         if bidsacq and not any(f'_acq-{bidsacq}_' in x for x in members):
             return
         for member in tar.getmembers():
-            membername = PosixPath(member.name)
-            flags = membername.name.split('_')
-            for flag in flags:
-                flag = flag.split('-')
-                if flag[0] in ('ses', 'sess'):
-                    ses = flag[1]
-                    break
-            dst = self.raw / f'sub-{id:04d}' / f'ses-{ses}' / bidscat
-            mname = self.fix_name(membername.name, id)
-            if (
-                (mname.endswith('.json') and self.json != 'no')
-                or
-                (mname.endswith('.nii.gz') and self.json != 'only')
-            ):
+            dst = self.raw_path(member.name, id, bidscat)
+            if dst:
                 yield Action(
-                    tar.name, dst / mname,
-                    lambda f:
-                        write_from_buffer(tar.extractfile(member), f)
+                    tar.name, dst,
+                    lambda f, member=member:
+                        write_from_buffer(tar.extractfile(member), f),
+                    member=member.name,
                 )
 
+    def raw_path(self, name, id, bidscat) -> Path | None:
+        """
+        Return the BIDS path of an archive member, or None if the
+        member should not be written.
+        """
+        name = PosixPath(name).name
+        flags = name.split('_')
+        for flag in flags:
+            flag = flag.split('-')
+            if flag[0] in ('ses', 'sess'):
+                ses = flag[1]
+                break
+        dst = self.raw / f'sub-{id:04d}' / f'ses-{ses}' / bidscat
+        mname = self.fix_name(name, id)
+        if (
+            (mname.endswith('.json') and self.json != 'no')
+            or
+            (mname.endswith('.nii.gz') and self.json != 'only')
+        ):
+            return dst / mname
+        return None
+
     def fix_name(self, name, id):
         substitutions = {
             'sess-': 'ses-',
-            'sub-OAS3{id:04d}': f'sub-{id:04d}',
+            f'sub-OAS3{id:04d}': f'sub-{id:04d}',
             'task-restingstateMB4': 'task-restingstate_acq-MB4',
         }
         for old, new in substitutions.items():
@@ -322,13 +380,14 @@ class Bidsifier:
     #   Write freesurfer
     # ------------------------------------------------------------------
     def make_freesurfer(self):
+        def iter_actions():
+            for i, id in enumerate(self.subs):
+                yield from self._make_freesurfer(id)
+                yield {'progress': 100*(i+1)/len(self.subs)}
+
         # Run actions
         yield {'progress': 0}
-        for i, id in enumerate(self.subs):
-            for action in self._make_freesurfer(id):
-                for status in action:
-                    yield from self.fixstatus(status, action.dst.name)
-                yield {'progress': 100*(i+1)/len(self.subs)}
+        yield from self.run_actions(iter_actions())
         yield {'progress': 100}
         yield {'status': 'done', 'message': ''}
 
@@ -337,26 +396,237 @@ class Bidsifier:
         paths = self.src.glob(f'OAS3{id:04d}_MR_*/*Freesurfer*.tar.gz')
         for path in paths:
             ses = path.name.split('.')[0].split('_')[-1]
+            with TarIndex(path).open('r:gz') as tar:
+                yield from self._make_freesurfer_tar(tar, id, ses, src=path)
+
+    def _make_freesurfer_tar(self, tar, id, ses, src=tuple(), mtime=None):
+        """
+        Process one freesurfer archive.
+
+        Members are visited in order, so that `tar` may be a stream
+        (mode `'r|gz'`), as long as each action is run before the next
+        one is generated.
+
+        A `Barrier` separates the unpacking and bidsifying actions.
+        """
+        # Unpack raw freesurfer outputs
+        # under "derivatives/oasis-freesurfer/sourcedata/sub-{04d}/ses-{}"
+        for member in tar:
+            if not member.isfile():
+                continue
+            tarpath = PosixPath(member.name)
+            if 'fs-all' not in self.keys:
+                if not str(tarpath).endswith(fs.bidsifiable_outputs):
+                    continue
+            dst = self.dfs/'sourcedata'/f'sub-{id:04d}'/f'ses-{ses}'
+            dst = dst.joinpath(*tarpath.parts[6:])
+            yield WriteBytes(
+                tar.extractfile(member),
+                dst,
+                src=src,
+                mtime=mtime,
+                member=member.name,
+            )
+
+        # `fs.bidsify` only yields actions for files that exist, so all
+        # files must be unpacked before it is called.
+        yield Barrier()
+
+        # Bidsify under "derivatives/oasis-freesurfer/sub-{04d}/ses-{}"
+        src = self.dfs / 'sourcedata' / f'sub-{id:04d}' / f'ses-{ses}'
+        dst = self.dfs / f'sub-{id:04d}' / f'ses-{ses}'
+        srcbase = f'bids:raw:sub-{id:04d}/anat/sub-{id:04d}/ses-{ses}/'
+        sourcefiles = [srcbase + f'sub-{id:04d}_ses-{ses}_T1w.nii.gz']
+        yield from fs.bidsify(src, dst, sourcefiles, json=self.json)
+
+    # ------------------------------------------------------------------
+    #   Bidsify archives while they are downloaded
+    # ------------------------------------------------------------------
+    def sync(
+        self,
+        downloaders: Iterable[Downloader],
+        keep_sourcedata: bool = False,
+    ):
+        """Run all actions, streaming archives from the server"""
+        self.init()
+        with self.out as self.out:
+            self._sync(downloaders, keep_sourcedata)
 
-            # Unpack raw freesurfer outputs
-            # under "derivatives/oasis-freesurfer/sourcedata/sub-{04d}/ses-{}"
-            with tarfile.open(str(path), 'r:gz') as tar:
-                for member in tar.getmembers():
-                    tarpath = PosixPath(member.name)
-                    if 'fs-all' not in self.keys:
-                        if not str(tarpath).endswith(fs.bidsifiable_outputs):
+    def _sync(
+        self,
+        downloaders: Iterable[Downloader],
+        keep_sourcedata: bool = False,
+    ):
+        """Must be run from inside the `out` context."""
+        # Metadata
+        self.nb_errors = self.nb_skipped = 0
+        for status in self.make_meta():
+            status.setdefault('modality', 'meta')
+            self.out(status)
+
+        # Archives
+        for downloader in downloaders:
+            path = Path(downloader.dst)
+            modality = path.parent.name + '/' + path.name.split('.')[0]
+            self.nb_errors = self.nb_skipped = 0
+            for status in self.make_from_download(
+                downloader, keep_sourcedata
+            ):
+                status.setdefault('modality', modality)
+                self.out(status)
+
+    def make_from_download(
+        self,
+        downloader: Downloader,
+        keep_sourcedata: bool = False,
+    ) -> Iterator[Status]:
+        """
+        Bidsify an archive while it is being downloaded.
+
+        The HTTP response is piped through a streaming tar reader, and
+        each member is written directly into the BIDS tree. The archive
+        itself is only saved (under `sourcedata`) if `keep_sourcedata`.
+        If it already exists locally, it is read from disk instead.
+
+        Parameters
+        ----------
+        downloader : Downloader
+            Downloader of an OASIS-3 archive
+        keep_sourcedata : bool
+            Keep a copy of the archive under `sourcedata`
+
+        Yields
+        ------
+        status : Status
+        """
+        path = Path(downloader.dst)
+        experiment, name = path.parent.name, path.name.split('.')[0]
+
+        # Metadata archives are not bidsified
+        if not experiment.startswith('OAS3'):
+            if keep_sourcedata:
+                for status in downloader:
+                    yield from self.fixstatus(status, path.name)
+            return
+
+        # Select actions
+        id = int(experiment.split('_')[0][4:])
+        if 'Freesurfer' in name:
+            if not self.do_freesurfer():
+                return
+            ses = name.split('_')[-1]
+
+            def make_actions(tar, **kwargs):
+                return self._make_freesurfer_tar(tar, id, ses, **kwargs)
+
+        else:
+            cat = experiment.split('_')[1]
+            categories = []
+            for key in self.raw_keys():
+                category = self.categories(key)
+                if category[0] == cat and name.startswith(category[1]):
+                    categories.append(category)
+            if not categories:
+                return
+
+            def make_actions(tar, **kwargs):
+                return self._make_raw_stream(tar, categories, id, **kwargs)
+
+        # Run actions
+        yield {'progress': 0}
+        tee = None
+        try:
+            with ExitStack() as stack:
+                if path.exists():
+                    src, mtime = path, None
+                    fileobj = stack.enter_context(path.open('rb'))
+                    size = path.stat().st_size
+                else:
+                    src = tuple()
+                    remote = stack.enter_context(RemoteFile(
+                        downloader.src,
+                        downloader.session,
+                        downloader.auth,
+                        chunk_size=downloader.chunk_size,
+                    ))
+                    mtime = downloader.mtime or remote.mtime
+                    size = downloader.size or remote.size
+                    if keep_sourcedata:
+                        if downloader.digests:
+                            checkalgo = next(iter(downloader.digests))
+                        else:
+                            checkalgo = None
+                        tee = stack.enter_context(
+                            IncompleteFile(path, checkalgo=checkalgo)
+                        )
+                    fileobj = RemoteStream(remote, tee=tee)
+
+                with tarfile.open(fileobj=fileobj, mode='r|gz') as tar:
+                    for action in make_actions(tar, src=src, mtime=mtime):
+                        if isinstance(action, Barrier):
+                            # actions are run sequentially
                             continue
-                    dst = self.dfs/'sourcedata'/f'sub-{id:04d}'/f'ses-{ses}'
-                    dst = dst.joinpath(*tarpath.parts[6:])
+                        for status in action:
+                            yield from self.fixstatus(status, action.dst.name)
+                        if not src and status.get('status') == 'done':
+                            # streamed archive: its source is the URL
+                            record_provenance(
+                                action.dst, downloader.src, action.member
+                            )
+                        if size:
+                            yield {'progress': 100*fileobj.tell()/size}
+
+                # Make sure that the saved archive is complete
+                if tee is not None:
+                    fileobj.drain()
+
+            # Check digest and set mtime of the saved archive
+            if not src and keep_sourcedata:
+                checksum = None
+                if checkalgo:
+                    checksum = downloader.digests[checkalgo]
+                if mtime is not None:
+                    downloader.mtime = mtime
+                for status in downloader._finalize(
+                    checksum, checkalgo, tee.digest
+                ):
+                    if status.get('status', '') != 'done':
+                        yield from self.fixstatus(status, path.name)
+
+        except Exception as e:
+            lg.error(f"{path}: {e}")
+            yield {'status': 'error', 'message': str(e)}
+            return
+
+        yield {'progress': 100}
+        yield {'status': 'done', 'message': ''}
+
+    def _make_raw_stream(self, tar, categories, id, src=tuple(), mtime=None):
+        """
+        Process one raw archive, member by member.
+
+        Contrary to `_make_raw_scan`, the archive is not indexed
+        beforehand, so that `tar` may be a stream (mode `'r|gz'`).
+        Members are matched against the modality (and acquisition) of
+        each category.
+        """
+        for member in tar:
+            if not member.isfile():
+                continue
+            name = PosixPath(member.name).name
+            stem = name.split('.')[0]
+            for _, _, bidscat, bidsmod, bidsacq in categories:
+                if not stem.endswith(f'_{bidsmod}'):
+                    continue
+                if bidsacq and f'_acq-{bidsacq}_' not in name:
+                    continue
+                dst = self.raw_path(name, id, bidscat)
+                if dst:
                     yield WriteBytes(
                         tar.extractfile(member),
                         dst,
-                        src=tar.name,
+                        src=src,
+                        mtime=mtime,
+                        member=member.name,
                     )
-
-            # Bidsify under "derivatives/oasis-freesurfer/sub-{04d}/ses-{}"
-            src = self.dfs / 'sourcedata' / f'sub-{id:04d}' / f'ses-{ses}'
-            dst = self.dfs / f'sub-{id:04d}' / f'ses-{ses}'
-            srcbase = f'bids:raw:sub-{id:04d}/anat/sub-{id:04d}/ses-{ses}/'
-            sourcefiles = [srcbase + 'sub-{id:04d}_ses-{ses}_T1w.nii.gz']
-            yield from fs.bidsify(src, dst, sourcefiles, json=self.json)
+                break
@@ -1,5 +1,6 @@
 from cyclopts import App
 from braindataprep.cli import app
+from braindataprep.manifest import manifest_commands
 
 oasis3_help = """
 Commands related to the OASIS-III dataset
@@ -18,3 +19,4 @@ Commands related to the OASIS-III dataset
 """  # noqa: E501
 
 app.command(oasis3 := App(name="oasis3", help=oasis3_help))
+manifest_commands(oasis3, 'OASIS-3')
@@ -1,14 +1,19 @@
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 from pathlib import Path
-from typing import Iterable
+from typing import Iterable, Iterator, Literal
 from humanize import naturalsize
 
 from braindataprep.utils.ui import human2bytes
 from braindataprep.utils.path import get_tree_path
+from braindataprep.utils.path import get_cache_path
 from braindataprep.utils.log import setup_filelog
 from braindataprep.download import DownloadManager
 from braindataprep.download import IfExists
 from braindataprep.download import CHUNK_SIZE
+from braindataprep.download import Downloader
 from braindataprep.xnat import XNAT
+from braindataprep.xnat import ListingCache
+from braindataprep.xnat import filter_list
 from braindataprep.datasets.OASIS.III.command import oasis3
 from braindataprep.datasets.OASIS.III.keys import allkeys
 from braindataprep.datasets.OASIS.III.keys import flatten_keys
@@ -29,6 +34,13 @@ def download(
     user: str | None = None,
     password: str | None = None,
     packet: int | str = naturalsize(CHUNK_SIZE),
+    jobs: int = 1,
+    engine: Literal["requests", "async"] = "requests",
+    refresh_index: bool = False,
+    index_ttl: float = 7.0,
+    crawl_jobs: int = 4,
+    crawl_delay: float = 0,
+    bulk_index: bool = False,
     log: str | None = None,
 ):
     """
@@ -83,6 +95,22 @@ def download(
         NITRC password
     packet : int
         Packet size to download, in bytes
+    jobs : int
+        Number of files to download in parallel
+    engine : {"requests", "async"}
+        Download engine. With "async", all downloads share a single
+        event loop, which scales to many (`--jobs`) parallel downloads.
+    refresh_index : bool
+        Revalidate all cached XNAT listings
+    index_ttl : float
+        Number of days during which cached XNAT listings are trusted
+    crawl_jobs : int
+        Number of XNAT listing requests sent in parallel
+    crawl_delay : float
+        Minimum delay between two XNAT requests, in seconds
+    bulk_index : bool
+        List all experiments, scans and assessors of the project in a
+        few bulk requests, instead of one request per experiment
     log : str
         Path to log file
 
@@ -92,8 +120,69 @@ def download(
     keys = set(keys or flatten_keys(allkeys))
     src = path / 'OASIS-3' / 'sourcedata'
 
-    xnat = XNAT(user, password, open=True)
+    xnat = open_xnat(
+        path / 'OASIS-3', user, password,
+        index_ttl=index_ttl,
+        refresh_index=refresh_index,
+        crawl_jobs=crawl_jobs,
+        crawl_delay=crawl_delay,
+        bulk_index=bulk_index,
+    )
+    subs = get_subject_ids(xnat, subs, exclude_subs)
 
+    downloaders = iter_downloaders(
+        xnat, src, keys, subs,
+        crawl_jobs=crawl_jobs,
+        chunk_size=human2bytes(packet),
+        ifexists=if_exists,
+        engine=engine,
+    )
+
+    # Download all
+    DownloadManager(
+        downloaders, ifexists=if_exists, path='full', workers=jobs
+    ).run()
+    xnat.close()
+    xnat.cache.close()
+
+
+def open_xnat(
+    root: Path,
+    user: str | None = None,
+    password: str | None = None,
+    *,
+    index_ttl: float = 7.0,
+    refresh_index: bool = False,
+    crawl_jobs: int = 4,
+    crawl_delay: float = 0,
+    bulk_index: bool = False,
+) -> XNAT:
+    """
+    Open an XNAT session whose listings are cached under the
+    dataset root.
+    """
+    cache = ListingCache(
+        get_cache_path(root, 'xnat.sqlite'),
+        ttl=index_ttl * 24 * 60 * 60,
+        refresh=refresh_index,
+    )
+    return XNAT(
+        user, password, open=True, cache=cache,
+        jobs=crawl_jobs, delay=crawl_delay, bulk=bulk_index,
+    )
+
+
+def get_subject_ids(
+    xnat: XNAT,
+    subs: Iterable[int | str] | None = tuple(),
+    exclude_subs: Iterable[int] | None = tuple(),
+) -> set[int]:
+    """
+    Return the set of subject IDs to process.
+
+    `subs` may contain integer IDs, or paths to files that contain
+    one ID per line. If empty, all subjects are listed from XNAT.
+    """
     # Format subjects
     if isinstance(subs, (int, str)):
         subs = [subs]
@@ -118,10 +207,81 @@ def download(
             else:
                 subs.append(int(sub))
     subs = set(subs) - exclude_subs
+    return subs
+
+
+def iter_downloaders(
+    xnat: XNAT,
+    src: Path,
+    keys: set[str],
+    subs: Iterable[int],
+    *,
+    crawl_jobs: int = 4,
+    **opt
+) -> Iterator[Downloader]:
+    """
+    Crawl the OASIS-3 catalogue and yield the downloaders of all
+    archives that match `keys` and `subs`.
+
+    Listing requests (subject -> experiments -> scans/assessors) run in
+    a thread pool, and the downloaders of an experiment are yielded as
+    soon as it is resolved.
+    """
+    def keep_experiment(experiment):
+        # early filter on experiment type
+        experiment_type = experiment.split('_')[1]
+        if experiment_type == 'MR':
+            return bool(keys & compat_keys("mri"))
+        elif experiment_type == "CT":
+            return bool(keys & compat_keys("ct"))
+        elif experiment_type == "FDG":
+            return bool(keys & compat_keys("fdg"))
+        elif experiment_type == "PIB":
+            return bool(keys & compat_keys("pib"))
+        elif experiment_type == "AV45":
+            return bool(keys & compat_keys("av45"))
+        else:
+            return False
+
+    def experiment_downloaders(sub, experiment):
+        downloaders = []
+
+        scans = xnat.get_scans('OASIS3', f'OAS3{sub:04d}', experiment,
+                               return_info=True)
+        for scan in scans:
+            # filter on scan type (maybe not robust enough?)
+            keep_scan = bool(keys & compat_keys(scan['type']))
+            if not keep_scan:
+                continue
+            scan = scan['ID']
+            fname = src / experiment / f'{scan}.tar.gz'
+            downloaders.append(xnat.get_downloader(
+                'OASIS3', f'OAS3{sub:04d}', experiment, scan, fname,
+                **opt
+            ))
+
+        # derivatives
+
+        patterns = []
+        if keys & compat_keys("fs"):
+            patterns.append('*Freesurfer*')
+        if keys & compat_keys("pup"):
+            patterns.append('*PUPTIMECOURSE*')
+        if patterns:
+            assessors = xnat.get_assessors(
+                'OASIS3', f'OAS3{sub:04d}', experiment
+            )
+            for pattern in patterns:
+                for assessor in filter_list(assessors, pattern):
+                    fname = src / experiment / f'{assessor}.tar.gz'
+                    downloaders.append(xnat.get_downloader(
+                        'OASIS3', f'OAS3{sub:04d}', experiment, assessor,
+                        fname, type='assessor', **opt
+                    ))
+
+        return downloaders
 
-    # Accumulate downloaders
     def all_downloaders():
-        opt = dict(chunk_size=human2bytes(packet), ifexists=if_exists)
 
         # Get downloaders for metadata
         if (keys & compat_keys("meta")):
@@ -130,73 +290,41 @@ def download(
             )
 
         # Get downloaders for image data
-        for sub in subs:
-            experiments = xnat.get_experiments('OASIS3', f'OAS3{sub:04d}')
-            for experiment in experiments:
-
-                # early filter on experiment type
-                experiment_type = experiment.split('_')[1]
-                if experiment_type == 'MR':
-                    if not (keys & compat_keys("mri")):
-                        continue
-                elif experiment_type == "CT":
-                    if not (keys & compat_keys("ct")):
-                        continue
-                elif experiment_type == "FDG":
-                    if not (keys & compat_keys("fdg")):
-                        continue
-                elif experiment_type == "PIB":
-                    if not (keys & compat_keys("pib")):
-                        continue
-                elif experiment_type == "AV45":
-                    if not (keys & compat_keys("av45")):
-                        continue
-                else:
-                    continue
-
-                scans = xnat.get_scans('OASIS3', f'OAS3{sub:04d}', experiment,
-                                       return_info=True)
-                for scan in scans:
-                    # filter on scan type (maybe not robust enough?)
-                    keep_scan = bool(keys & compat_keys(scan['type']))
-                    if not keep_scan:
-                        continue
-                    scan = scan['ID']
-                    fname = src / experiment / f'{scan}.tar.gz'
-                    yield xnat.get_downloader(
-                        'OASIS3', f'OAS3{sub:04d}', experiment, scan, fname,
-                        **opt
-                    )
+        with ThreadPoolExecutor(max(1, crawl_jobs)) as pool:
+            futures = {}
 
-                # derivatives
+            # Subjects are submitted lazily, so that experiments of
+            # already resolved subjects are listed first.
+            todo = iter(sorted(subs))
 
-                if keys & compat_keys("fs"):
-                    assessors = xnat.get_all_assessors(
-                        'OASIS3', f'OAS3{sub:04d}', experiment, '*Freesurfer*'
+            def submit_subject():
+                for sub in todo:
+                    future = pool.submit(
+                        xnat.get_experiments, 'OASIS3', f'OAS3{sub:04d}'
                     )
-                    for assessor in assessors:
-                        assessor = assessor.split('/')[-1]
-                        fname = src / experiment / f'{assessor}.tar.gz'
-
-                        yield xnat.get_downloader(
-                            'OASIS3', f'OAS3{sub:04d}', experiment, assessor,
-                            fname, type='assessor', **opt
-                        )
-
-                if keys & compat_keys("pup"):
-                    assessors = xnat.get_all_assessors(
-                        'OASIS3', f'OAS3{sub:04d}', experiment,
-                        '*PUPTIMECOURSE*'
-                    )
-                    for assessor in assessors:
-                        assessor = assessor.split('/')[-1]
-                        fname = src / experiment / f'{assessor}.tar.gz'
+                    futures[future] = ('subject', sub)
+                    return
 
-                        yield xnat.get_downloader(
-                            'OASIS3', f'OAS3{sub:04d}', experiment, assessor,
-                            fname, type='assessor', **opt
-                        )
+            for _ in range(max(1, crawl_jobs)):
+                submit_subject()
 
-    # Download all
-    DownloadManager(all_downloaders(), ifexists=if_exists, path='full').run()
-    xnat.close()
+            try:
+                while futures:
+                    done, _ = wait(futures, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        kind, sub = futures.pop(future)
+                        if kind == 'subject':
+                            for experiment in future.result():
+                                if not keep_experiment(experiment):
+                                    continue
+                                futures[pool.submit(
+                                    experiment_downloaders, sub, experiment
+                                )] = ('experiment', sub)
+                            submit_subject()
+                        else:
+                            yield from future.result()
+            finally:
+                for future in futures:
+                    future.cancel()
+
+    yield from all_downloaders()
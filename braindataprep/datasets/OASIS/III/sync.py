@@ -0,0 +1,175 @@
+from pathlib import Path
+from typing import Iterable, Literal
+from humanize import naturalsize
+
+from braindataprep.utils.ui import human2bytes
+from braindataprep.utils.path import get_tree_path
+from braindataprep.utils.log import setup_filelog
+from braindataprep.download import CHUNK_SIZE
+from braindataprep.actions import IfExists
+from braindataprep.datasets.OASIS.III.command import oasis3
+from braindataprep.datasets.OASIS.III.bidsifier import Bidsifier
+from braindataprep.datasets.OASIS.III.download import open_xnat
+from braindataprep.datasets.OASIS.III.download import get_subject_ids
+from braindataprep.datasets.OASIS.III.download import iter_downloaders
+from braindataprep.datasets.OASIS.III.keys import allleaves
+from braindataprep.datasets.OASIS.III.keys import lower_keys
+
+from logging import getLogger
+lg = getLogger(__name__)
+
+
+DATASET = 'OASIS-3'
+
+
+@oasis3.command
+def sync(
+    path: str | Path | None = None,
+    *,
+    keys: Iterable[str] = tuple(),
+    exclude_keys: Iterable[str] | None = tuple(),
+    subs: Iterable[int] | None = tuple(),
+    exclude_subs: Iterable[int] | None = tuple(),
+    json: Literal["yes", "no", "only"] | bool = "yes",
+    if_exists: IfExists.Choice = "skip",
+    keep_sourcedata: bool = False,
+    user: str | None = None,
+    password: str | None = None,
+    packet: int | str = naturalsize(CHUNK_SIZE),
+    refresh_index: bool = False,
+    index_ttl: float = 7.0,
+    crawl_jobs: int = 4,
+    crawl_delay: float = 0,
+    bulk_index: bool = False,
+    log: str | None = None,
+):
+    """
+    Download and bidsify the OASIS-III dataset in a single pass.
+
+    Each archive is streamed from the server and its members are
+    written directly into the BIDS tree, so that intermediate
+    tarballs are never stored (unless `--keep-sourcedata`).
+    Archives that already exist under `sourcedata` are read from disk.
+
+    **Hierarchy of keys:**
+
+    * raw :              All the raw imaging data
+        * mri :           All the MRI data
+            * anat :       All the anatomical MRI data
+                * T1w :     T1-weighted MRI scans
+                * T2w :     T2-weighted MRI scans
+                * TSE :     Turbo Spin Echo MRI scans
+                * FLAIR :   Fluid-inversion Recovery MRI scans
+                * T2star :  T2-star quantitative scans
+                * angio :   MR angiography scans
+                * swi :     All susceptibility-weighted MRI data
+            * func :       All fthe functional MRI data
+                * pasl :    Pulsed arterial spin labeling
+                * asl :     Arterial spin labelling
+                * bold :    Blood-oxygenation level dependant (fMRI) scans
+            * fmap :       All field maps
+            * dwi :        All diffusion-weighted MRI data
+        * pet :           All the PET data
+            * fdg :        Fludeoxyglucose
+            * pib :        Pittsburgh Compound B (amyloid)
+            * av45 :       18F Florpiramine (tau)
+            * av1451 :     18F Flortaucipir (tau)
+        * ct              All the CT data
+    * derivatives :      All derivatives
+        * fs :            Freesurfer derivatives
+        * fs-all :        Freesurfer derivatives (even non bidsifiable ones)
+        * pup :           PET derivatives
+    * meta :             All metadata
+        * pheno :         Phenotypes
+
+    Parameters
+    ----------
+    path : str
+        Path to root of all datasets. An `OASIS-3` folder will be created.
+    keys : [list of] str
+        Only bidsify these keys (all if empty)
+    exclude_keys : [list of] str
+        Do not bidsify these keys
+    subs : [list of] int
+        Only bidsify these subjects (all if empty)
+    exclude_subs : [list of] int
+        Do not bidsify these subjects
+    json : {"yes", "no", "only"} | bool
+        Whether to write (only) sidecar JSON files
+    if_exists : {"error", "skip", "overwrite", "different", "refresh"}
+        Behaviour when a file already exists
+    keep_sourcedata : bool
+        Also save the downloaded archives under `sourcedata`
+    user : str
+        NITRC username
+    password : str
+        NITRC password
+    packet : int
+        Packet size to download, in bytes
+    refresh_index : bool
+        Revalidate all cached XNAT listings
+    index_ttl : float
+        Number of days during which cached XNAT listings are trusted
+    crawl_jobs : int
+        Number of XNAT listing requests sent in parallel
+    crawl_delay : float
+        Minimum delay between two XNAT requests, in seconds
+    bulk_index : bool
+        List all experiments, scans and assessors of the project in a
+        few bulk requests, instead of one request per experiment
+    log : str
+        Path to log file
+    """
+    setup_filelog(log)
+
+    # Format keys
+    if isinstance(keys, str):
+        keys = [keys]
+    keys = set(keys or allleaves)
+
+    if isinstance(exclude_keys, str):
+        exclude_keys = [exclude_keys]
+    exclude_keys = set(exclude_keys)
+
+    # Format json
+    if isinstance(json, bool):
+        json = 'yes' if json else 'no'
+    json = json.lower()
+
+    # Get root
+    root = get_tree_path(path) / DATASET
+
+    # Metadata archives are not bidsified, so they are only
+    # downloaded if sourcedata must be kept.
+    dlkeys = set(keys)
+    if not keep_sourcedata:
+        dlkeys -= lower_keys('meta')
+
+    xnat = open_xnat(
+        root, user, password,
+        index_ttl=index_ttl,
+        refresh_index=refresh_index,
+        crawl_jobs=crawl_jobs,
+        crawl_delay=crawl_delay,
+        bulk_index=bulk_index,
+    )
+    subs = get_subject_ids(xnat, subs, exclude_subs)
+
+    downloaders = iter_downloaders(
+        xnat, root / 'sourcedata', dlkeys, subs,
+        crawl_jobs=crawl_jobs,
+        chunk_size=human2bytes(packet),
+        ifexists=if_exists,
+    )
+
+    # Download and bidsify
+    Bidsifier(
+        root,
+        keys=keys,
+        exclude_keys=exclude_keys,
+        subs=subs,
+        json=json,
+        ifexists=if_exists,
+    ).sync(downloaders, keep_sourcedata)
+    xnat.close()
+    xnat.cache.close()
@@ -1,7 +1,16 @@
 # Adapted from `dandi.support.digest`
 # Apache License Version 2.0
+import ctypes
+import ctypes.util
 import hashlib
-from typing import List, Mapping, Literal
+import os
+import sqlite3
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from itertools import count
+from pathlib import Path
+from typing import BinaryIO, Iterable, Iterator, List, Mapping, Literal
 from enum import IntEnum
 from logging import getLogger
 
@@ -41,24 +50,221 @@ def sort_digests(digests, priority=DigestPriority):
     return digests
 
 
+class DigestCache:
+    """
+    On-disk (SQLite) cache of file digests.
+
+    Records are keyed by (path, algorithm) and store the size, mtime
+    and inode of the file when it was hashed. A record is only used if
+    the file still has the same stat tuple, so that files are only
+    re-hashed when they change.
+
+    ```python
+    cache = DigestCache('.bdp/digests.sqlite')
+    digest = cache.get('path/to/file', 'sha256')
+    ```
+    """
+
+    def __init__(self, path: str | Path):
+        """
+        Parameters
+        ----------
+        path : str | Path
+            Path to the SQLite database
+        """
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(str(self.path), check_same_thread=False)
+        with self._lock, self._db:
+            self._db.execute('PRAGMA journal_mode=WAL')
+            self._db.execute(
+                'CREATE TABLE IF NOT EXISTS digests ('
+                'path TEXT, algo TEXT, size INTEGER, mtime INTEGER, '
+                'inode INTEGER, digest TEXT, PRIMARY KEY (path, algo))'
+            )
+
+    @staticmethod
+    def _key(fpath: str | Path) -> tuple[str, os.stat_result]:
+        fpath = os.path.abspath(fpath)
+        return fpath, os.stat(fpath)
+
+    def get(
+        self, fpath: str | Path, algos: Iterable[str]
+    ) -> dict[str, str]:
+        """
+        Return the cached digests of a file (for the algorithms that
+        have an up-to-date record).
+        """
+        fpath, stat = self._key(fpath)
+        algos = list(algos)
+        with self._lock:
+            rows = self._db.execute(
+                'SELECT algo, digest FROM digests '
+                'WHERE path = ? AND size = ? AND mtime = ? AND inode = ? '
+                'AND algo IN (%s)' % ', '.join('?' * len(algos)),
+                (fpath, stat.st_size, stat.st_mtime_ns, stat.st_ino, *algos)
+            ).fetchall()
+        return dict(rows)
+
+    def set(self, fpath: str | Path, digests: Mapping[str, str]) -> None:
+        """Save (or replace) the digests of a file, in its current state"""
+        fpath, stat = self._key(fpath)
+        with self._lock, self._db:
+            self._db.executemany(
+                'INSERT OR REPLACE INTO digests VALUES (?, ?, ?, ?, ?, ?)',
+                [
+                    (fpath, algo, stat.st_size, stat.st_mtime_ns,
+                     stat.st_ino, digest)
+                    for algo, digest in digests.items()
+                ]
+            )
+
+    def prune(self) -> int:
+        """Delete the records of missing or modified files"""
+        with self._lock:
+            rows = self._db.execute(
+                'SELECT DISTINCT path, size, mtime, inode FROM digests'
+            ).fetchall()
+        stale = set()
+        for fpath, size, mtime, inode in rows:
+            try:
+                stat = os.stat(fpath)
+            except OSError:
+                stale.add(fpath)
+                continue
+            if (stat.st_size, stat.st_mtime_ns, stat.st_ino) != (
+                size, mtime, inode
+            ):
+                stale.add(fpath)
+        with self._lock, self._db:
+            self._db.executemany(
+                'DELETE FROM digests WHERE path = ?', [(x,) for x in stale]
+            )
+        return len(stale)
+
+    def clear(self) -> None:
+        """Delete all records"""
+        with self._lock, self._db:
+            self._db.execute('DELETE FROM digests')
+
+    def close(self) -> None:
+        with self._lock:
+            self._db.close()
+
+
+# Name of the digest cache file, under a `.bdp` folder
+DIGEST_CACHE_NAME: str = 'digests.sqlite'
+
+_caches: dict[Path, DigestCache] = {}
+_roots: dict[Path, Path] = {}
+_caches_lock = threading.Lock()
+
+
+def default_cache_path() -> Path:
+    """Path of the user-level digest cache"""
+    root = os.environ.get('XDG_CACHE_HOME', '') or Path.home() / '.cache'
+    return Path(root) / 'braindataprep' / DIGEST_CACHE_NAME
+
+
+def get_digest_cache(fpath: str | Path) -> DigestCache:
+    """
+    Return the digest cache that serves a file.
+
+    This is the cache of the dataset that contains the file (i.e., the
+    nearest parent folder that contains a `.bdp` folder), or the
+    user-level cache if the file is not in a dataset.
+    """
+    folder = Path(os.path.abspath(fpath)).parent
+    with _caches_lock:
+        path = _roots.get(folder, None)
+        if path is None:
+            path = default_cache_path()
+            for parent in (folder, *folder.parents):
+                if (parent / '.bdp').is_dir():
+                    path = parent / '.bdp' / DIGEST_CACHE_NAME
+                    break
+            _roots[folder] = path
+        cache = _caches.get(path, None)
+        if cache is None:
+            cache = _caches[path] = DigestCache(path)
+    return cache
+
+
+def cache_digests(fpath: str | Path, digests: Mapping[str, str]) -> None:
+    """Save known digests of a file in its digest cache"""
+    try:
+        get_digest_cache(fpath).set(fpath, digests)
+    except (OSError, sqlite3.Error) as e:
+        lg.debug(f'Could not cache digests of {fpath}: {e}')
+
+
+# Number of worker threads used to hash files
+HASH_THREADS: int = os.cpu_count() or 1
+
+_pool: ThreadPoolExecutor | None = None
+_pool_lock = threading.Lock()
+
+
+def _get_pool() -> ThreadPoolExecutor:
+    """Return the (lazily created) pool shared by all digesters"""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ThreadPoolExecutor(
+                HASH_THREADS, thread_name_prefix='digest'
+            )
+    return _pool
+
+
 class Digester:
-    """Helper to compute multiple digests in one pass for a file"""
+    """
+    Helper to compute multiple digests in one pass for a file
+
+    Files are read in large blocks into preallocated buffers. When
+    `threads` is set, each block is hashed by all algorithms in parallel
+    (hashlib releases the GIL on large buffers) while the next block
+    is being read.
+
+    ```python
+    digester = Digester(['md5', 'sha256'])
+    digests = digester('path/to/file')
+    for path, digests in zip(paths, digester.map(paths)):
+        ...
+    ```
+    """
 
     # Loosely based on snippet by PM 2Ring 2014.10.23
     # http://unix.stackexchange.com/a/163769/55543
 
-    # Ideally we should find an efficient way to parallelize this but
-    # atm this one is sufficiently speedy
-
     def __init__(
         self,
         digests: List[str] = ('md5', 'sha1', 'sha256', 'sha512'),
-        blocksize: int = 1 << 16,
+        blocksize: int = 1 << 23,
         returns: Literal['digest', 'digester'] = 'digest',
+        threads: bool = True,
+        cache: bool = True,
     ):
+        """
+        Parameters
+        ----------
+        digests : list[str]
+            Hashing algorithms
+        blocksize : int
+            Number of bytes read at once
+        returns : {'digest', 'digester'}
+            Return hex digests, or the hashlib objects
+        threads : bool
+            Dispatch hashing to worker threads
+        cache : bool
+            Use (and fill) the digest cache of each file.
+            Not used if `returns='digester'`.
+        """
         self.digests = list(digests)
         self.blocksize = blocksize
         self.returns = returns
+        self.threads = threads
+        self.cache = cache and returns == 'digest'
         self.digest_funcs = [
             getattr(hashlib, digest) for digest in self.digests
         ]
@@ -75,24 +281,239 @@ class Digester:
         dict
             Keys are algorithm labels, and values are checksum strings
         """
+        return self._digest(fpath, self.threads)
+
+    def map(
+        self, fpaths: Iterable[str], jobs: int | None = None
+    ) -> Iterator[Mapping[str, str]]:
+        """
+        Compute the digests of many files concurrently.
+
+        Parameters
+        ----------
+        fpaths : iterable[str | Path]
+            File paths for which checksums shall be computed.
+        jobs : int
+            Number of files hashed in parallel (default: `HASH_THREADS`)
+
+        Yields
+        ------
+        dict
+            Digests of each file, in the order of `fpaths`
+        """
+        # Each file is hashed serially by a single worker, so that
+        # workers never wait on each other.
+        jobs = jobs or HASH_THREADS
+        if jobs <= 1:
+            for fpath in fpaths:
+                yield self._digest(fpath, False)
+            return
+        with ThreadPoolExecutor(jobs, thread_name_prefix='digest') as pool:
+            yield from pool.map(lambda x: self._digest(x, False), fpaths)
+
+    def _digest(self, fpath: str, threads: bool) -> Mapping[str, str]:
+        cached = {}
+        if self.cache:
+            try:
+                cache = get_digest_cache(fpath)
+                cached = cache.get(fpath, self.digests)
+            except (OSError, sqlite3.Error) as e:
+                lg.debug(f'Could not read digest cache of {fpath}: {e}')
+                cache = None
+        missing = [
+            (n, x) for n, x in zip(self.digests, self.digest_funcs)
+            if n not in cached
+        ]
+        if not missing:
+            return {n: cached[n] for n in self.digests}
+
         lg.debug("Estimating digests for %s" % fpath)
-        digests = [x() for x in self.digest_funcs]
-        with open(fpath, "rb") as f:
-            while True:
-                block = f.read(self.blocksize)
-                if not block:
+        digests = [x() for _, x in missing]
+        with open(fpath, "rb", buffering=0) as f:
+            if threads and os.fstat(f.fileno()).st_size > self.blocksize:
+                self._update_threaded(f, digests)
+            else:
+                self._update(f, digests)
+        if self.returns == 'digester':
+            return {n: d for (n, _), d in zip(missing, digests)}
+
+        computed = {n: d.hexdigest() for (n, _), d in zip(missing, digests)}
+        if self.cache and cache is not None:
+            try:
+                cache.set(fpath, computed)
+            except (OSError, sqlite3.Error) as e:
+                lg.debug(f'Could not cache digests of {fpath}: {e}')
+        cached.update(computed)
+        return {n: cached[n] for n in self.digests}
+
+    def _update(self, f: BinaryIO, digests: list) -> None:
+        buffer = bytearray(self.blocksize)
+        view = memoryview(buffer)
+        while True:
+            nbytes = f.readinto(buffer)
+            if not nbytes:
+                break
+            for d in digests:
+                d.update(view[:nbytes])
+
+    def _update_threaded(self, f: BinaryIO, digests: list) -> None:
+        # Double buffering: the next block is read in one buffer while
+        # the previous one is being hashed.
+        pool = _get_pool()
+        buffers = [bytearray(self.blocksize), bytearray(self.blocksize)]
+        pending = []
+        try:
+            for i in count():
+                buffer = buffers[i % 2]
+                nbytes = f.readinto(buffer)
+                for future in pending:
+                    future.result()
+                pending = []
+                if not nbytes:
                     break
-                for d in digests:
-                    d.update(block)
-        return {
-            n: d if self.returns == 'digester' else d.hexdigest()
-            for n, d in zip(self.digests, digests)
-        }
+                view = memoryview(buffer)[:nbytes]
+                pending = [pool.submit(d.update, view) for d in digests]
+        finally:
+            for future in pending:
+                future.result()
 
 
-def get_digest(filepath: str, digest: str = "sha256") -> str:
-    return Digester([digest])(filepath)[digest]
+def get_digest(
+    filepath: str, digest: str = "sha256", cache: bool = True
+) -> str:
+    return Digester([digest], cache=cache)(filepath)[digest]
 
 
 def get_digester(filepath: str, digest: str = "sha256") -> str:
     return Digester([digest], returns='digester')(filepath)[digest]
+
+
+# Name of OpenSSL's low-level functions, and size (in bytes) of their
+# context structure (`MD5_CTX`, `SHA_CTX`, `SHA256_CTX`, `SHA512_CTX`)
+_OPENSSL_HASHES: dict[str, tuple[str, int]] = {
+    'md5': ('MD5', 92),
+    'sha1': ('SHA1', 96),
+    'sha224': ('SHA224', 112),
+    'sha256': ('SHA256', 112),
+    'sha384': ('SHA384', 216),
+    'sha512': ('SHA512', 216),
+}
+
+_libcrypto: ctypes.CDLL | None | bool = None
+_libcrypto_lock = threading.Lock()
+
+
+def _get_libcrypto() -> ctypes.CDLL | None:
+    """Return the (lazily loaded) OpenSSL library, if available"""
+    global _libcrypto
+    with _libcrypto_lock:
+        if _libcrypto is None:
+            _libcrypto = False
+            # On macOS, the system libcrypto aborts the process when it
+            # is loaded directly, so we only try on Linux.
+            name = None
+            if sys.platform.startswith('linux'):
+                name = ctypes.util.find_library('crypto')
+            try:
+                lib = ctypes.CDLL(name) if name else None
+            except OSError as e:
+                lg.debug(f'Could not load {name}: {e}')
+                lib = None
+            if lib is not None:
+                for prefix, _ in _OPENSSL_HASHES.values():
+                    if not hasattr(lib, prefix + '_Init'):
+                        continue
+                    init = getattr(lib, prefix + '_Init')
+                    update = getattr(lib, prefix + '_Update')
+                    final = getattr(lib, prefix + '_Final')
+                    init.argtypes = [ctypes.c_void_p]
+                    update.argtypes = [
+                        ctypes.c_void_p, ctypes.c_char_p, ctypes.c_size_t
+                    ]
+                    final.argtypes = [ctypes.c_char_p, ctypes.c_void_p]
+                _libcrypto = lib
+        return _libcrypto or None
+
+
+class ResumableHash:
+    """
+    A hash object, like those returned by `hashlib.new`, whose internal
+    state can be saved and restored.
+
+    It calls OpenSSL's low-level digest functions through `ctypes`, so
+    it only exists for MD5, SHA-1 and SHA-2, and only if `libcrypto`
+    can be loaded (see `ResumableHash.available`). The saved state is
+    only meaningful on the machine that produced it.
+
+    ```python
+    digester = ResumableHash('md5')
+    digester.update(b'first bytes')
+    state = digester.state()
+    ...
+    digester = ResumableHash('md5', state)
+    digester.update(b'more bytes')
+    digest = digester.hexdigest()
+    ```
+    """
+
+    def __init__(self, name: str, state: bytes | None = None):
+        """
+        Parameters
+        ----------
+        name : str
+            Hashing algorithm
+        state : bytes | None
+            Internal state, as returned by `state()`
+        """
+        if not self.available(name):
+            raise ValueError(f'Cannot save the state of {name} hashes')
+        lib = _get_libcrypto()
+        prefix, size = _OPENSSL_HASHES[name]
+        self.name = name
+        self.digest_size = hashlib.new(name).digest_size
+        self._update = getattr(lib, prefix + '_Update')
+        self._final = getattr(lib, prefix + '_Final')
+        self._ctx = ctypes.create_string_buffer(size)
+        if state is None:
+            getattr(lib, prefix + '_Init')(self._ctx)
+        elif len(state) != size:
+            raise ValueError(f'Invalid {name} hash state')
+        else:
+            ctypes.memmove(self._ctx, bytes(state), size)
+
+    @staticmethod
+    def available(name: str) -> bool:
+        """Whether the state of this hashing algorithm can be saved"""
+        if name not in _OPENSSL_HASHES:
+            return False
+        lib = _get_libcrypto()
+        return bool(lib) and hasattr(lib, _OPENSSL_HASHES[name][0] + '_Init')
+
+    def update(self, data: bytes) -> None:
+        if not isinstance(data, bytes):
+            data = bytes(data)
+        # ctypes releases the GIL while the function runs
+        self._update(self._ctx, data, len(data))
+
+    def state(self) -> bytes:
+        """Return the internal state of the hash"""
+        return self._ctx.raw
+
+    def copy(self) -> "ResumableHash":
+        return type(self)(self.name, self.state())
+
+    def digest(self) -> bytes:
+        # `Final` clobbers the context, so finalize a copy
+        out = ctypes.create_string_buffer(self.digest_size)
+        self._final(out, self.copy()._ctx)
+        return out.raw
+
+    def hexdigest(self) -> str:
+        return self.digest().hex()
+
+
+def new_hash(name: str) -> "ResumableHash | hashlib._Hash":
+    """Return a `ResumableHash` if possible, else a `hashlib` object"""
+    if ResumableHash.available(name):
+        return ResumableHash(name)
+    return hashlib.new(name)
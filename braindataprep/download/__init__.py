@@ -3,9 +3,11 @@ from . import downloader    # noqa: F401
 from . import incomplete    # noqa: F401
 from . import manager       # noqa: F401
 from . import remote        # noqa: F401
+from . import session       # noqa: F401
 
 from .constants import *    # noqa: F401, F403
 from .downloader import *   # noqa: F401, F403
 from .incomplete import *   # noqa: F401, F403
 from .manager import *      # noqa: F401, F403
 from .remote import *       # noqa: F401, F403
+from .session import *      # noqa: F401, F403
@@ -0,0 +1,389 @@
+"""
+Asynchronous download engine, based on `aiohttp`.
+
+This engine follows the same status protocol as the default
+(`requests`-based) engine, but a single event loop can hold many
+downloads in flight. It is used by `Downloader(..., engine='async')`.
+"""
+import asyncio
+import random
+import sys
+import time
+from contextlib import asynccontextmanager
+from email.utils import parsedate_to_datetime
+from logging import getLogger
+from typing import (
+    TYPE_CHECKING, AsyncIterator, Callable, ContextManager, Generator,
+    Iterator, TypeVar
+)
+from urllib.parse import urlparse, ParseResult
+
+import requests
+
+from braindataprep.download.constants import CHUNK_SIZE
+from braindataprep.download.incomplete import IncompleteFile
+if TYPE_CHECKING:
+    from braindataprep.download.downloader import Downloader
+
+lg = getLogger(__name__)
+
+T = TypeVar('T')
+
+try:
+    import aiohttp
+except ImportError:
+    lg.error(
+        'Cannot find `aiohttp`. Did you install with [async] flag? '
+        'Try `pip install braindataprep[async]`.'
+    )
+
+
+def make_session(
+    session: requests.Session | None = None,
+    auth: Callable[[requests.Session], None] | None = None,
+) -> "aiohttp.ClientSession":
+    """
+    Create an `aiohttp` session that shares the credentials of a
+    `requests` session.
+
+    Parameters
+    ----------
+    session : requests.Session
+        Opened (and authenticated) session
+    auth : callable[requests.Session]
+        Authentification function, used if no session is provided
+
+    Returns
+    -------
+    session : aiohttp.ClientSession
+    """
+    cookies = headers = basic = None
+    own = session is None and auth is not None
+    if own:
+        session = requests.Session()
+        auth(session)
+    if session is not None:
+        cookies = {cookie.name: cookie.value for cookie in session.cookies}
+        if 'Authorization' in session.headers:
+            headers = {'Authorization': session.headers['Authorization']}
+        if isinstance(session.auth, tuple):
+            basic = aiohttp.BasicAuth(*session.auth)
+        if own:
+            session.close()
+    return aiohttp.ClientSession(
+        cookies=cookies,
+        headers=headers,
+        auth=basic,
+        cookie_jar=aiohttp.CookieJar(unsafe=True),
+    )
+
+
+class AsyncRemoteFile:
+    """
+    This object represents a remote file, whose bytes are downloaded
+    asynchronously. It is used as an asynchronous context manager.
+
+    ```python
+    async with aiohttp.ClientSession() as session:
+        async with AsyncRemoteFile(url, session) as f:
+            obj = b''
+            async for chunk in f:
+                obj += chunk
+    ```
+    """
+
+    def __init__(
+            self,
+            url: str | ParseResult,
+            session: "aiohttp.ClientSession",
+            chunk_size: int = CHUNK_SIZE,
+            offset: int = 0,
+            length: int | None = None,
+    ):
+        """
+        Parameters
+        ----------
+        url : str | ParseResult
+            Remote URL
+        session : aiohttp.ClientSession
+            Opened session
+        chunk_size : int
+            Number of bytes to read at once
+        offset : int
+            Number of bytes to skip
+        length : int | None
+            Number of bytes to read (default: up to the end of the file).
+            Only used if the server accepts range requests.
+        """
+        if not isinstance(url, ParseResult):
+            url = urlparse(url)
+        self.url = url
+        self.session = session
+        self.chunk_size = chunk_size
+        self.offset = offset
+        self.length = length
+        self.has_range = None
+        self.size = None
+        self.mtime = None
+        self.response = None
+        self.total = 0
+        self.last_speed = None
+        self.mean_speed = 0
+
+    async def probe(self) -> "AsyncRemoteFile":
+        """Read size, mtime and range support from a single HEAD request"""
+        h = {'Range': 'bytes=0-0'}
+        async with self.session.head(
+            self.url.geturl(), headers=h, allow_redirects=True
+        ) as r:
+            r.raise_for_status()
+            self.url = urlparse(str(r.url))
+            self.has_range = (r.status == 206)
+            if 'Content-Range' in r.headers:
+                self.size = int(r.headers['Content-Range'].split('/')[-1])
+            elif r.status == 200 and 'Content-Length' in r.headers:
+                self.size = int(r.headers['Content-Length'])
+            if 'Last-Modified' in r.headers:
+                self.mtime = parsedate_to_datetime(r.headers['Last-Modified'])
+        return self
+
+    async def __aenter__(self) -> "AsyncRemoteFile":
+        if self.has_range is None and (self.offset or self.length):
+            await self.probe()
+        h = {}
+        if self.length is not None and self.has_range:
+            stop = self.offset + self.length - 1
+            h['Range'] = f'bytes={self.offset}-{stop}'
+        elif self.offset and self.has_range:
+            h['Range'] = f'bytes={self.offset}-'
+        self.response = await self.session.get(
+            self.url.geturl(), headers=h, allow_redirects=True
+        )
+        self.response.raise_for_status()
+        self.total = 0
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        self.response.release()
+        self.response = None
+
+    async def __aiter__(self) -> AsyncIterator[bytes]:
+        # skip offset if range not available
+        skip = 0 if self.has_range else self.offset
+        content = self.response.content
+        while True:
+            tic = time.time()
+            chunk = await content.read(self.chunk_size)
+            toc = time.time()
+            if not chunk:
+                return
+            # timing (total must be increased _after_ update speed)
+            self._update_speed(len(chunk), toc-tic)
+            self.total += len(chunk)
+            if skip:
+                nbytes = min(skip, len(chunk))
+                chunk, skip = chunk[nbytes:], skip - nbytes
+                if not chunk:
+                    continue
+            yield chunk
+
+    def _update_speed(self, nbytes, time):
+        if not time:
+            return
+        self.last_speed = nbytes / time
+        if self.mean_speed:
+            self.mean_speed = self.total / self.mean_speed + time
+            self.mean_speed = (self.total + nbytes) / self.mean_speed
+        else:
+            self.mean_speed = self.last_speed
+
+
+@asynccontextmanager
+async def in_thread(context: ContextManager[T]) -> AsyncIterator[T]:
+    """
+    Enter and exit a (blocking) context manager in a worker thread,
+    so that the event loop is never blocked by it.
+    """
+    value = await asyncio.to_thread(context.__enter__)
+    try:
+        yield value
+    except BaseException:
+        if not await asyncio.to_thread(context.__exit__, *sys.exc_info()):
+            raise
+    else:
+        await asyncio.to_thread(context.__exit__, None, None, None)
+
+
+def _drain(generator: Generator[dict, None, T]) -> tuple[list[dict], T]:
+    """Run a status generator to completion. Return statuses and value."""
+    statuses = []
+    try:
+        while True:
+            statuses.append(next(generator))
+    except StopIteration as e:
+        return statuses, e.value
+
+
+async def iter_download(
+    downloader: "Downloader",
+    session: "aiohttp.ClientSession | None" = None,
+) -> AsyncIterator[dict]:
+    """
+    Download a file asynchronously.
+
+    Parameters
+    ----------
+    downloader : Downloader
+        Downloader that describes the file to download
+    session : aiohttp.ClientSession
+        Opened session. If None, a session that shares the credentials
+        of the downloader is created.
+
+    Yields
+    ------
+    status : dict
+        Same status messages as `Downloader.__iter__`
+    """
+    own_session = session is None
+    if own_session:
+        session = make_session(downloader.session, downloader.auth)
+    statuses = _iter_download(downloader, session)
+    try:
+        async for status in statuses:
+            yield status
+    finally:
+        try:
+            await statuses.aclose()
+        finally:
+            if own_session:
+                await session.close()
+
+
+async def _iter_download(
+    self: "Downloader",
+    session: "aiohttp.ClientSession",
+) -> AsyncIterator[dict]:
+    # ------------------------------------------------------------------
+    # Read size and mtime from remote
+    # ------------------------------------------------------------------
+    if self.size is None or self.mtime is None:
+        remote = await AsyncRemoteFile(self.src, session).probe()
+        if self.size is None:
+            self.size = remote.size
+        if self.mtime is None:
+            self.mtime = remote.mtime
+    yield {'size': self.size}
+
+    # ------------------------------------------------------------------
+    # If file exists, select replacement strategy
+    # (in a thread, since it may compute the digest of the file)
+    # ------------------------------------------------------------------
+    statuses, should_overwrite = await asyncio.to_thread(
+        _drain, self._should_overwrite()
+    )
+    for status in statuses:
+        yield status
+    if not should_overwrite:
+        return
+
+    if self.segments > 1:
+        lg.debug('Segmented downloads are not implemented by the async '
+                 'engine; download in a single stream')
+
+    # ------------------------------------------------------------------
+    # Download
+    # ------------------------------------------------------------------
+    for attempt in range(self.max_attemps):
+        try:
+            warned = False
+            if self.digests:
+                checkalgo, checksum = next(iter(self.digests.items()))
+            else:
+                checksum = checkalgo = None
+
+            # Disk I/O (locks, writes, hashes) runs in worker threads
+            async with in_thread(IncompleteFile(
+                self.dst,
+                checksum=checksum,
+                checkalgo=checkalgo,
+                ifnochecksum=self.ifnodigest,
+            )) as local_file:
+
+                assert local_file.offset is not None
+                downloaded = local_file.offset
+                if self.size is None or downloaded != self.size:
+                    async with AsyncRemoteFile(
+                        self.src,
+                        session,
+                        chunk_size=self.chunk_size,
+                        offset=local_file.offset,
+                    ) as remote_file:
+
+                        async for chunk in remote_file:
+                            downloaded += len(chunk)
+                            out = {'done': downloaded}
+                            if self.size:
+                                if downloaded > self.size and not warned:
+                                    warned = True
+                                    lg.warning(
+                                        'Downloaded %d bytes although size '
+                                        'was told to be just %d.',
+                                        downloaded, self.size,
+                                    )
+                                out['done%'] = 100 * downloaded / self.size
+                            await asyncio.to_thread(local_file.append, chunk)
+                            out['dspeed'] = remote_file.mean_speed
+                            out['wspeed'] = local_file.mean_speed
+                            yield out
+
+            dlchecksum = local_file.digest
+
+            # ----------------------------------------------------------
+            # success! -> a few checks then break out of trials loop
+            # ----------------------------------------------------------
+            statuses, _ = await asyncio.to_thread(
+                _drain, self._finalize(checksum, checkalgo, dlchecksum)
+            )
+            for status in statuses:
+                yield status
+            return
+
+        # --------------------------------------------------------------
+        # An exception was raised
+        # --------------------------------------------------------------
+
+        except ValueError:
+            raise
+
+        except (aiohttp.ClientError, asyncio.TimeoutError) as exc:
+            status = getattr(exc, 'status', None)
+            if 1 + attempt >= self.max_attemps or (
+                status is not None
+                and status not in self.RETRY_STATUSES
+            ):
+                lg.debug('Download failed: %s', exc)
+                yield {'status': 'error', 'message': str(exc)}
+                return
+            lg.debug(
+                'Failed to download on attempt #%d: %s, '
+                'will sleep a bit and retry',
+                attempt, exc,
+            )
+            await asyncio.sleep(random.random() * 5)
+
+
+def run_sync(aiterator: AsyncIterator[dict]) -> Iterator[dict]:
+    """
+    Consume an asynchronous iterator from synchronous code, in a
+    private event loop.
+    """
+    loop = asyncio.new_event_loop()
+    try:
+        while True:
+            try:
+                yield loop.run_until_complete(aiterator.__anext__())
+            except StopAsyncIteration:
+                return
+    finally:
+        loop.run_until_complete(aiterator.aclose())
+        loop.close()
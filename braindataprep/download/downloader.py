@@ -4,17 +4,24 @@ import time
 import random
 import os
 import datetime
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from queue import Queue
 from enum import Enum as _Enum
 from logging import getLogger
 from os.path import lexists
 from pathlib import Path, PosixPath
-from typing import Literal, Generator, Iterator, Callable
+from typing import (
+    Literal, Generator, Iterator, AsyncIterator, Callable
+)
 from urllib.parse import urlparse, ParseResult
 
 from braindataprep.digests import get_digest
+from braindataprep.digests import cache_digests
 from braindataprep.digests import sort_digests
 from braindataprep.download.remote import RemoteFile
 from braindataprep.download.incomplete import IncompleteFile
+from braindataprep.download.incomplete import SegmentedFile
 from braindataprep.download.constants import CHUNK_SIZE
 
 lg = getLogger('__name__')
@@ -156,6 +163,8 @@ class Downloader:
         digests: dict[str, str] | None = None,
         ifnodigest: Literal['restart', 'continue'] = 'restart',
         max_attemps: int = 3,
+        segments: int = 1,
+        engine: Literal['requests', 'async'] = 'requests',
     ):
         """
         Parameters
@@ -185,6 +194,14 @@ class Downloader:
             Behaviour if incomplete file exists but no digest is provided
         max_attempts : int
             Maximum number of attempts
+        segments : int
+            Number of segments (byte ranges) to download in parallel.
+            Only used if the server accepts range requests and the
+            size of the file is known.
+        engine : {'requests', 'async'}
+            Download engine. The 'async' engine uses `aiohttp` and
+            allows many downloads to share a single event loop
+            (see `DownloadManager`). It requires `braindataprep[async]`.
         """
         if not isinstance(src, ParseResult):
             src = urlparse(src)
@@ -204,6 +221,15 @@ class Downloader:
         self.ifnodigest = ifnodigest
         self.ifexists = IfExists.from_any(ifexists)
         self.max_attemps = max_attemps
+        self.segments = max(1, segments or 1)
+        self.engine = engine
+
+    def __aiter__(self) -> AsyncIterator[dict]:
+        """
+        Download the file asynchronously (requires `aiohttp`)
+        """
+        from braindataprep.download import aio
+        return aio.iter_download(self)
 
     def _should_overwrite(self) -> Generator[dict, None, bool]:
         if not lexists(self.dst):
@@ -280,6 +306,12 @@ class Downloader:
         """
         Download the file
         """
+        if self.engine == 'async':
+            # Run the asynchronous engine in a private event loop
+            from braindataprep.download import aio
+            yield from aio.run_sync(aio.iter_download(self))
+            return
+
         # --------------------------------------------------------------
         # Read size and mtime from remote
         # --------------------------------------------------------------
@@ -297,96 +329,42 @@ class Downloader:
         if not (yield from self._should_overwrite()):
             return
 
+        # --------------------------------------------------------------
+        # Check whether the file can be downloaded in segments
+        # --------------------------------------------------------------
+        segmented = False
+        if self.segments > 1 and self.size and self.size > self.chunk_size:
+            remote = RemoteFile(self.src, session=self.session, auth=self.auth)
+            segmented = remote.has_range
+            if not segmented:
+                lg.info(
+                    f'Server does not accept range requests: download '
+                    f'{self.dst!s} in a single stream'
+                )
+
         # --------------------------------------------------------------
         # Download
         # --------------------------------------------------------------
         for attempt in range(self.max_attemps):
             try:
-                warned = False
                 if self.digests:
-                    checksum, checkalgo = next(iter(self.digests.items()))
+                    checkalgo, checksum = next(iter(self.digests.items()))
                 else:
                     checksum = checkalgo = None
-                with IncompleteFile(
-                    self.dst,
-                    checksum=checksum,
-                    checkalgo=checkalgo,
-                    ifnochecksum=self.ifnodigest,
-                ) as local_file:
-
-                    assert local_file.offset is not None
-                    downloaded = local_file.offset
-                    if self.size is not None and downloaded == self.size:
-                        # Exit early when downloaded == size, as making
-                        # a Range request in such a case results in a
-                        # 416 error from S3. Problems will result if
-                        # `size` is None but we've already downloaded
-                        # everything.
-                        break
-
-                    with RemoteFile(
-                        self.src,
-                        session=self.session,
-                        auth=self.auth,
-                        chunk_size=self.chunk_size,
-                        offset=local_file.offset,
-                    ) as remote_file:
 
-                        for chunk in remote_file:
-                            downloaded += len(chunk)
-                            out = {'done': downloaded}
-                            if self.size:
-                                if downloaded > self.size and not warned:
-                                    warned = True
-                                    # Yield ERROR?
-                                    lg.warning(
-                                        'Downloaded %d bytes although size '
-                                        'was told to be just %d.',
-                                        downloaded, self.size,
-                                    )
-                                out['done%'] = 100 * downloaded / self.size
-                            local_file += chunk
-                            out['dspeed'] = remote_file.mean_speed
-                            out['wspeed'] = local_file.mean_speed
-                            yield out
-
-                    dlchecksum = local_file.digest
+                if segmented:
+                    dlchecksum = yield from self._download_segments(
+                        checksum, checkalgo
+                    )
+                else:
+                    dlchecksum = yield from self._download_stream(
+                        checksum, checkalgo
+                    )
 
                 # ------------------------------------------------------
                 # success! -> a few checks then break out of trials loop
                 # ------------------------------------------------------
-
-                if checksum and dlchecksum:
-
-                    if dlchecksum != checksum:
-                        msg = (
-                            f'{checkalgo}: '
-                            f'downloaded {dlchecksum} != {checksum}'
-                        )
-                        yield {
-                            'checksum': 'differs',
-                            'status': 'error',
-                            'message': msg,
-                        }
-                        lg.debug(
-                            '%s is different: %s.', self.dst, msg
-                        )
-                        return
-                    else:
-                        yield {'checksum': 'ok'}
-                        lg.debug(
-                            'Verified that %s has correct %s %s',
-                            self.dst, checkalgo, dlchecksum
-                        )
-
-                else:
-                    yield {'checksum': '-'}
-
-                if self.mtime is not None:
-                    yield {'status': 'setting mtime'}
-                    os.utime(self.dst, (time.time(), self.mtime.timestamp()))
-
-                yield {'status': 'done'}
+                yield from self._finalize(checksum, checkalgo, dlchecksum)
                 return
 
             # ----------------------------------------------------------
@@ -420,3 +398,177 @@ class Downloader:
                     attempt, exc,
                 )
                 time.sleep(random.random() * 5)
+
+    def _finalize(
+        self,
+        checksum: str | None,
+        checkalgo: str | None,
+        dlchecksum: str | None,
+    ) -> Iterator[dict]:
+        """Check the digest of a downloaded file and set its mtime."""
+        if checksum and dlchecksum:
+
+            if dlchecksum != checksum:
+                msg = (
+                    f'{checkalgo}: '
+                    f'downloaded {dlchecksum} != {checksum}'
+                )
+                yield {
+                    'checksum': 'differs',
+                    'status': 'error',
+                    'message': msg,
+                }
+                lg.debug(
+                    '%s is different: %s.', self.dst, msg
+                )
+                return
+            else:
+                yield {'checksum': 'ok'}
+                lg.debug(
+                    'Verified that %s has correct %s %s',
+                    self.dst, checkalgo, dlchecksum
+                )
+
+        else:
+            yield {'checksum': '-'}
+
+        if self.mtime is not None:
+            yield {'status': 'setting mtime'}
+            os.utime(self.dst, (time.time(), self.mtime.timestamp()))
+
+        if checksum and dlchecksum:
+            cache_digests(self.dst, {checkalgo: dlchecksum})
+
+        yield {'status': 'done'}
+
+    def _download_stream(
+        self, checksum: str | None, checkalgo: str | None
+    ) -> Generator[dict, None, str | None]:
+        """Download the file in a single stream. Return its digest."""
+        warned = False
+        with IncompleteFile(
+            self.dst,
+            checksum=checksum,
+            checkalgo=checkalgo,
+            ifnochecksum=self.ifnodigest,
+        ) as local_file:
+
+            assert local_file.offset is not None
+            downloaded = local_file.offset
+            if self.size is not None and downloaded == self.size:
+                # Exit early when downloaded == size, as making
+                # a Range request in such a case results in a
+                # 416 error from S3. Problems will result if
+                # `size` is None but we've already downloaded
+                # everything.
+                pass
+
+            else:
+                with RemoteFile(
+                    self.src,
+                    session=self.session,
+                    auth=self.auth,
+                    chunk_size=self.chunk_size,
+                    offset=local_file.offset,
+                ) as remote_file:
+
+                    for chunk in remote_file:
+                        downloaded += len(chunk)
+                        out = {'done': downloaded}
+                        if self.size:
+                            if downloaded > self.size and not warned:
+                                warned = True
+                                # Yield ERROR?
+                                lg.warning(
+                                    'Downloaded %d bytes although size '
+                                    'was told to be just %d.',
+                                    downloaded, self.size,
+                                )
+                            out['done%'] = 100 * downloaded / self.size
+                        local_file += chunk
+                        out['dspeed'] = remote_file.mean_speed
+                        out['wspeed'] = local_file.mean_speed
+                        yield out
+
+        return local_file.digest
+
+    def _download_segments(
+        self, checksum: str | None, checkalgo: str | None
+    ) -> Generator[dict, None, str | None]:
+        """
+        Download the file over several parallel range requests.
+        Return its digest.
+        """
+        with SegmentedFile(
+            self.dst,
+            self.size,
+            nb_segments=self.segments,
+            checksum=checksum,
+            checkalgo=checkalgo,
+            ifnochecksum=self.ifnodigest,
+        ) as local_file:
+
+            todo = [
+                index for index, (_, offset, stop)
+                in enumerate(local_file.segments)
+                if offset < stop
+            ]
+            queue = Queue()
+            abort = threading.Event()
+
+            def fetch(index: int) -> None:
+                try:
+                    _, offset, stop = local_file.segments[index]
+                    with RemoteFile(
+                        self.src,
+                        session=self.session,
+                        auth=self.auth,
+                        chunk_size=self.chunk_size,
+                        offset=offset,
+                        length=stop - offset,
+                    ) as remote_file:
+                        if remote_file.response.status_code != 206:
+                            raise requests.HTTPError(
+                                f'Range request not honoured '
+                                f'(status {remote_file.response.status_code})',
+                                response=remote_file.response,
+                            )
+                        for chunk in remote_file:
+                            if abort.is_set():
+                                return
+                            # never write past the end of the segment
+                            left = stop - local_file.segments[index][1]
+                            chunk = chunk[:left]
+                            local_file.write_at(index, chunk)
+                            queue.put(len(chunk))
+                            if len(chunk) == left:
+                                return
+                finally:
+                    queue.put(None)
+
+            downloaded = start = local_file.offset
+            tic = time.time()
+            with ThreadPoolExecutor(len(todo) or 1) as pool:
+                futures = [pool.submit(fetch, index) for index in todo]
+                try:
+                    running = len(futures)
+                    while running:
+                        nbytes = queue.get()
+                        if nbytes is None:
+                            running -= 1
+                            continue
+                        downloaded += nbytes
+                        elapsed = max(time.time() - tic, 1e-9)
+                        yield {
+                            'done': downloaded,
+                            'done%': 100 * downloaded / self.size,
+                            'dspeed': (downloaded - start) / elapsed,
+                            'wspeed': local_file.mean_speed,
+                        }
+                    # Raise errors that happened in workers
+                    for future in futures:
+                        future.result()
+                finally:
+                    abort.set()
+
+        return local_file.digest
@@ -1,4 +1,7 @@
 import hashlib
+import json
+import os
+import threading
 import time
 from pathlib import Path
 from shutil import rmtree
@@ -6,11 +9,128 @@ from fasteners import InterProcessLock
 from typing import IO, Literal
 from logging import getLogger
 
-from braindataprep.digests import get_digester
+import requests
+
+from braindataprep.digests import ResumableHash
+from braindataprep.digests import get_digest
+from braindataprep.digests import new_hash
 
 lg = getLogger(__name__)
 
 
+class IncompleteDownload(requests.exceptions.ChunkedEncodingError):
+    """
+    Raised when the server stops sending data before the end of a
+    segment. It is a `requests.RequestException`, so that downloaders
+    retry (and resume) the download.
+    """
+    pass
+
+
+class CatchUpHasher(threading.Thread):
+    """
+    Hash a file that is still being written, in a background thread.
+
+    The hasher reads the file from `position` (its start, by default),
+    up to the number of bytes that are known to be written (`extend`),
+    and waits for more until `finish` is called. It is used when a
+    download is resumed: the bytes that come after the last saved hash
+    state are hashed while new bytes are being downloaded, instead of
+    before the download restarts.
+    """
+
+    # Number of bytes read at once
+    BLOCK_SIZE: int = 1 << 23
+
+    def __init__(
+        self,
+        filename: str | Path,
+        checkalgo: str,
+        size: int = 0,
+        digester: "ResumableHash | hashlib._Hash | None" = None,
+        position: int = 0,
+    ):
+        """
+        Parameters
+        ----------
+        filename : str | Path
+            File to hash
+        checkalgo : str
+            Hashing algorithm
+        size : int
+            Number of bytes already written
+        digester : ResumableHash | hashlib._Hash | None
+            Hash object that has already hashed the first `position` bytes
+        position : int
+            Number of bytes already hashed by `digester`
+        """
+        super().__init__(daemon=True, name=f'hash:{Path(filename).name}')
+        self.filename = Path(filename)
+        if digester is None:
+            digester, position = new_hash(checkalgo), 0
+        self.digester = digester
+        self.position = position
+        self.target = size
+        self.done = False
+        self.error: BaseException | None = None
+        self.cond = threading.Condition()
+
+    def extend(self, size: int) -> None:
+        """Signal that `size` bytes are now available in the file"""
+        with self.cond:
+            self.target = size
+            self.cond.notify()
+
+    def caught_up(self) -> bool:
+        """Whether all available bytes have been hashed"""
+        with self.cond:
+            return self.position >= self.target
+
+    def finish(self, size: int | None = None) -> "hashlib._Hash":
+        """Hash up to `size` bytes, then stop and return the digester"""
+        with self.cond:
+            if size is not None:
+                self.target = size
+            self.done = True
+            self.cond.notify()
+        self.join()
+        if self.error:
+            raise self.error
+        return self.digester
+
+    def cancel(self) -> None:
+        """Stop as soon as possible"""
+        with self.cond:
+            self.target = self.position
+            self.done = True
+            self.cond.notify()
+        self.join()
+
+    def run(self) -> None:
+        try:
+            with open(self.filename, 'rb') as f:
+                f.seek(self.position)
+                while True:
+                    with self.cond:
+                        while self.position >= self.target and not self.done:
+                            self.cond.wait()
+                        if self.position >= self.target:
+                            return
+                        target = self.target
+                    while self.position < target:
+                        nbytes = min(self.BLOCK_SIZE, target - self.position)
+                        block = f.read(nbytes)
+                        if not block:
+                            raise EOFError(
+                                f'{self.filename} is shorter than expected'
+                            )
+                        self.digester.update(block)
+                        with self.cond:
+                            self.position += len(block)
+        except BaseException as e:
+            self.error = e
+
+
 class IncompleteFile:
     """
     An object that represents a file being downloaded, in its
@@ -18,6 +138,12 @@ class IncompleteFile:
     an unfinished download can be continued, or should be completely
     restarted.
 
+    When possible (see `ResumableHash`), the state of the running hash
+    is saved in a sidecar file (`{filename}.hashstate`) every
+    `CHECKPOINT_SIZE` bytes and when the download is interrupted, so
+    that a resumed download only re-hashes the bytes written after the
+    last checkpoint.
+
     ```python
     with IncompleteFile(filename, checksum=sha1) as obj:
         for chunk in chunk_server:
@@ -29,6 +155,9 @@ class IncompleteFile:
     # https://github.com/dandi/dandi-cli/blob/master/dandi/download.py
     # Apache License Version 2.0
 
+    # Number of bytes written between two saves of the hash state
+    CHECKPOINT_SIZE: int = 1 << 26
+
     def __init__(
             self,
             filename: str | Path,
@@ -49,7 +178,7 @@ class IncompleteFile:
             Behaviour if incomplete file exists but no checksum is provided
         """
         # checks
-        if checkalgo and not hasattr(checkalgo, hashlib):
+        if checkalgo and checkalgo not in hashlib.algorithms_available:
             raise ValueError('Unknown hashing algorithm')
         # assign
         self.filename: Path = Path(filename)
@@ -62,6 +191,9 @@ class IncompleteFile:
         self.checkname: Path = self.filename.with_name(
             self.filename.name + '.checksum'
         )
+        self.statename: Path = self.filename.with_name(
+            self.filename.name + '.hashstate'
+        )
         self.lock: InterProcessLock | None = None
         self.file: IO[bytes] | None = None
         self.offset: int | None = None
@@ -69,7 +201,9 @@ class IncompleteFile:
         self.checkalgo: str = checkalgo
         self.ifnochecksum: Literal['r', 'c'] = ifnochecksum.lower()[0]
         self.digester = None
+        self.hasher: CatchUpHasher | None = None
         self._digest: str | None = None
+        self._checkpoint: int = 0
         self.last_speed: float = 0
         self.mean_speed: float = 0
 
@@ -86,24 +220,16 @@ class IncompleteFile:
         self.filename.parent.mkdir(parents=True, exist_ok=True)
 
         # Acquire lock
-        self.lock = InterProcessLock(str(self.lockname))
-        if not self.lock.acquire(blocking=False):
-            raise RuntimeError(
-                f'Could not acquire download lock for {self.filename}'
-            )
+        self._acquire_lock()
 
         # Check if a file was already being downloaded, and if we should
         # continue from where we left off
-        try:
-            with self.checkname.open('rt') as f:
-                checksum = f.read()
-        except (FileNotFoundError, ValueError):
-            checksum = None
+        checksum = self._read_checksum()
 
         # Compute checksum on the fly
         self._digest = None
         if self.checkalgo:
-            self.digester = hashlib.new(self.checkalgo)
+            self.digester = new_hash(self.checkalgo)
 
         # Check whether we should keep the existing partial file
         cont = self.tempname.exists()
@@ -120,9 +246,18 @@ class IncompleteFile:
                 lg.debug(
                     'Download file exists; resuming download'
                 )
-            if self.digest:
-                with self.tempname.open('rb') as f:
-                    self.digester = get_digester(f, self.checkalgo)
+            if self.digester:
+                # Restart from the last saved hash state (if any) and
+                # hash the remaining bytes of the partial file in the
+                # background, while the download continues.
+                size = self.tempname.stat().st_size
+                digester, position = self._read_hashstate(size)
+                self.digester = None
+                self.hasher = CatchUpHasher(
+                    self.tempname, self.checkalgo, size,
+                    digester=digester, position=position,
+                )
+                self.hasher.start()
         else:
             mode = 'wb'
             if self.tempname.exists():
@@ -139,23 +274,83 @@ class IncompleteFile:
                 lg.debug('Starting new download')
             # Remove existing file
             self.tempname.unlink(missing_ok=True)
+            self.statename.unlink(missing_ok=True)
 
         # Open file
         self.file = self.tempname.open(mode)
-        self.offset = self.file.tell()
+        self.offset = self._checkpoint = self.file.tell()
 
         # Write expected checksum
+        self._write_checksum()
+
+        return self
+
+    def _acquire_lock(self) -> None:
+        self.lock = InterProcessLock(str(self.lockname))
+        if not self.lock.acquire(blocking=False):
+            raise RuntimeError(
+                f'Could not acquire download lock for {self.filename}'
+            )
+
+    def _read_checksum(self) -> str | None:
+        try:
+            with self.checkname.open('rt') as f:
+                return f.read()
+        except (FileNotFoundError, ValueError):
+            return None
+
+    def _write_checksum(self) -> None:
         if self.checksum:
             with self.checkname.open("w") as f:
                 f.write(self.checksum)
 
-        return self
+    def _read_hashstate(
+        self, size: int
+    ) -> tuple[ResumableHash | None, int]:
+        try:
+            with self.statename.open('rt') as f:
+                obj = json.load(f)
+            if obj['algo'] != self.checkalgo or obj['offset'] > size:
+                raise ValueError('Hash state does not match download')
+            digester = ResumableHash(obj['algo'], bytes.fromhex(obj['state']))
+        except (FileNotFoundError, KeyError, TypeError, ValueError) as e:
+            lg.debug(f'Cannot use hash state of {self.filename}: {e}')
+            return None, 0
+        lg.debug(f'Resuming hash of {self.filename} at {obj["offset"]}')
+        return digester, obj['offset']
+
+    def _write_hashstate(self, digester, offset: int) -> None:
+        if not isinstance(digester, ResumableHash):
+            return
+        obj = {'algo': digester.name, 'offset': offset,
+               'state': digester.state().hex()}
+        tmpname = self.statename.with_name(self.statename.name + '.tmp')
+        with tmpname.open('wt') as f:
+            json.dump(obj, f)
+        tmpname.replace(self.statename)
+        self._checkpoint = offset
 
     def __exit__(self, exc_type, exc_val, exc_tb):
         # Close file
         assert self.file is not None
+        size = self.file.tell()
         self.file.close()
 
+        # Wait for the background hasher to reach the end of the file
+        if self.hasher is not None:
+            if exc_type is None:
+                self.digester = self.hasher.finish(size)
+            else:
+                self.hasher.cancel()
+                if not self.hasher.error:
+                    self._write_hashstate(
+                        self.hasher.digester, self.hasher.position
+                    )
+            self.hasher = None
+        elif exc_type is not None and self.digester:
+            # Save the hash state so that it can be resumed
+            self._write_hashstate(self.digester, size)
+
         # Rename temporary filename to output filename
         # Note that we only rename the file to its final name and
         # remove temporary file if the download was succesful (i.e.
@@ -177,6 +372,7 @@ class IncompleteFile:
                 self.tempname.unlink(missing_ok=True)
                 self.lockname.unlink(missing_ok=True)
                 self.checkname.unlink(missing_ok=True)
+                self.statename.unlink(missing_ok=True)
             self.lock = None
             self.file = None
             self.offset = None
@@ -186,10 +382,24 @@ class IncompleteFile:
             raise ValueError(
                 'IncompleteFile.append() called outside of context manager'
             )
-        if self.digest:
-            self.digest.update(blob)
+        if self.hasher is not None and self.hasher.caught_up():
+            # The background hasher has caught up: hash on the fly again
+            self.digester = self.hasher.finish()
+            self.hasher = None
+        if self.digester:
+            self.digester.update(blob)
         tic = time.time()
         self.file.write(blob)
+        if self.hasher is not None:
+            self.file.flush()
+            self.hasher.extend(self.file.tell())
+        elif (
+            isinstance(self.digester, ResumableHash) and
+            self.file.tell() - self._checkpoint >= self.CHECKPOINT_SIZE
+        ):
+            # The hash state must never be ahead of the bytes on disk
+            self.file.flush()
+            self._write_hashstate(self.digester, self.file.tell())
         toc = time.time()
 
         # timing
@@ -213,3 +423,200 @@ class IncompleteFile:
             self.mean_speed = (total + nbytes) / self.mean_speed
         else:
             self.mean_speed = self.last_speed
+
+
+class SegmentedFile(IncompleteFile):
+    """
+    An incomplete file that is downloaded as several independent
+    segments (byte ranges), typically over parallel connections.
+
+    The temporary file is preallocated (sparse) and each segment is
+    written at its own position. The current offset of each segment is
+    saved in a sidecar file (`{filename}.segments`), so that each
+    segment can be resumed independently.
+
+    ```python
+    with SegmentedFile(filename, size, nb_segments=4) as obj:
+        for index, (start, offset, stop) in enumerate(obj.segments):
+            for chunk in chunk_server(offset, stop):
+                obj.write_at(index, chunk)
+    ```
+    """
+
+    # Minimum delay between two saves of the sidecar file, in seconds
+    SAVE_DELAY: float = 1.0
+
+    def __init__(
+            self,
+            filename: str | Path,
+            size: int,
+            nb_segments: int = 4,
+            checksum: str | None = None,
+            checkalgo: str | None = None,
+            ifnochecksum: Literal['restart', 'continue'] = 'restart',
+    ):
+        """
+        Parameters
+        ----------
+        filename : str | Path
+            Output filename
+        size : int
+            Size of the file, in bytes
+        nb_segments : int
+            Number of segments
+        checksum : str | None
+            Expected checksum (hex) of the file
+        checkalgo : str | None
+            Algorithm to use to compute the checksum of downloaded file
+        ifnochecksum : {'restart', 'continue'}
+            Behaviour if incomplete file exists but no checksum is provided
+        """
+        super().__init__(filename, checksum, checkalgo, ifnochecksum)
+        self.size: int = size
+        self.nb_segments: int = max(1, min(nb_segments, size or 1))
+        self.segname: Path = self.filename.with_name(
+            self.filename.name + '.segments'
+        )
+        # list of [start, offset, stop] (stop is exclusive)
+        self.segments: list[list[int]] | None = None
+        self._mutex = threading.Lock()
+        self._last_save: float = 0
+
+    def _split(self) -> list[list[int]]:
+        step = -(-self.size // self.nb_segments)
+        return [
+            [start, start, min(start + step, self.size)]
+            for start in range(0, self.size, step)
+        ]
+
+    def _read_segments(self) -> list[list[int]] | None:
+        try:
+            with self.segname.open('rt') as f:
+                obj = json.load(f)
+        except (FileNotFoundError, ValueError):
+            return None
+        if obj.get('size') != self.size:
+            return None
+        return obj['segments']
+
+    def _write_segments(self) -> None:
+        with self.segname.open('wt') as f:
+            json.dump({'size': self.size, 'segments': self.segments}, f)
+        self._last_save = time.time()
+
+    @property
+    def complete(self) -> bool:
+        return all(offset >= stop for _, offset, stop in self.segments)
+
+    def __enter__(self) -> "SegmentedFile":
+        self.filename.parent.mkdir(parents=True, exist_ok=True)
+
+        # Acquire lock
+        self._acquire_lock()
+
+        # Check if a file was already being downloaded, and if we should
+        # continue from where we left off
+        checksum = self._read_checksum()
+        segments = self._read_segments()
+        self._digest = None
+        self.digester = None
+
+        cont = self.tempname.exists() and segments is not None
+        cont = cont and ((self.checksum and self.checksum == checksum) or
+                         (not self.checksum and self.ifnochecksum == 'c'))
+        if cont:
+            lg.debug('Segmented download file exists; resuming download')
+            self.segments = segments
+            self.file = self.tempname.open('r+b')
+        else:
+            lg.debug('Starting new segmented download')
+            self.tempname.unlink(missing_ok=True)
+            self.segments = self._split()
+            self.file = self.tempname.open('w+b')
+            # Preallocate (sparse) file
+            self.file.truncate(self.size)
+
+        self.offset = sum(offset - start for start, offset, _ in self.segments)
+        self._written = 0
+        self._wtime = 0
+
+        # Write sidecars
+        self._write_checksum()
+        self._write_segments()
+
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        assert self.file is not None
+        self.file.close()
+
+        if exc_type is None and not self.complete:
+            exc_type = IncompleteDownload
+
+        try:
+            if exc_type is None:
+                if self.checkalgo:
+                    self._digest = get_digest(
+                        self.tempname, self.checkalgo, cache=False
+                    )
+                try:
+                    self.tempname.replace(self.filename)
+                except IsADirectoryError:
+                    rmtree(self.filename)
+                    self.tempname.replace(self.filename)
+            else:
+                # Save progress so that segments can be resumed
+                self._write_segments()
+        finally:
+            assert self.lock is not None
+            self.lock.release()
+            if exc_type is None:
+                self.tempname.unlink(missing_ok=True)
+                self.lockname.unlink(missing_ok=True)
+                self.checkname.unlink(missing_ok=True)
+                self.segname.unlink(missing_ok=True)
+            self.lock = None
+            self.file = None
+            self.offset = None
+
+        if exc_val is None and exc_type is IncompleteDownload:
+            raise IncompleteDownload(f'Incomplete download: {self.filename}')
+
+    def write_at(self, index: int, blob: bytes) -> "SegmentedFile":
+        """
+        Write a chunk of bytes at the current position of a segment.
+
+        This method can be called concurrently from different threads,
+        as long as each segment is only written by a single thread.
+        """
+        if self.file is None:
+            raise ValueError(
+                'SegmentedFile.write_at() called outside of context manager'
+            )
+        segment = self.segments[index]
+        tic = time.time()
+        if hasattr(os, 'pwrite'):
+            os.pwrite(self.file.fileno(), blob, segment[1])
+        else:
+            with self._mutex:
+                self.file.seek(segment[1])
+                self.file.write(blob)
+                self.file.flush()
+        toc = time.time()
+        with self._mutex:
+            segment[1] += len(blob)
+            self.offset += len(blob)
+            # timing
+            self._written += len(blob)
+            self._wtime += toc - tic
+            if toc > tic:
+                self.last_speed = len(blob) / (toc - tic)
+            if self._wtime:
+                self.mean_speed = self._written / self._wtime
+            # save progress
+            if toc - self._last_save > self.SAVE_DELAY:
+                self._write_segments()
+        return self
+
+    def append(self, blob: bytes) -> "SegmentedFile":
+        raise TypeError('SegmentedFile must be written with `write_at()`')
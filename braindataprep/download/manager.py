@@ -1,7 +1,11 @@
+import asyncio
+import threading
 from pathlib import Path
 from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
 from logging import getLogger
-from typing import Literal, Iterable
+from queue import Queue
+from typing import Literal, Iterable, Iterator
 
 from braindataprep.pyout import LogSafeTabular, get_style
 from braindataprep.download.downloader import IfExists
@@ -14,7 +18,8 @@ class DownloadManager:
     """
     A class that manages is list of downloads.
 
-    It runs them one at a time and display their status in a table.
+    It runs them one at a time (or `workers` at a time) and display
+    their status in a table.
 
     ```python
     manager = DownloadManager(
@@ -33,6 +38,7 @@ class DownloadManager:
             on_error: Literal["yield", "raise"] = "yield",
             path: Literal["name", "full", "abs", "short"] = "name",
             jobs: int = 1,
+            workers: int = 1,
     ):
         """
         Parameters
@@ -55,8 +61,11 @@ class DownloadManager:
             * "short" : hide common prefix
         jobs : int
             Number of `pyout` jobs used for printing
+        workers : int
+            Number of downloads running concurrently
         """
         self.downloaders = downloaders
+        self.workers = max(1, workers or 1)
 
         self.ifexists = IfExists.from_any(ifexists)
         self.on_error = on_error
@@ -81,7 +90,7 @@ class DownloadManager:
 
     def run(self):
         """Run all downloads"""
-        guard = {'yield': self.guard, 'raise': lambda x: x}[self.on_error]
+        guard = {'yield': self.guard, 'raise': self.abortable}[self.on_error]
 
         if self.path[0] == 's':
             # Shorten path, but we need to access all downloaders wich
@@ -91,20 +100,188 @@ class DownloadManager:
 
             with self.out:
                 with IfExists(self.ifexists):
-                    for path, downloader in zip(paths, self.downloaders):
-                        for status in guard(downloader):
-                            self.out({"path": path, **status})
+                    tasks = zip(paths, self.downloaders)
+                    for path, status in self.iter_tasks(tasks, guard):
+                        self.out({"path": path, **status})
 
         else:
             # Just yield from the generator
-            for downloader in self.downloaders:
-                path = str(self.repath(downloader.dst))
+            tasks = (
+                (str(self.repath(downloader.dst)), downloader)
+                for downloader in self.downloaders
+            )
+            for path, status in self.iter_tasks(tasks, guard):
+                self.out({"path": path, **status})
+
+    def iter_tasks(self, tasks, guard) -> Iterator[tuple[str, dict]]:
+        """
+        Run (path, downloader) tasks and yield (path, status) tuples.
+
+        If `self.workers > 1`, up to `workers` downloaders run
+        concurrently in a thread pool, and their statuses are yielded
+        (interleaved) in the calling thread, as they arrive.
+        Tasks are pulled lazily from the input iterable, so that a
+        (long) generator of downloaders is never fully unrolled.
+
+        Downloaders that use the `'async'` engine do not consume a
+        thread: they all run in a single event loop (itself running
+        in a background thread).
+
+        If the iteration stops early (error, interruption, or the
+        consumer closes the generator), running downloads are aborted
+        at their next status message, so that their partial files can
+        be resumed later.
+        """
+        if self.workers == 1:
+            for path, downloader in tasks:
                 for status in guard(downloader):
-                    self.out({"path": path, **status})
+                    yield path, status
+            return
+
+        # Statuses are pushed to a queue by the workers, and popped
+        # by the main thread (which owns the table). A `None` status
+        # signals that a task is finished. An exception is forwarded
+        # as is and re-raised in the main thread.
+        queue = Queue()
+        # Set when the iteration stops: running workers stop at their
+        # next status message
+        abort = threading.Event()
+
+        def work(path, downloader):
+            statuses = guard(downloader, abort)
+            try:
+                for status in statuses:
+                    queue.put((path, status))
+            except BaseException as e:
+                queue.put((path, e))
+            finally:
+                # Exit the downloader's context (e.g., partial file)
+                statuses.close()
+                queue.put((path, None))
+
+        async def awork(path, downloader):
+            statuses = aio.iter_download(downloader, get_session(downloader))
+            if self.on_error == 'yield':
+                statuses = self.aguard(downloader, statuses)
+            try:
+                try:
+                    async for status in statuses:
+                        if abort.is_set():
+                            break
+                        queue.put((path, status))
+                finally:
+                    # Exit the downloader's context (e.g., partial file)
+                    await statuses.aclose()
+            except BaseException as e:
+                queue.put((path, e))
+            finally:
+                queue.put((path, None))
+
+        # Async downloads that share the same credentials share a single
+        # `aiohttp` session, so that connections are pooled and kept
+        # alive across files.
+        sessions = {}
+
+        def get_session(downloader):
+            key = (downloader.session, downloader.auth)
+            if key not in sessions:
+                sessions[key] = aio.make_session(*key)
+            return sessions[key]
+
+        async def close_sessions():
+            for session in sessions.values():
+                await session.close()
+
+        aio = None
+        loop = loop_thread = None
+
+        def submit(path, downloader):
+            nonlocal loop, loop_thread, aio
+            if getattr(downloader, 'engine', None) == 'async':
+                if loop is None:
+                    from braindataprep.download import aio
+                    loop = asyncio.new_event_loop()
+                    loop_thread = threading.Thread(
+                        target=loop.run_forever, daemon=True
+                    )
+                    loop_thread.start()
+                asyncio.run_coroutine_threadsafe(awork(path, downloader), loop)
+            else:
+                pool.submit(work, path, downloader)
+
+        tasks = iter(tasks)
+        running = 0
+        with ThreadPoolExecutor(self.workers) as pool:
+            try:
+                for path, downloader in tasks:
+                    submit(path, downloader)
+                    running += 1
+                    if running == self.workers:
+                        break
+                while running:
+                    path, status = queue.get()
+                    if status is None:
+                        running -= 1
+                        for path, downloader in tasks:
+                            submit(path, downloader)
+                            running += 1
+                            break
+                    elif isinstance(status, BaseException):
+                        raise status
+                    else:
+                        yield path, status
+            finally:
+                # Stop running tasks, and do not start pending ones
+                abort.set()
+                pool.shutdown(wait=True, cancel_futures=True)
+                if loop is not None:
+                    asyncio.run_coroutine_threadsafe(
+                        self._cancel_all(), loop
+                    ).result()
+                    asyncio.run_coroutine_threadsafe(
+                        close_sessions(), loop
+                    ).result()
+                    loop.call_soon_threadsafe(loop.stop)
+                    loop_thread.join()
+                    loop.close()
+
+    @staticmethod
+    def abortable(downloader, abort=None):
+        """Iterate a downloader until `abort` is set"""
+        statuses = iter(downloader)
+        try:
+            for status in statuses:
+                if abort is not None and abort.is_set():
+                    return
+                yield status
+        finally:
+            statuses.close()
+
+    def guard(self, downloader, abort=None):
+        try:
+            yield from self.abortable(downloader, abort)
+        except Exception as exc:
+            lg.exception(
+                "Caught while downloading %s:", downloader.dst
+            )
+            yield {
+                "status": "error",
+                "message": str(exc.__class__.__name__),
+            }
+
+    @staticmethod
+    async def _cancel_all():
+        tasks = asyncio.all_tasks() - {asyncio.current_task()}
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
 
-    def guard(self, downloader):
+    async def aguard(self, downloader, statuses=None):
+        if statuses is None:
+            statuses = aiter(downloader)
         try:
-            yield from downloader
+            async for status in statuses:
+                yield status
         except Exception as exc:
             lg.exception(
                 "Caught while downloading %s:", downloader.dst
@@ -113,6 +290,8 @@ class DownloadManager:
                 "status": "error",
                 "message": str(exc.__class__.__name__),
             }
+        finally:
+            await statuses.aclose()
 
     def shortpath(self, paths):
         if len(paths) == 1:
@@ -1,10 +1,14 @@
+import io
 import requests
 import time
-from typing import Callable
+from typing import BinaryIO, Callable
 from email.utils import parsedate_to_datetime
 from urllib.parse import urlparse, ParseResult
 
 from braindataprep.download.constants import CHUNK_SIZE
+from braindataprep.download.session import RemoteInfo
+from braindataprep.download.session import get_session
+from braindataprep.download.session import get_remote_info
 
 
 class RemoteFile:
@@ -29,6 +33,7 @@ class RemoteFile:
             auth: Callable[[requests.Session], None] = None,
             chunk_size: int = CHUNK_SIZE,
             offset: int = 0,
+            length: int | None = None,
     ):
         """
         Parameters
@@ -36,49 +41,42 @@ class RemoteFile:
         url : str | ParseResult
             Remote URL
         session : Session
-            Opened session
+            Opened session (default: pooled session, see `get_session`)
         auth : callable[Session]
             Authentification function
         chunk_size : int
             Number of bytes to read at once
         offset : int
             Number of bytes to skip
+        length : int | None
+            Number of bytes to read (default: up to the end of the file).
+            Only used if the server accepts range requests.
         """
         if not isinstance(url, ParseResult):
             url = urlparse(url)
         self.url = url
-        self.session = session
-        self.session_is_mine = session is not None
-        self.auth = auth or (lambda x: None)
+        self.auth = auth
+        # Use a pooled session if none is provided. In both cases,
+        # the session is not ours to close.
+        self.session = session or get_session(url, auth)
         self.chunk_size = chunk_size
-        self.has_range = self._check_has_range()
         self.offset = offset
+        self.length = length
         self.response = None
         self.iterator = None
         self.buffer = None
         self.last_speed = None
         self.mean_speed = 0
 
-    def _check_has_range(self):
-        answer = False
-        if self.session is None:
-            self.session = requests.Session()
-            self.auth(self.session)
-        try:
-            h = {'Range': 'bytes=0-0'}
-            r = self.session.head(self.url.geturl(), headers=h)
-            if r.status_code in self.REDIRECTION:
-                self.url = urlparse(r.headers['Location'])
-                r = self.session.head(self.url.geturl(), headers=h)
-            if r.status_code not in (200, 206) and self.auth:
-                self.auth(self.session)
-                r = self.session.head(self.url.geturl(), headers=h)
-            answer = (r.status_code == 206)
-        finally:
-            if not self.session_is_mine:
-                self.session.close()
-                self.session = None
-            return answer
+    @property
+    def info(self) -> RemoteInfo:
+        """Metadata from a (cached) HEAD request"""
+        return get_remote_info(self.url, self.session, self.auth)
+
+    @property
+    def has_range(self) -> bool:
+        """Whether the server accepts range requests"""
+        return self.info.has_range
 
     @property
     def size(self):
@@ -93,25 +91,7 @@ class RemoteFile:
             else:
                 return None
         else:
-            size = None
-            if self.session is None:
-                self.session = requests.Session()
-                self.auth(self.session)
-            try:
-                r = self.session.head(self.url.geturl())
-                if r.status_code in self.REDIRECTION:
-                    self.url = urlparse(r.headers['Location'])
-                    r = self.session.head(self.url.geturl())
-                if r.status_code != 200 and self.auth:
-                    self.auth(self.session)
-                    r = self.session.head(self.url.geturl())
-                if r.status_code == 200 and 'Content-Length' in r.headers:
-                    size = int(r.headers['Content-Length'])
-            finally:
-                if not self.session_is_mine:
-                    self.session.close()
-                    self.session = None
-                return size
+            return self.info.size
 
     @property
     def mtime(self):
@@ -124,34 +104,15 @@ class RemoteFile:
             else:
                 return None
         else:
-            mtime = None
-            if self.session is None:
-                self.session = requests.Session()
-                self.auth(self.session)
-            try:
-                r = self.session.head(self.url.geturl())
-                if r.status_code in self.REDIRECTION:
-                    self.url = urlparse(r.headers['Location'])
-                    r = self.session.head(self.url.geturl())
-                if r.status_code != 200 and self.auth:
-                    self.auth(self.session)
-                    r = self.session.head(self.url.geturl())
-                if r.status_code == 200 and 'Last-Modified' in r.headers:
-                    mtime = parsedate_to_datetime(r.headers['Last-Modified'])
-            finally:
-                if not self.session_is_mine:
-                    self.session.close()
-                    self.session = None
-                return mtime
+            return self.info.mtime
 
     def __enter__(self):
-        # open session
-        if self.session is None:
-            self.session = requests.Session()
-            self.auth(self.session)
         # open content streamer
         h = {}
-        if self.offset and self.has_range:
+        if self.length is not None and self.has_range:
+            stop = self.offset + self.length - 1
+            h['Range'] = f'bytes={self.offset}-{stop}'
+        elif self.offset and self.has_range:
             h['Range'] = f'bytes={self.offset}-'
         self.response = self.session.get(
             self.url.geturl(), stream=True, headers=h
@@ -176,9 +137,6 @@ class RemoteFile:
         self.response.__exit__(exc_type, exc_val, exc_tb)
         self.response = None
         self.buffer = None
-        if not self.session_is_mine:
-            self.session.close()
-            self.session = None
 
     def _skip(self, nbytes):
         if self.buffer is None:
@@ -225,3 +183,79 @@ class RemoteFile:
             self.mean_speed = (self.total + nbytes) / self.mean_speed
         else:
             self.mean_speed = self.last_speed
+
+
+class RemoteStream(io.RawIOBase):
+    """
+    A read-only, non-seekable file object that exposes the bytes of an
+    opened `RemoteFile`. It can be passed to consumers that expect a
+    file object (e.g., `tarfile.open(fileobj=..., mode='r|gz')`), so
+    that remote archives are processed while they are downloaded.
+
+    If `tee` is provided, all bytes that go through the stream are
+    also written into it (e.g., to keep a local copy of the file).
+
+    ```python
+    with RemoteFile(url) as remote:
+        stream = RemoteStream(remote)
+        with tarfile.open(fileobj=stream, mode='r|gz') as tar:
+            for member in tar:
+                ...
+    ```
+    """
+
+    def __init__(self, remote: RemoteFile, tee: BinaryIO | None = None):
+        """
+        Parameters
+        ----------
+        remote : RemoteFile
+            An opened remote file
+        tee : file-like
+            An object with a `write` method, that receives a copy of
+            all the bytes that are read.
+        """
+        super().__init__()
+        self.remote = remote
+        self.tee = tee
+        self.iterator = iter(remote)
+        self.buffer = memoryview(b'')
+        self.total = 0
+
+    def readable(self) -> bool:
+        return True
+
+    def tell(self) -> int:
+        return self.total
+
+    def _next_chunk(self) -> bool:
+        try:
+            chunk = next(self.iterator)
+        except StopIteration:
+            return False
+        if self.tee is not None:
+            self.tee.write(chunk)
+        self.buffer = memoryview(chunk)
+        return True
+
+    def readinto(self, b) -> int:
+        while not self.buffer:
+            if not self._next_chunk():
+                return 0
+        nbytes = min(len(b), len(self.buffer))
+        b[:nbytes] = self.buffer[:nbytes]
+        self.buffer = self.buffer[nbytes:]
+        self.total += nbytes
+        return nbytes
+
+    def drain(self) -> int:
+        """
+        Consume the rest of the remote file (so that `tee` receives
+        all of it) and return the number of bytes that were skipped.
+        """
+        nbytes = len(self.buffer)
+        self.buffer = memoryview(b'')
+        while self._next_chunk():
+            nbytes += len(self.buffer)
+        self.buffer = memoryview(b'')
+        self.total += nbytes
+        return nbytes
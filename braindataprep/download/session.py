@@ -0,0 +1,150 @@
+import atexit
+import datetime
+import requests
+import threading
+from email.utils import parsedate_to_datetime
+from logging import getLogger
+from typing import Callable, NamedTuple
+from urllib.parse import urlparse, ParseResult
+from requests.adapters import HTTPAdapter
+
+lg = getLogger(__name__)
+
+
+# Number of hosts whose connections are kept alive (per session)
+POOL_CONNECTIONS: int = 16
+# Number of connections kept alive per host
+POOL_MAXSIZE: int = 64
+# Maximum number of HEAD records kept in memory
+HEAD_CACHE_SIZE: int = 1024 * 64
+
+_sessions: dict[tuple, requests.Session] = {}
+_heads: dict[str, "RemoteInfo"] = {}
+_lock = threading.Lock()
+
+
+class RemoteInfo(NamedTuple):
+    """Metadata of a remote file, as returned by a HEAD request"""
+    url: str                                # Final URL (after redirection)
+    size: int | None = None                 # Size in bytes
+    mtime: datetime.datetime | None = None  # Last-modified time
+    has_range: bool = False                 # Whether Range is accepted
+
+
+def new_session() -> requests.Session:
+    """
+    Create a new session whose connection pool is large enough to
+    serve many concurrent downloads.
+    """
+    session = requests.Session()
+    adapter = HTTPAdapter(
+        pool_connections=POOL_CONNECTIONS,
+        pool_maxsize=POOL_MAXSIZE,
+    )
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
+def get_session(
+    url: str | ParseResult,
+    auth: Callable[[requests.Session], None] | None = None,
+) -> requests.Session:
+    """
+    Return the process-wide session that serves a host.
+
+    Sessions are keyed by (scheme, host, auth) so that connections
+    (and TLS handshakes) are reused across files. They are closed when
+    the process exits.
+
+    Parameters
+    ----------
+    url : str | ParseResult
+        Any URL on the host
+    auth : callable[Session]
+        Authentification function, called once when the session is
+        created.
+
+    Returns
+    -------
+    session : requests.Session
+    """
+    if not isinstance(url, ParseResult):
+        url = urlparse(url)
+    key = (url.scheme, url.netloc, auth)
+    with _lock:
+        session = _sessions.get(key, None)
+        if session is None:
+            lg.debug(f'New pooled session for {url.scheme}://{url.netloc}')
+            session = _sessions[key] = new_session()
+            if auth:
+                auth(session)
+    return session
+
+
+@atexit.register
+def close_sessions() -> None:
+    """Close all pooled sessions"""
+    with _lock:
+        for session in _sessions.values():
+            session.close()
+        _sessions.clear()
+
+
+def get_remote_info(
+    url: str | ParseResult,
+    session: requests.Session | None = None,
+    auth: Callable[[requests.Session], None] | None = None,
+    refresh: bool = False,
+) -> RemoteInfo:
+    """
+    Return the (cached) metadata of a remote file.
+
+    A single `HEAD` request (with `Range: bytes=0-0`) is used to
+    guess the size, last-modified time and range support of the file.
+
+    Parameters
+    ----------
+    url : str | ParseResult
+        Remote URL
+    session : requests.Session
+        Opened session (default: pooled session)
+    auth : callable[Session]
+        Authentification function, called if the first request fails
+    refresh : bool
+        Ignore cached record
+
+    Returns
+    -------
+    info : RemoteInfo
+    """
+    if isinstance(url, ParseResult):
+        url = url.geturl()
+    if not refresh:
+        info = _heads.get(url, None)
+        if info is not None:
+            return info
+
+    session = session or get_session(url, auth)
+    h = {'Range': 'bytes=0-0'}
+    r = session.head(url, headers=h, allow_redirects=True)
+    if r.status_code not in (200, 206) and auth:
+        auth(session)
+        r = session.head(url, headers=h, allow_redirects=True)
+
+    size = mtime = None
+    if 'Content-Range' in r.headers:
+        size = r.headers['Content-Range'].split('/')[-1]
+        size = None if size == '*' else int(size)
+    elif r.status_code == 200 and 'Content-Length' in r.headers:
+        size = int(r.headers['Content-Length'])
+    if r.status_code in (200, 206) and 'Last-Modified' in r.headers:
+        mtime = parsedate_to_datetime(r.headers['Last-Modified'])
+    info = RemoteInfo(r.url, size, mtime, r.status_code == 206)
+
+    if r.status_code in (200, 206):
+        with _lock:
+            while len(_heads) >= HEAD_CACHE_SIZE:
+                del _heads[next(iter(_heads))]
+            _heads[url] = info
+    return info
@@ -0,0 +1,419 @@
+"""
+Integrity manifest of a dataset.
+
+The manifest (`{dataset}/.bdp/manifest.tsv.gz` by default) lists every
+file of the tree along with its size, mtime, digest and provenance
+(source archive and archive member). It can later be used to check
+that the tree is complete and unmodified:
+
+* in fast mode, files are only stat-ed, and their size and mtime are
+  compared to those in the manifest;
+* in full mode, files are also hashed, and their digest is compared
+  to that in the manifest.
+
+Both modes report missing, extra and modified/corrupted files.
+"""
+import csv
+import gzip
+import json
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from fnmatch import fnmatch
+from pathlib import Path
+from typing import Iterable, NamedTuple
+from cyclopts import App
+
+from braindataprep.digests import Digester
+from braindataprep.actions.state import Provenance
+from braindataprep.utils.path import get_tree_path
+from braindataprep.utils.log import setup_filelog
+
+from logging import getLogger
+lg = getLogger(__name__)
+
+
+# Name of the manifest file, under a `.bdp` folder
+MANIFEST_NAME: str = 'manifest.tsv.gz'
+MANIFEST_VERSION: int = 1
+
+# Number of threads used to list and stat the tree
+STAT_THREADS: int = 32
+
+# Paths (relative to the dataset root) excluded by default
+EXCLUDE: tuple[str, ...] = ('sourcedata',)
+
+# Files that are never part of the tree (caches, temporary files, ...)
+IGNORE: tuple[str, ...] = (
+    '.bdp', '*.tmp', '*.download', '*.lock', '*.checksum', '*.segments',
+    '*.index', '*.gzidx',
+)
+
+
+class Entry(NamedTuple):
+    """One file of the manifest"""
+    path: str                   # Path relative to the dataset root
+    size: int                   # Size, in bytes
+    mtime: int                  # Last-modified time, in nanoseconds
+    digest: str                 # Hex digest
+    source: str = ''            # Source file(s), separated by ';'
+    member: str = ''            # Archive member
+
+
+def _excluded(relpath: str, name: str, exclude: Iterable[str]) -> bool:
+    return (
+        any(fnmatch(name, pattern) for pattern in IGNORE) or
+        any(fnmatch(relpath, pattern) for pattern in exclude)
+    )
+
+
+def scan_tree(
+    root: str | Path,
+    exclude: Iterable[str] = EXCLUDE,
+    jobs: int | None = None,
+) -> dict[str, tuple[int, int]]:
+    """
+    List all files of a tree, with their size and mtime.
+
+    Directories are scanned level by level, and all directories of a
+    level are scanned in parallel.
+
+    Parameters
+    ----------
+    root : str | Path
+        Root of the tree
+    exclude : list[str]
+        Patterns of relative paths to exclude
+    jobs : int
+        Number of threads (default: `STAT_THREADS`)
+
+    Returns
+    -------
+    files : dict[str, (int, int)]
+        Mapping from relative path to (size, mtime in nanoseconds)
+    """
+    root = Path(root)
+    exclude = list(exclude)
+
+    def scan(reldir: str) -> tuple[list, list]:
+        files, subdirs = [], []
+        try:
+            with os.scandir(root / reldir) as entries:
+                for entry in entries:
+                    relpath = entry.name
+                    if reldir:
+                        relpath = f'{reldir}/{relpath}'
+                    if _excluded(relpath, entry.name, exclude):
+                        continue
+                    try:
+                        if entry.is_dir():
+                            subdirs.append(relpath)
+                            continue
+                        stat = entry.stat()
+                    except OSError as e:
+                        lg.warning(f'Cannot stat {relpath}: {e}')
+                        continue
+                    files.append((relpath, (stat.st_size, stat.st_mtime_ns)))
+        except OSError as e:
+            lg.warning(f'Cannot list {reldir or root}: {e}')
+        return files, subdirs
+
+    files = {}
+    level = ['']
+    with ThreadPoolExecutor(jobs or STAT_THREADS) as pool:
+        while level:
+            nextlevel = []
+            for found, subdirs in pool.map(scan, level):
+                files.update(found)
+                nextlevel.extend(subdirs)
+            level = nextlevel
+    return files
+
+
+def read_manifest(path: str | Path) -> tuple[dict, dict[str, Entry]]:
+    """
+    Read a manifest.
+
+    Returns
+    -------
+    header : dict
+        Manifest options (`version`, `digest`, `exclude`)
+    entries : dict[str, Entry]
+        Mapping from relative path to entry
+    """
+    with gzip.open(path, 'rt', newline='') as f:
+        header = json.loads(f.readline().lstrip('#'))
+        if header.get('version') != MANIFEST_VERSION:
+            raise ValueError(
+                f'Unsupported manifest version: {header.get("version")}'
+            )
+        reader = csv.reader(f, delimiter='\t')
+        next(reader)  # column names
+        entries = {}
+        for path, size, mtime, digest, source, member in reader:
+            entries[path] = Entry(
+                path, int(size), int(mtime), digest, source, member
+            )
+    return header, entries
+
+
+def write_manifest(
+    root: str | Path,
+    output: str | Path | None = None,
+    *,
+    digest: str = 'sha256',
+    exclude: Iterable[str] = EXCLUDE,
+    rehash: bool = False,
+    jobs: int | None = None,
+) -> dict[str, Entry]:
+    """
+    Write the manifest of a dataset.
+
+    Files whose size and mtime match those recorded in the previous
+    manifest are not hashed again. Other digests are computed by a
+    `Digester`, and therefore served from the digest cache when
+    possible.
+
+    Parameters
+    ----------
+    root : str | Path
+        Dataset root
+    output : str | Path
+        Output path (default: `{root}/.bdp/manifest.tsv.gz`)
+    digest : str
+        Hashing algorithm
+    exclude : list[str]
+        Patterns of relative paths to exclude
+    rehash : bool
+        Hash all files, even if they are unchanged since the previous
+        manifest
+    jobs : int
+        Number of files hashed in parallel
+
+    Returns
+    -------
+    entries : dict[str, Entry]
+        Mapping from relative path to entry
+    """
+    root = Path(root)
+    output = Path(output or root / '.bdp' / MANIFEST_NAME)
+    exclude = list(exclude)
+
+    # Previous manifest
+    previous = {}
+    if output.exists() and not rehash:
+        try:
+            header, previous = read_manifest(output)
+            if header.get('digest') != digest:
+                previous = {}
+        except (OSError, ValueError) as e:
+            lg.warning(f'Cannot read previous manifest {output}: {e}')
+
+    # Provenance
+    provenance = Provenance(root)
+    try:
+        sources = dict(provenance.items())
+    finally:
+        provenance.close()
+
+    # List tree
+    files = scan_tree(root, exclude)
+    lg.info(f'{root}: {len(files)} files')
+
+    # Hash new or modified files
+    digests = {}
+    tohash = []
+    for path, (size, mtime) in files.items():
+        entry = previous.get(path, None)
+        if entry and (entry.size, entry.mtime) == (size, mtime):
+            digests[path] = entry.digest
+        else:
+            tohash.append(path)
+    lg.info(f'{root}: hashing {len(tohash)} files')
+    digester = Digester([digest])
+    paths = (root / path for path in tohash)
+    for path, value in zip(tohash, digester.map(paths, jobs)):
+        digests[path] = value[digest]
+
+    # Write manifest
+    entries = {}
+    for path in sorted(files):
+        size, mtime = files[path]
+        src, member = sources.get(path, ([], None))
+        entries[path] = Entry(
+            path, size, mtime, digests[path], ';'.join(src), member or ''
+        )
+
+    header = {
+        'version': MANIFEST_VERSION,
+        'digest': digest,
+        'exclude': exclude,
+    }
+    output.parent.mkdir(parents=True, exist_ok=True)
+    tmppath = output.with_name(output.name + '.tmp')
+    with gzip.open(tmppath, 'wt', newline='') as f:
+        f.write('#' + json.dumps(header) + '\n')
+        writer = csv.writer(f, delimiter='\t', lineterminator='\n')
+        writer.writerow(['path', 'size', 'mtime', digest, 'source', 'member'])
+        writer.writerows(entries.values())
+    tmppath.replace(output)
+    lg.info(f'Manifest written to {output}')
+    return entries
+
+
+def verify_manifest(
+    root: str | Path,
+    manifest: str | Path | None = None,
+    *,
+    full: bool = False,
+    jobs: int | None = None,
+) -> dict[str, list[str]]:
+    """
+    Check a dataset against its manifest.
+
+    Parameters
+    ----------
+    root : str | Path
+        Dataset root
+    manifest : str | Path
+        Path to manifest (default: `{root}/.bdp/manifest.tsv.gz`)
+    full : bool
+        Hash all files and compare their digests. Otherwise, only
+        compare their size and mtime.
+    jobs : int
+        Number of files hashed in parallel
+
+    Returns
+    -------
+    report : dict[str, list[str]]
+        Relative paths of `"missing"`, `"extra"`, `"modified"`
+        (size or mtime differs) and `"corrupted"` (digest differs)
+        files. Files are only reported as corrupted in full mode.
+    """
+    root = Path(root)
+    manifest = Path(manifest or root / '.bdp' / MANIFEST_NAME)
+    header, entries = read_manifest(manifest)
+    files = scan_tree(root, header.get('exclude', EXCLUDE))
+
+    report = {
+        'missing': sorted(set(entries) - set(files)),
+        'extra': sorted(set(files) - set(entries)),
+        'modified': [],
+        'corrupted': [],
+    }
+    common = sorted(set(files) & set(entries))
+
+    if not full:
+        report['modified'] = [
+            path for path in common
+            if files[path] != (entries[path].size, entries[path].mtime)
+        ]
+        return report
+
+    # Files whose size differs cannot have the same digest
+    algo = header['digest']
+    tohash = []
+    for path in common:
+        if files[path][0] != entries[path].size:
+            report['corrupted'].append(path)
+        else:
+            tohash.append(path)
+    digester = Digester([algo], cache=False)
+    paths = (root / path for path in tohash)
+    for path, value in zip(tohash, digester.map(paths, jobs)):
+        if value[algo] != entries[path].digest:
+            report['corrupted'].append(path)
+    report['corrupted'].sort()
+    return report
+
+
+def manifest_commands(app: App, dataset: str) -> None:
+    """Register the `manifest` and `verify` commands of a dataset"""
+
+    @app.command
+    def manifest(
+        path: str | None = None,
+        *,
+        output: str | None = None,
+        digest: str = 'sha256',
+        exclude: Iterable[str] = EXCLUDE,
+        rehash: bool = False,
+        jobs: int | None = None,
+        log: str | None = None,
+    ):
+        """
+        Write the integrity manifest of the dataset.
+
+        The manifest lists the path, size, mtime, digest, source archive
+        and source member of every file of the tree.
+
+        Parameters
+        ----------
+        path : str
+            Path to root of all datasets.
+        output : str
+            Path to manifest (default: `{dataset}/.bdp/manifest.tsv.gz`)
+        digest : str
+            Hashing algorithm
+        exclude : [list of] str
+            Patterns of paths (relative to the dataset) to exclude
+        rehash : bool
+            Hash all files, even those that are unchanged since the
+            previous manifest
+        jobs : int
+            Number of files hashed in parallel
+        log : str
+            Path to log file
+        """
+        setup_filelog(log)
+        if isinstance(exclude, str):
+            exclude = [exclude]
+        write_manifest(
+            get_tree_path(path) / dataset, output,
+            digest=digest, exclude=exclude, rehash=rehash, jobs=jobs,
+        )
+
+    @app.command
+    def verify(
+        path: str | None = None,
+        *,
+        manifest: str | None = None,
+        full: bool = False,
+        jobs: int | None = None,
+        log: str | None = None,
+    ):
+        """
+        Check the dataset against its integrity manifest.
+
+        Report missing, extra and modified (fast mode) or corrupted
+        (full mode) files.
+
+        Parameters
+        ----------
+        path : str
+            Path to root of all datasets.
+        manifest : str
+            Path to manifest (default: `{dataset}/.bdp/manifest.tsv.gz`)
+        full : bool
+            Hash all files and compare their digests, instead of only
+            comparing their size and mtime
+        jobs : int
+            Number of files hashed in parallel
+        log : str
+            Path to log file
+        """
+        setup_filelog(log)
+        root = get_tree_path(path) / dataset
+        manifest = Path(manifest or root / '.bdp' / MANIFEST_NAME)
+        if not manifest.exists():
+            lg.error(f'Manifest not found: {manifest}')
+            sys.exit(1)
+        report = verify_manifest(root, manifest, full=full, jobs=jobs)
+        for kind, paths in report.items():
+            for relpath in paths:
+                lg.warning(f'{kind}: {relpath}')
+        summary = ', '.join(f'{len(v)} {k}' for k, v in report.items())
+        if any(report.values()):
+            lg.error(f'{dataset}: {summary}')
+            sys.exit(1)
+        lg.info(f'{dataset}: OK')
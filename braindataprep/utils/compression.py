@@ -0,0 +1,482 @@
+"""
+Compression of the volumes written by braindataprep.
+
+All gzip-compressed NIfTI (and MGH) outputs are written through
+`open_compressed` or `save_image`, which use the current compression
+settings (see `set_compression`):
+
+* `level` : gzip compression level, from 0 (no compression) to 9
+  (best compression). Low levels are much faster, e.g., for scratch
+  builds. The default (1) is that of nibabel.
+* `threads` : number of threads used to compress each file. If larger
+  than one, files are compressed by a `ParallelGzipFile`, which splits
+  the stream into blocks that are compressed in parallel (like `pigz`)
+  but still form a standard gzip file.
+
+`reframe_gzip` replaces the beginning (e.g., the header) of a gzip
+file without recompressing the rest of the stream.
+"""
+import io
+import struct
+import threading
+import zlib
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from logging import getLogger
+from pathlib import Path
+from typing import IO
+
+import nibabel
+from nibabel.openers import ImageOpener
+
+lg = getLogger(__name__)
+
+
+# Default compression level (same as nibabel)
+COMPRESSION_LEVEL: int = 1
+
+# Size of the blocks that are compressed in parallel
+BLOCK_SIZE: int = 512 * 1024
+
+# Size of the deflate window, primed with the end of the previous block
+DICT_SIZE: int = 32 * 1024
+
+# Amount of compressed data in which `reframe_gzip` looks for a sync point
+SYNC_SEARCH_SIZE: int = 16 * 1024 * 1024
+
+# Amount of compressed data used to check a candidate sync point
+SYNC_CHECK_SIZE: int = 64 * 1024
+
+# Byte-aligned end of an empty stored block (written by sync flushes)
+_SYNC_MARKER = b'\x00\x00\xff\xff'
+
+_settings = {'level': COMPRESSION_LEVEL, 'threads': 1}
+
+# Thread pools shared by all compressed files (one per number of threads)
+_pools: dict[int, ThreadPoolExecutor] = {}
+_pools_lock = threading.Lock()
+
+
+def get_compression() -> dict:
+    """Return the current compression settings (`level`, `threads`)"""
+    return dict(_settings)
+
+
+def set_compression(
+    level: int | None = None, threads: int | None = None
+) -> dict:
+    """
+    Set the compression settings of all written volumes.
+
+    Parameters
+    ----------
+    level : int
+        Gzip compression level, from 0 (none) to 9 (best).
+        Unchanged if None.
+    threads : int
+        Number of threads used to compress each file.
+        Unchanged if None.
+
+    Returns
+    -------
+    settings : dict
+        New settings
+    """
+    if level is not None:
+        if not 0 <= level <= 9:
+            raise ValueError(f'Compression level must be in 0..9: {level}')
+        _settings['level'] = int(level)
+    if threads is not None:
+        _settings['threads'] = max(1, int(threads))
+    return get_compression()
+
+
+def _get_pool(threads: int) -> ThreadPoolExecutor:
+    with _pools_lock:
+        if threads not in _pools:
+            _pools[threads] = ThreadPoolExecutor(threads, 'gzip')
+        return _pools[threads]
+
+
+def _deflate(block: bytes, zdict: bytes, level: int, last: bool) -> bytes:
+    """Compress a block into a raw deflate stream"""
+    if zdict:
+        compressor = zlib.compressobj(
+            level, zlib.DEFLATED, -zlib.MAX_WBITS, zdict=zdict
+        )
+    else:
+        compressor = zlib.compressobj(level, zlib.DEFLATED, -zlib.MAX_WBITS)
+    # A sync flush ends the block on a byte boundary, without marking
+    # it as final, so that the next block can be appended.
+    flush = zlib.Z_FINISH if last else zlib.Z_SYNC_FLUSH
+    return compressor.compress(block) + compressor.flush(flush)
+
+
+class ParallelGzipFile(io.BufferedIOBase):
+    """
+    A write-only gzip file whose blocks are compressed in parallel.
+
+    The uncompressed stream is split into blocks that are deflated by
+    a pool of threads, each with the end of the previous block as
+    dictionary (like `pigz`). The compressed blocks are concatenated
+    in order into a single, standard, gzip member. The output only
+    depends on the data, the compression level and the block size, and
+    not on the number of threads.
+
+    Only forward seeks are supported (the gap is filled with zeros).
+
+    ```python
+    with ParallelGzipFile('volume.nii.gz', threads=4) as f:
+        f.write(data)
+    ```
+    """
+
+    def __init__(
+        self,
+        filename: str | Path | None = None,
+        mode: str = 'wb',
+        compresslevel: int = COMPRESSION_LEVEL,
+        fileobj: IO[bytes] | None = None,
+        *,
+        threads: int = 1,
+        blocksize: int = BLOCK_SIZE,
+        mtime: int = 0,
+    ):
+        """
+        Parameters
+        ----------
+        filename : str | Path
+            Output path
+        mode : {'wb'}
+            Only writing is supported
+        compresslevel : int
+            Compression level, from 0 (none) to 9 (best)
+        fileobj : file-like
+            Output file object, used instead of `filename`
+        threads : int
+            Number of compression threads
+        blocksize : int
+            Size of the uncompressed blocks
+        mtime : int
+            Modification time stored in the gzip header
+        """
+        super().__init__()
+        if mode not in ('w', 'wb'):
+            raise ValueError(f'Unsupported mode: {mode}')
+        self._owned = fileobj is None
+        if fileobj is None:
+            fileobj = open(filename, 'wb')
+        self.fileobj = fileobj
+        self.name = str(filename or getattr(fileobj, 'name', ''))
+        self.level = compresslevel
+        self.threads = max(1, threads)
+        self.blocksize = blocksize
+        self._pool = _get_pool(self.threads)
+        self._pending = deque()
+        self._buffer = bytearray()
+        self._zdict = b''
+        self._crc = 0
+        self._size = 0
+
+        # Gzip header (no file name)
+        self.fileobj.write(_gzip_header(mtime, compresslevel))
+
+    def writable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def tell(self) -> int:
+        return self._size
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        if whence == io.SEEK_CUR:
+            offset = self._size + offset
+        elif whence != io.SEEK_SET:
+            raise OSError('Seek from end not supported')
+        if offset < self._size:
+            raise OSError('Negative seek in write mode')
+        while self._size < offset:
+            self.write(bytes(min(offset - self._size, self.blocksize)))
+        return self._size
+
+    def write(self, data) -> int:
+        if self.closed:
+            raise ValueError('write to closed file')
+        data = memoryview(data).cast('B')
+        nbytes = len(data)
+        self._crc = zlib.crc32(data, self._crc)
+        self._size += nbytes
+        # Complete the pending block
+        if self._buffer:
+            missing = self.blocksize - len(self._buffer)
+            self._buffer += data[:missing]
+            data = data[missing:]
+            if len(self._buffer) < self.blocksize:
+                return nbytes
+            self._submit(bytes(self._buffer))
+            self._buffer = bytearray()
+        # Submit full blocks straight from the input
+        while len(data) >= self.blocksize:
+            self._submit(bytes(data[:self.blocksize]))
+            data = data[self.blocksize:]
+        self._buffer += data
+        return nbytes
+
+    def _submit(self, block: bytes, last: bool = False) -> None:
+        zdict, self._zdict = self._zdict, block[-DICT_SIZE:]
+        self._pending.append(
+            self._pool.submit(_deflate, block, zdict, self.level, last)
+        )
+        # Write compressed blocks in order, and bound memory usage
+        while self._pending and (
+            len(self._pending) > 2 * self.threads or self._pending[0].done()
+        ):
+            self.fileobj.write(self._pending.popleft().result())
+
+    def flush(self) -> None:
+        # Incomplete blocks are only compressed once the file is closed
+        if not self.fileobj.closed:
+            self.fileobj.flush()
+
+    def close(self) -> None:
+        if self.closed:
+            return
+        try:
+            self._submit(bytes(self._buffer), last=True)
+            self._buffer = bytearray()
+            while self._pending:
+                self.fileobj.write(self._pending.popleft().result())
+            self.fileobj.write(
+                struct.pack('<II', self._crc, self._size & 0xFFFFFFFF)
+            )
+            self.fileobj.flush()
+        finally:
+            if self._owned:
+                self.fileobj.close()
+            super().close()
+
+
+def open_compressed(path: str | Path) -> IO[bytes]:
+    """
+    Open a file for writing, using the current compression settings if
+    its extension is `.gz`.
+    """
+    path = str(path)
+    if not path.lower().endswith('.gz'):
+        return open(path, 'wb')
+    level, threads = _settings['level'], _settings['threads']
+    if threads > 1:
+        return ParallelGzipFile(path, compresslevel=level, threads=threads)
+    return ImageOpener(path, 'wb', compresslevel=level)
+
+
+def save_image(img: nibabel.spatialimages.SpatialImage, dst: str | Path):
+    """
+    Save a nibabel image, using the current compression settings.
+
+    Parameters
+    ----------
+    img : nibabel.SpatialImage
+        Image, whose type must match the extension of `dst`
+    dst : str | Path
+        Output path
+    """
+    if len(img.files_types) != 1 or not str(dst).lower().endswith('.gz'):
+        # Uncompressed, or made of several files (e.g., Analyze pair)
+        nibabel.save(img, dst)
+        return
+    with open_compressed(dst) as f:
+        img.to_file_map({
+            key: nibabel.FileHolder(filename=str(dst), fileobj=f)
+            for key, _ in img.files_types
+        })
+
+
+def _gzip_header(mtime: int = 0, level: int = COMPRESSION_LEVEL) -> bytes:
+    """Minimal gzip header (no file name)"""
+    xfl = {1: b'\x04', 9: b'\x02'}.get(level, b'\x00')
+    return b'\x1f\x8b\x08\x00' + struct.pack('<I', mtime) + xfl + b'\xff'
+
+
+def _skip_gzip_header(f: IO[bytes]) -> bool:
+    """Move past the header of a gzip member. Return False if invalid."""
+    header = f.read(10)
+    if len(header) < 10 or header[:3] != b'\x1f\x8b\x08':
+        return False
+    flags = header[3]
+    if flags & 4:  # FEXTRA
+        xlen, = struct.unpack('<H', f.read(2))
+        f.seek(xlen, io.SEEK_CUR)
+    for flag in (8, 16):  # FNAME, FCOMMENT
+        if flags & flag:
+            while f.read(1) not in (b'\x00', b''):
+                pass
+    if flags & 2:  # FHCRC
+        f.seek(2, io.SEEK_CUR)
+    return True
+
+
+def _gf2_times(matrix: list[int], vector: int) -> int:
+    total, i = 0, 0
+    while vector:
+        if vector & 1:
+            total ^= matrix[i]
+        vector >>= 1
+        i += 1
+    return total
+
+
+def _gf2_square(matrix: list[int]) -> list[int]:
+    return [_gf2_times(matrix, row) for row in matrix]
+
+
+def crc32_combine(crc1: int, crc2: int, len2: int) -> int:
+    """
+    CRC-32 of the concatenation of two byte strings, from their CRCs
+    and the length of the second one (as zlib's `crc32_combine`).
+    """
+    if len2 <= 0:
+        return crc1
+    # operator for one zero bit, then two and four zero bits
+    odd = [0xEDB88320] + [1 << n for n in range(31)]
+    even = _gf2_square(odd)
+    odd = _gf2_square(even)
+    # apply len2 zero bytes to crc1
+    while True:
+        even = _gf2_square(odd)
+        if len2 & 1:
+            crc1 = _gf2_times(even, crc1)
+        len2 >>= 1
+        if not len2:
+            break
+        odd = _gf2_square(even)
+        if len2 & 1:
+            crc1 = _gf2_times(odd, crc1)
+        len2 >>= 1
+        if not len2:
+            break
+    return crc1 ^ crc2
+
+
+def _is_sync_point(inflater, window: bytes, compressed: bytes) -> bool:
+    """
+    Check that a (byte-aligned) position of a deflate stream is a block
+    boundary, by inflating what follows it from scratch (with the
+    previous 32 KiB of data as dictionary) and comparing the result
+    with the continuation of the stream.
+    """
+    expected = inflater.copy().decompress(compressed)
+    try:
+        probe = zlib.decompressobj(-zlib.MAX_WBITS, zdict=window)
+        found = probe.decompress(compressed)
+    except zlib.error:
+        return False
+    return bool(expected) and found == expected
+
+
+def reframe_gzip(
+    src: IO[bytes],
+    dst: str | Path,
+    prefix: bytes,
+    offset: int,
+    size: int | None = None,
+) -> bool:
+    """
+    Replace the first bytes of a gzip file, without recompressing the
+    rest of its data.
+
+    The deflate stream of `src` is cut at its first sync point (the
+    empty stored block that ends each block written by `pigz` or by
+    `ParallelGzipFile`) that is at least 32 KiB past `offset`, so that
+    no later data refers to the replaced bytes. Only the data before
+    this point is decompressed and recompressed (with `prefix` instead
+    of its first `offset` bytes); the rest of the compressed stream is
+    copied as is, and the trailer is recomputed without decompressing
+    it.
+
+    Nothing is written if the stream cannot be cut (e.g., a file
+    written by a single-threaded gzip, which has no sync point).
+
+    Parameters
+    ----------
+    src : file-like
+        Seekable gzip file, made of a single member
+    dst : str | Path
+        Output path
+    prefix : bytes
+        New (uncompressed) beginning of the file
+    offset : int
+        Number of (uncompressed) bytes replaced by `prefix`
+    size : int
+        Expected uncompressed size of `src`, used to check that the
+        file has a single member. Required if larger than 4 GiB.
+
+    Returns
+    -------
+    success : bool
+    """
+    src.seek(0, io.SEEK_END)
+    end = src.tell() - 8
+    src.seek(0)
+    if not _skip_gzip_header(src):
+        return False
+    start = src.tell()
+    src.seek(end)
+    crc, isize = struct.unpack('<II', src.read(8))
+    if size is None:
+        size = isize
+    elif size & 0xFFFFFFFF != isize:
+        return False
+
+    # Decompress up to the first usable sync point
+    src.seek(start)
+    head = src.read(max(0, min(SYNC_SEARCH_SIZE, end - start)))
+    inflater = zlib.decompressobj(-zlib.MAX_WBITS)
+    data = bytearray()
+    pos = 0
+    while True:
+        marker = head.find(_SYNC_MARKER, pos)
+        if marker < 0:
+            return False
+        cut = marker + len(_SYNC_MARKER)
+        try:
+            data += inflater.decompress(head[pos:cut])
+        except zlib.error:
+            return False
+        pos = cut
+        if inflater.eof:
+            return False
+        if len(data) < offset + DICT_SIZE:
+            continue
+        window = bytes(data[-DICT_SIZE:])
+        if _is_sync_point(inflater, window, head[cut:cut + SYNC_CHECK_SIZE]):
+            break
+
+    # Recompress the new beginning, and recompute the trailer:
+    # crc(tail) = crc(old) ^ shift(crc(old head)), and
+    # crc(new) = shift(crc(new head)) ^ crc(tail)
+    tailsize = size - len(data)
+    newhead = prefix + data[offset:]
+    tailcrc = crc32_combine(zlib.crc32(data), crc, tailsize)
+    crc = crc32_combine(zlib.crc32(newhead), tailcrc, tailsize)
+    size = len(newhead) + tailsize
+    level = _settings['level']
+    compressor = zlib.compressobj(level, zlib.DEFLATED, -zlib.MAX_WBITS)
+
+    lg.debug(f'Reframe {getattr(src, "name", src)} -> {dst}')
+    with open(dst, 'wb') as f:
+        f.write(_gzip_header(level=level))
+        f.write(compressor.compress(newhead))
+        f.write(compressor.flush(zlib.Z_SYNC_FLUSH))
+        src.seek(start + cut)
+        remaining = end - start - cut
+        while remaining:
+            chunk = src.read(min(remaining, BLOCK_SIZE))
+            if not chunk:
+                raise EOFError(f'Truncated gzip file: {src}')
+            f.write(chunk)
+            remaining -= len(chunk)
+        f.write(struct.pack('<II', crc, size & 0xFFFFFFFF))
+    return True
@@ -0,0 +1,273 @@
+"""
+Random access into gzip files.
+
+Seeking backward in a `gzip.GzipFile` rewinds the stream and inflates
+it again from the start. `SeekableGzipFile` instead keeps checkpoints
+of the decompressor state every `SPACING` bytes (the "zran" approach),
+so that any position can be reached by inflating at most `SPACING`
+bytes.
+
+If `indexed_gzip` is installed, it is used as backend and its index
+is saved next to the archive (`{archive}.gzidx`), so that it is only
+built once. Otherwise, checkpoints are kept in memory for the lifetime
+of the process.
+"""
+import io
+import os
+import threading
+import zlib
+from bisect import bisect_right
+from logging import getLogger
+from pathlib import Path
+from typing import NamedTuple
+
+lg = getLogger(__name__)
+
+try:
+    import indexed_gzip
+except ImportError:
+    indexed_gzip = None
+
+
+# Distance between two checkpoints, in uncompressed bytes
+SPACING: int = 16 * 1024 * 1024
+# Number of compressed bytes read at once
+CHUNK_SIZE: int = 64 * 1024
+# Maximum number of files whose (in-memory) checkpoints are kept
+CACHE_SIZE: int = 64
+
+_checkpoints: dict[tuple, list["Checkpoint"]] = {}
+# Protects the cache and its (sorted) lists, shared by files opened
+# in different threads
+_checkpoints_lock = threading.Lock()
+
+
+class Checkpoint(NamedTuple):
+    """State of the decompressor at a given position"""
+    offset: int                 # Uncompressed offset
+    raw_offset: int             # Compressed offset (bytes read so far)
+    state: "zlib._Decompress"   # Copy of the decompressor
+
+
+def is_gzip(path: str | Path) -> bool:
+    """Whether a file starts with the gzip magic number"""
+    with open(path, 'rb') as f:
+        return f.read(2) == b'\x1f\x8b'
+
+
+def open_gzip(filename: str | Path, **kwargs) -> io.BufferedReader:
+    """
+    Open a gzip file for (buffered) random access.
+    Keywords are passed to `SeekableGzipFile`.
+
+    ```python
+    with open_gzip('archive.tar.gz') as f:
+        with tarfile.open(fileobj=f, mode='r:') as tar:
+            ...
+    ```
+    """
+    return io.BufferedReader(
+        SeekableGzipFile(filename, **kwargs), buffer_size=CHUNK_SIZE
+    )
+
+
+class SeekableGzipFile(io.RawIOBase):
+    """
+    A read-only gzip file that supports fast random access.
+
+    Like all raw streams, `readinto` may return fewer bytes than
+    requested. Use `open_gzip` to get a buffered reader.
+    """
+
+    def __init__(
+        self,
+        filename: str | Path,
+        index: str | Path | None = None,
+        *,
+        spacing: int = SPACING,
+        save: bool = True,
+    ):
+        """
+        Parameters
+        ----------
+        filename : str | Path
+            Path to the gzip file
+        index : str | Path
+            Path to the saved index (default: `{filename}.gzidx`).
+            Only used by the `indexed_gzip` backend.
+        spacing : int
+            Distance between two checkpoints, in uncompressed bytes
+        save : bool
+            Save the index when the file is closed, if it has grown.
+            Only used by the `indexed_gzip` backend.
+        """
+        super().__init__()
+        self.name = str(filename)
+        self.indexpath = Path(index or self.name + '.gzidx')
+        self.spacing = spacing
+        self.saveindex = save
+        stat = os.stat(self.name)
+        self.stamp = (self.name, stat.st_size, stat.st_mtime_ns)
+
+        if indexed_gzip is not None:
+            self._init_indexed_gzip()
+        else:
+            self._init_zlib()
+
+    # ------------------------------------------------------------------
+    #   indexed_gzip backend
+    # ------------------------------------------------------------------
+    def _init_indexed_gzip(self):
+        self.file = indexed_gzip.IndexedGzipFile(
+            self.name, spacing=self.spacing
+        )
+        self.nb_points = 0
+        if (
+            self.indexpath.exists() and
+            os.stat(self.indexpath).st_mtime_ns >= self.stamp[2]
+        ):
+            try:
+                self.file.import_index(str(self.indexpath))
+                self.nb_points = len(list(self.file.seek_points()))
+                lg.debug(f'Loaded gzip index {self.indexpath}')
+            except Exception as e:
+                lg.warning(f'Could not load gzip index {self.indexpath}: {e}')
+
+    def _save_indexed_gzip(self):
+        try:
+            nb_points = len(list(self.file.seek_points()))
+            if nb_points > self.nb_points:
+                tmppath = self.indexpath.with_name(
+                    self.indexpath.name + '.tmp'
+                )
+                self.file.export_index(str(tmppath))
+                tmppath.replace(self.indexpath)
+                self.nb_points = nb_points
+        except Exception as e:
+            lg.warning(f'Could not save gzip index {self.indexpath}: {e}')
+
+    # ------------------------------------------------------------------
+    #   zlib backend
+    # ------------------------------------------------------------------
+    def _init_zlib(self):
+        self.file = None
+        self.raw = open(self.name, 'rb')
+        # Checkpoints are shared by all files opened on the same archive
+        with _checkpoints_lock:
+            points = _checkpoints.get(self.stamp, None)
+            if points is None:
+                while len(_checkpoints) >= CACHE_SIZE:
+                    del _checkpoints[next(iter(_checkpoints))]
+                points = _checkpoints[self.stamp] = [
+                    Checkpoint(0, 0, zlib.decompressobj(zlib.MAX_WBITS | 16))
+                ]
+        self.points = points
+        self._restore(points[0])
+
+    def _restore(self, point: Checkpoint):
+        self.raw.seek(point.raw_offset)
+        self.decompressor = point.state.copy()
+        self.stream_offset = point.offset
+        self.buffer = memoryview(b'')
+
+    def _inflate(self, size: int) -> bytes:
+        """Inflate (at most `size`) bytes, and checkpoint if needed"""
+        while True:
+            d = self.decompressor
+            if d.eof:
+                # end of a gzip member: start the next one (if any)
+                data = d.unused_data or self.raw.read(CHUNK_SIZE)
+                if not data.lstrip(b'\x00'):
+                    return b''
+                self.decompressor = d = zlib.decompressobj(
+                    zlib.MAX_WBITS | 16
+                )
+            elif d.unconsumed_tail:
+                data = d.unconsumed_tail
+            else:
+                data = self.raw.read(CHUNK_SIZE)
+                if not data:
+                    raise EOFError(
+                        'Compressed file ended before the end-of-stream '
+                        'marker was reached'
+                    )
+            out = d.decompress(data, size)
+            if not out:
+                continue
+            self.stream_offset += len(out)
+            # Check and append atomically, so that the list stays sorted
+            # when other threads extend it
+            with _checkpoints_lock:
+                if self.stream_offset >= self.points[-1].offset + self.spacing:
+                    self.points.append(Checkpoint(
+                        self.stream_offset, self.raw.tell(), d.copy()
+                    ))
+            return out
+
+    # ------------------------------------------------------------------
+    #   RawIOBase API
+    # ------------------------------------------------------------------
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def tell(self) -> int:
+        if self.file is not None:
+            return self.file.tell()
+        return self.stream_offset - len(self.buffer)
+
+    def readinto(self, b) -> int:
+        if self.file is not None:
+            return self.file.readinto(b)
+        if not self.buffer:
+            self.buffer = memoryview(self._inflate(max(len(b), CHUNK_SIZE)))
+        nbytes = min(len(b), len(self.buffer))
+        b[:nbytes] = self.buffer[:nbytes]
+        self.buffer = self.buffer[nbytes:]
+        return nbytes
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        if self.file is not None:
+            return self.file.seek(offset, whence)
+        if whence == io.SEEK_CUR:
+            offset += self.tell()
+        elif whence == io.SEEK_END:
+            raise io.UnsupportedOperation('cannot seek from end')
+        if offset < 0:
+            raise ValueError('negative seek position')
+
+        # Restore the last checkpoint before the target, unless the
+        # current position is closer
+        position = self.tell()
+        with _checkpoints_lock:
+            point = self.points[bisect_right(
+                self.points, offset, key=lambda p: p.offset
+            ) - 1]
+        if not (point.offset <= position <= offset):
+            self._restore(point)
+            position = point.offset
+
+        # Inflate up to the target
+        skip = offset - position
+        while skip:
+            if not self.buffer:
+                self.buffer = memoryview(self._inflate(CHUNK_SIZE))
+                if not self.buffer:
+                    break
+            nbytes = min(skip, len(self.buffer))
+            self.buffer = self.buffer[nbytes:]
+            skip -= nbytes
+        return self.tell()
+
+    def close(self):
+        if self.closed:
+            return
+        if self.file is not None:
+            if self.saveindex:
+                self._save_indexed_gzip()
+            self.file.close()
+        else:
+            self.raw.close()
+        super().close()
@@ -1,16 +1,45 @@
+import io
 import os
 import csv
 import json
+import errno
+import stat
+import tarfile
 import logging
+import shutil
+import threading
 import nibabel
 import numpy as np
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
+from nibabel.arrayproxy import ArrayProxy
+from nibabel.arraywriters import get_slope_inter, make_array_writer
+from nibabel.openers import ImageOpener
+from nibabel.volumeutils import array_to_file, finite_range, seek_tell
 
 from braindataprep.utils.log import LoggingOutputSuppressor
 from braindataprep.utils.path import fileparts
+from braindataprep.utils.vol import relabel as vol_relabel
+from braindataprep.utils.compression import (
+    open_compressed, reframe_gzip, save_image
+)
+from braindataprep.utils.tar import ThreadLocalFile
 
 lg = logging.getLogger(__name__)
 
+# Size of the buffer used to copy streams, in bytes
+COPY_CHUNK_SIZE: int = 1024 * 1024
+
+# Largest number of bytes copied by a single system call
+_MAX_KERNEL_COPY: int = 1024 * 1024 * 1024
+
+# Size of the slabs decoded at once by `nibabel_convert`, in bytes
+SLAB_SIZE: int = 64 * 1024 * 1024
+
+# Reusable copy buffers (one per thread)
+_buffers = threading.local()
+
 
 def nibabel_convert(
         src,
@@ -20,14 +49,20 @@ def nibabel_convert(
         out_format=None,
         affine=None,
         makedirs=True,
+        relabel=None,
+        slab_size=None,
 ):
     """
     Convert a volume between formats
 
     Parameters
     ----------
-    src : str or Path
-        Path to source volume
+    src : str or Path or dict[str, file-like]
+        Path to source volume, or file map of the source volume
+        (e.g., `{'header': fhdr, 'image': fimg}`). A file map can be
+        made of in-memory buffers or archive members, so that the source
+        never needs to be written on disk. `inp_format` must then be
+        provided.
     dst : src or Path
         Path to destination volume
     remove : bool
@@ -38,16 +73,50 @@ def nibabel_convert(
         Output format  (default: guess)
     affine : np.ndarray
         Orientation matrix (default: from input)
+    relabel : dict[int, int or list[int]]
+        Lookup table applied to the data before it is written
+        (see `braindataprep.utils.vol.relabel`)
+    slab_size : int
+        Largest number of bytes of (scaled) data that is decoded at once
+        (default: `SLAB_SIZE`)
+
+    Notes
+    -----
+    Outputs are compressed with the current compression settings
+    (see `braindataprep.utils.compression`). If the source already has
+    the output format and extension, and neither its orientation nor
+    its labels are changed, it is copied byte for byte. Otherwise, if
+    its voxels can be written as they are stored (same data type, no
+    scaling, no relabelling) to a NIfTI file, only its header is
+    converted, and its voxel data is streamed to the output without
+    being decoded. A gzip-compressed NIfTI source whose stream has sync
+    points (e.g., written by `pigz`) is not even recompressed (see
+    `braindataprep.utils.compression.reframe_gzip`).
+
+    Other conversions to NIfTI are streamed: the source is read, scaled,
+    relabelled and written one slab at a time, so that the full volume
+    is never held in memory. If the output data type needs scaling, the
+    data range is computed in a first pass over the slabs.
     """
-    src = Path(src)
     dst = Path(dst)
 
     lg.info(f'write {dst.name}')
 
-    if inp_format is None:
-        f = nibabel.load(src)
+    if isinstance(src, dict):
+        if inp_format is None:
+            raise ValueError('An input format is required with a file map')
+        file_map = {
+            key: nibabel.FileHolder(fileobj=fileobj)
+            for key, fileobj in src.items()
+        }
+        f = inp_format.from_file_map(file_map)
+        remove = False
     else:
-        f = inp_format.load(src)
+        src = Path(src)
+        if inp_format is None:
+            f = nibabel.load(src)
+        else:
+            f = inp_format.load(src)
     if out_format is None:
         _, _, ext = fileparts(dst)
         if ext in ('.nii', '.nii.gz'):
@@ -58,12 +127,31 @@ def nibabel_convert(
             out_format = nibabel.AnalyzeImage
         else:
             raise ValueError('???')
-    if affine is None:
-        affine = f.affine
     if makedirs:
         dst.parent.mkdir(parents=True, exist_ok=True)
-    with LoggingOutputSuppressor('nibabel.global'):
-        nibabel.save(out_format(np.asarray(f.dataobj), affine, f.header), dst)
+    if (
+        not isinstance(src, dict) and type(f) is out_format and
+        len(out_format.files_types) == 1 and
+        affine is None and not relabel and
+        fileparts(src)[2] == fileparts(dst)[2]
+    ):
+        # Passthrough: nothing to convert
+        shutil.copyfile(src, dst)
+    elif not relabel and _patch_header(f, dst, out_format, affine):
+        # Header patch: voxel data copied as is
+        pass
+    elif _stream_convert(f, dst, out_format, affine, relabel, slab_size):
+        # Streamed conversion: one slab at a time
+        pass
+    else:
+        if affine is None:
+            affine = f.affine
+        dat = np.asarray(f.dataobj)
+        if relabel:
+            out = dat if dat.flags.writeable else None
+            dat = vol_relabel(dat, relabel, out=out)
+        with LoggingOutputSuppressor('nibabel.global'):
+            save_image(out_format(dat, affine, f.header), dst)
     if remove:
         for file in f.file_map.values():
             filename = Path(file.filename)
@@ -72,6 +160,290 @@ def nibabel_convert(
                 filename.unlink()
 
 
+def _output_header(out_format, dtype, shape, affine, header):
+    """
+    Header of an image of type `out_format` that holds an array of
+    data type `dtype` and shape `shape`. It is built from a (memory-less)
+    placeholder array, so that the data never needs to be loaded.
+    """
+    placeholder = np.broadcast_to(np.zeros([], dtype=dtype), shape)
+    with LoggingOutputSuppressor('nibabel.global'):
+        img = out_format(placeholder, affine, header)
+        img.update_header()
+    return img.header
+
+
+def _patch_header(f, dst, out_format, affine=None):
+    """
+    Write a volume with a converted header, followed by its voxel data,
+    copied as it is stored (without decoding). Return False if the voxel
+    data cannot be copied as is.
+    """
+    proxy = f.dataobj
+    if not (
+        isinstance(proxy, ArrayProxy) and proxy.order == 'F' and
+        (proxy.slope, proxy.inter) == (1.0, 0.0) and
+        issubclass(out_format, nibabel.Nifti1Image)
+    ):
+        return False
+    if affine is None:
+        affine = f.affine
+
+    dtype = proxy.dtype
+    header = _output_header(out_format, dtype, proxy.shape, affine, f.header)
+    out_dtype = header.get_data_dtype()
+    if out_dtype.newbyteorder('=') != dtype.newbyteorder('='):
+        return False
+    header.set_slope_inter(1.0, 0.0)
+    buffer = io.BytesIO()
+    header.write_to(buffer)
+    prefix = buffer.getvalue()
+    prefix += bytes(max(0, int(header.get_data_offset()) - len(prefix)))
+    nbytes = int(np.prod(proxy.shape)) * dtype.itemsize
+
+    # Compressed NIfTI with the same byte order: recompress the header only
+    src = proxy.file_like
+    if (
+        out_dtype == dtype and isinstance(f, nibabel.Nifti1Image) and
+        isinstance(src, (str, Path)) and
+        str(src).lower().endswith('.gz') and str(dst).lower().endswith('.gz')
+    ):
+        with open(src, 'rb') as fi:
+            if reframe_gzip(fi, dst, prefix, proxy.offset,
+                            proxy.offset + nbytes):
+                return True
+
+    # Otherwise, stream voxel data (byte-swapped if needed)
+    chunk_size = max(1, COPY_CHUNK_SIZE // dtype.itemsize) * dtype.itemsize
+    with ImageOpener(src) as fi, open_compressed(dst) as fo:
+        fo.write(prefix)
+        fi.seek(proxy.offset)
+        while nbytes:
+            chunk = fi.read(min(chunk_size, nbytes))
+            if not chunk:
+                raise EOFError(f'Truncated volume: {src}')
+            nbytes -= len(chunk)
+            if out_dtype != dtype:
+                chunk = np.frombuffer(chunk, dtype).astype(out_dtype)
+            fo.write(chunk)
+    return True
+
+
+def _iter_slabs(shape, itemsize, slab_size=None):
+    """
+    Yield indices of slabs that cover an array in Fortran order, such
+    that each slab has at most `slab_size` bytes (or is a single line).
+    """
+    slab_size = slab_size or SLAB_SIZE
+    # Number of leading axes that fit in a slab
+    nbytes, k = itemsize, 0
+    while k < len(shape) and nbytes * shape[k] <= slab_size:
+        nbytes *= shape[k]
+        k += 1
+    if k == len(shape):
+        yield (Ellipsis,)
+        return
+    step = max(1, slab_size // nbytes)
+    # Trailing axes are looped over in Fortran order (first one fastest)
+    for index in np.ndindex(*reversed(shape[k+1:])):
+        for start in range(0, shape[k], step):
+            yield (
+                (slice(None),) * k +
+                (slice(start, start + step),) +
+                tuple(reversed(index))
+            )
+
+
+def _stream_convert(
+    f, dst, out_format, affine=None, relabel=None, slab_size=None
+):
+    """
+    Write a volume to a NIfTI file one slab at a time, with the same
+    header and scaling as `save_image(out_format(data, affine, header))`.
+    Return False if the volume cannot be streamed.
+    """
+    proxy = f.dataobj
+    if not (
+        isinstance(proxy, ArrayProxy) and
+        issubclass(out_format, nibabel.Nifti1Image)
+    ):
+        return False
+    if affine is None:
+        affine = f.affine
+    shape = proxy.shape
+    if not all(shape):
+        return False
+    spec = (shape, proxy.dtype, proxy.offset, proxy.slope, proxy.inter)
+
+    # Data type of the scaled data (from a single voxel)
+    dtype = np.asarray(proxy[(0,) * len(shape)]).dtype
+    itemsize = max(dtype.itemsize, proxy.dtype.itemsize)
+
+    def iter_slabs():
+        # Slabs are read in order, through a single (forward-only) stream,
+        # so that compressed sources are only decompressed once per pass
+        with ImageOpener(proxy.file_like) as fi:
+            stream = ArrayProxy(fi, spec, order=proxy.order)
+            for index in _iter_slabs(shape, itemsize, slab_size):
+                slab = np.asarray(stream[index])
+                if relabel:
+                    out = slab if slab.flags.writeable else None
+                    slab = vol_relabel(slab, relabel, out=out)
+                yield slab
+
+    header = _output_header(out_format, dtype, shape, affine, f.header)
+    out_dtype = header.get_data_dtype()
+
+    # The scaling only depends on the data range, which is computed
+    # in a first pass if needed. A small array with the same range is
+    # then used to compute the scaling, as nibabel would.
+    mn, mx, has_nan = np.inf, -np.inf, False
+    if out_dtype.kind in 'iu' and not np.can_cast(dtype, out_dtype):
+        for slab in iter_slabs():
+            slab_mn, slab_mx, slab_nan = finite_range(slab, True)
+            mn, mx = min(mn, slab_mn), max(mx, slab_mx)
+            has_nan = has_nan or slab_nan
+        sample = [mn, mx] if mn <= mx else []
+        sample = np.asarray(sample + [np.nan] * has_nan, dtype=dtype)
+        if not sample.size:
+            sample = np.zeros([1], dtype=dtype)
+    else:
+        sample = np.zeros([1], dtype=dtype)
+    writer = make_array_writer(
+        sample, out_dtype, header.has_data_slope, header.has_data_intercept
+    )
+    slope, inter = get_slope_inter(writer)
+    header.set_slope_inter(slope, inter)
+    if dtype.kind == 'f' and out_dtype.kind in 'iu':
+        limits = (mn, mx) if mn <= mx else (0, 0)
+    else:
+        limits = (None, None)
+    nan2zero = dtype.kind in 'fc' and out_dtype.kind in 'iu' and has_nan
+
+    with open_compressed(dst) as fo:
+        header.write_to(fo)
+        seek_tell(fo, header.get_data_offset(), write0=True)
+        for slab in iter_slabs():
+            array_to_file(
+                slab, fo, out_dtype, offset=None,
+                intercept=inter, divslope=slope,
+                mn=limits[0], mx=limits[1], order='F', nan2zero=nan2zero,
+            )
+    return True
+
+
+def stack_nifti(channels, dst, jobs=1, makedirs=True):
+    """
+    Stack 3D NIfTI volumes into a 4D NIfTI file
+
+    The headers of all channels are checked before any voxel data is
+    read. Channels are then decoded in parallel threads and, as long as
+    they share the same data type and scaling, written to the output
+    (as soon as they are decoded, in order) without ever assembling the
+    4D array. At most `jobs + 1` channels are held in memory.
+
+    The output header is that of the last channel.
+
+    Parameters
+    ----------
+    channels : list[callable() -> file-like]
+        Functions that open each (uncompressed) NIfTI stream
+    dst : str or Path
+        Path to output volume
+
+    Other Parameters
+    ----------------
+    jobs : int
+        Number of channels decoded in parallel
+    makedirs : bool, default=True
+        Create all directories needs to write the file
+
+    Yields
+    ------
+    status : dict
+        Status update, each time a channel is written
+    """
+    dst = Path(dst)
+    lg.info(f'write {dst.name}')
+    jobs = max(1, jobs or 1)
+
+    # Check that all channels are compatible
+    headers = []
+    for channel in channels:
+        with channel() as f:
+            headers.append(nibabel.Nifti1Header.from_fileobj(f))
+    shapes = set(
+        tuple(n for n in header.get_data_shape() if n != 1)
+        for header in headers
+    )
+    if len(shapes) != 1:
+        raise RuntimeError('incompatible shapes')
+    shape = shapes.pop()
+    shape4 = shape + (len(channels),)
+
+    # Unscaled channels of the same type can be written as they are
+    header = headers[-1]
+    dtype = header.get_data_dtype()
+    unscaled = all(
+        h.get_data_dtype() == dtype and
+        h.get_slope_inter() in ((None, None), (1.0, 0.0))
+        for h in headers
+    )
+
+    def load(channel):
+        with channel() as f:
+            dataobj = nibabel.Nifti1Image.from_stream(f).dataobj
+            if unscaled:
+                dat = np.asarray(dataobj.get_unscaled())
+            else:
+                dat = np.asarray(dataobj)
+        dat = dat.squeeze()
+        if dat.shape != shape:
+            raise RuntimeError('incompatible shapes')
+        return dat
+
+    def iter_channels():
+        # Decode channels in parallel, but yield them in order
+        with ThreadPoolExecutor(jobs) as pool:
+            todo = iter(channels)
+            pending = deque()
+            for channel in todo:
+                pending.append(pool.submit(load, channel))
+                if len(pending) > jobs:
+                    yield pending.popleft().result()
+            while pending:
+                yield pending.popleft().result()
+
+    if makedirs:
+        dst.parent.mkdir(parents=True, exist_ok=True)
+    affine = header.get_best_affine()
+
+    if not unscaled:
+        # Fallback: fill a 4D array, then let nibabel scale it
+        out = None
+        for i, dat in enumerate(iter_channels()):
+            if out is None:
+                out = np.empty(shape4, dtype=dat.dtype, order='F')
+            out[..., i] = dat
+            yield {'status': f'load ch-{i:02d}'}
+        yield {'status': 'writing stack'}
+        with LoggingOutputSuppressor('nibabel.global'):
+            save_image(nibabel.Nifti1Image(out, affine, header), dst)
+        return
+
+    header = _output_header(nibabel.Nifti1Image, dtype, shape4, affine, header)
+    header.set_slope_inter(1.0, 0.0)
+
+    # Write header, then each channel (in Fortran order)
+    with open_compressed(dst) as f:
+        header.write_to(f)
+        seek_tell(f, header.get_data_offset(), write0=True)
+        for i, dat in enumerate(iter_channels()):
+            dat = np.asfortranarray(dat, dtype=dtype)
+            f.write(dat.T.data)
+            yield {'status': f'load ch-{i:02d}'}
+
+
 def read_json(src, **kwargs):
     """
     Read a JSON file
@@ -179,6 +551,141 @@ def write_tsv(src, dst, makedirs=True, **kwargs):
     writer.writerows(src)
 
 
+def copy_stream(src, dst, chunk_size=COPY_CHUNK_SIZE):
+    """
+    Copy the (remaining) content of a binary stream into another stream
+
+    If `src` is a member of an uncompressed tar archive and `dst` is a
+    regular file, bytes are copied by the kernel (`copy_file_range` or
+    `sendfile`) and never enter user space. Otherwise, they are copied
+    chunk by chunk through a reusable buffer, so that memory usage
+    does not depend on the size of the stream.
+
+    Parameters
+    ----------
+    src : file-like
+        An object with the `readinto()` or `read()` method
+    dst : file-like
+        An object with the `write()` method
+
+    Other Parameters
+    ----------------
+    chunk_size : int
+        Size of the copy buffer, in bytes
+
+    Returns
+    -------
+    nbytes : int
+        Number of bytes copied
+    """
+    nbytes = _kernel_copy(src, dst)
+
+    readinto = getattr(src, 'readinto', None)
+    if readinto is None:
+        while True:
+            chunk = src.read(chunk_size)
+            if not chunk:
+                return nbytes
+            dst.write(chunk)
+            nbytes += len(chunk)
+
+    buffer = getattr(_buffers, 'buffer', None)
+    if buffer is None or len(buffer) != chunk_size:
+        buffer = _buffers.buffer = memoryview(bytearray(chunk_size))
+    while True:
+        size = readinto(buffer)
+        if not size:
+            return nbytes
+        dst.write(buffer[:size])
+        nbytes += size
+
+
+def _fileno(f):
+    """File descriptor of a plain (uncompressed) regular file, or None"""
+    if isinstance(f, ThreadLocalFile):
+        f = f.file
+    if isinstance(f, (io.BufferedReader, io.BufferedWriter,
+                      io.BufferedRandom)):
+        f = f.raw
+    if not isinstance(f, io.FileIO) or f.closed:
+        return None
+    fd = f.fileno()
+    if not stat.S_ISREG(os.fstat(fd).st_mode):
+        return None
+    return fd
+
+
+def _copy_range(infd, outfd, offset, count):
+    """Copy bytes between file descriptors, inside the kernel"""
+    count = min(count, _MAX_KERNEL_COPY)
+    if hasattr(os, 'copy_file_range'):
+        try:
+            return os.copy_file_range(infd, outfd, count, offset)
+        except OSError as e:
+            # not supported by this kernel or (pair of) filesystems
+            if e.errno not in (
+                errno.EXDEV, errno.ENOSYS, errno.EINVAL,
+                errno.EOPNOTSUPP, errno.EBADF,
+            ):
+                raise
+    if hasattr(os, 'sendfile'):
+        return os.sendfile(outfd, infd, offset, count)
+    raise OSError(errno.ENOSYS, 'No kernel copy available')
+
+
+def _kernel_copy(src, dst):
+    """
+    Copy the remaining bytes of an uncompressed tar member into a
+    regular file, inside the kernel. Return the number of bytes copied
+    (zero if not applicable), and leave both streams positioned after
+    these bytes.
+    """
+    from braindataprep.actions.file import FileObjMixin
+
+    # Source must be a non-sparse member of an uncompressed archive
+    if not isinstance(src, tarfile.ExFileObject):
+        return 0
+    member = src.raw
+    if len(member.map) != 1 or not member.map[0][0]:
+        return 0
+    infd = _fileno(member.fileobj)
+    if infd is None:
+        return 0
+
+    # Bytes cannot bypass a digest computed on the fly
+    if isinstance(dst, FileObjMixin):
+        if dst.digester is not None:
+            return 0
+        wrapper, dst = dst, dst.fileobj
+    else:
+        wrapper = None
+    outfd = _fileno(dst)
+    if outfd is None:
+        return 0
+
+    position = src.tell()
+    offset = member.offset + position
+    size = member.size - position
+    dst.flush()
+    outposition = dst.tell()
+
+    nbytes = 0
+    try:
+        while nbytes < size:
+            copied = _copy_range(infd, outfd, offset + nbytes, size - nbytes)
+            if not copied:
+                break
+            nbytes += copied
+    except OSError as e:
+        lg.debug(f'Kernel copy failed ({e}), copying through memory')
+    finally:
+        src.seek(position + nbytes)
+        dst.seek(outposition + nbytes)
+    if wrapper is not None:
+        wrapper.total_write += nbytes
+    return nbytes
+
+
 def write_from_buffer(src, dst, makedirs=True):
     """
     Write from an open buffer
@@ -205,7 +712,7 @@ def write_from_buffer(src, dst, makedirs=True):
     if isinstance(src, bytes):
         dst.write(src)
     else:
-        dst.write(src.read())
+        copy_stream(src, dst)
 
 
 def write_text(src, dst, makedirs=True):
@@ -262,4 +769,4 @@ def copy_from_buffer(src, dst, makedirs=True):
     if isinstance(src, bytes):
         dst.write(src)
     else:
-        dst.write(src.read())
+        copy_stream(src, dst)
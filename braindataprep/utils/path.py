@@ -21,6 +21,16 @@ def get_tree_path(path: str | Path | None = None) -> Path:
     return Path(path or os.environ.get('BDP_PATH', '.'))
 
 
+def get_cache_path(root: str | Path, name: str) -> Path:
+    """
+    Return the path to a cache file stored under a dataset root
+    (in a hidden `.bdp` folder), and make sure its folder exists.
+    """
+    path = Path(root) / '.bdp' / name
+    path.parent.mkdir(parents=True, exist_ok=True)
+    return path
+
+
 def fileparts(fname):
     """Compute parts from path
 
@@ -0,0 +1,275 @@
+import io
+import json
+import os
+import tarfile
+import threading
+from functools import partial
+from logging import getLogger
+from pathlib import Path
+from typing import Callable, IO, Iterator
+
+from braindataprep.utils.gzindex import is_gzip
+from braindataprep.utils.gzindex import open_gzip
+
+lg = getLogger(__name__)
+
+
+class TarIndex:
+    """
+    An index of the members of a tar archive.
+
+    The archive is scanned once, and the header of each member
+    (name, offsets, size, mtime, ...) is saved in a sidecar file
+    (`{archive}.index`). Later, membership and lookup queries are
+    answered in O(1) without decompressing the archive, and members
+    can be extracted by seeking straight to their data.
+
+    The index is rebuilt whenever the size or mtime of the archive
+    changes.
+
+    Gzip-compressed archives are read through a `SeekableGzipFile`,
+    whose checkpoints are built during the same scan, so that members
+    can be reached without inflating the archive from its start.
+
+    ```python
+    index = TarIndex('path/to/archive.tar.gz')
+    if 'some/member.nii' in index:
+        with index.open() as tar:
+            data = tar.extractfile(index.getmember('some/member.nii'))
+    ```
+    """
+
+    VERSION = 1
+
+    # Header fields stored in the index
+    FIELDS = (
+        'name', 'type', 'offset', 'offset_data', 'size', 'mtime', 'mode',
+        'linkname',
+    )
+
+    def __init__(
+        self,
+        path: str | Path,
+        indexpath: str | Path | None = None,
+        *,
+        save: bool = True,
+    ):
+        """
+        Parameters
+        ----------
+        path : str | Path
+            Path to the tar archive
+        indexpath : str | Path
+            Path to the index file (default: `{path}.index`)
+        save : bool
+            Save the index to disk after it is built
+        """
+        self.path = Path(path)
+        self.indexpath = Path(
+            indexpath or self.path.with_name(self.path.name + '.index')
+        )
+        self.saveindex = save
+        self.members: dict[str, tarfile.TarInfo] = {}
+        if not self.load():
+            self.build()
+            if self.saveindex:
+                self.save()
+
+    # ------------------------------------------------------------------
+    #   Build / load / save
+    # ------------------------------------------------------------------
+    def _stamp(self) -> dict:
+        stat = os.stat(self.path)
+        return {'size': stat.st_size, 'mtime': stat.st_mtime_ns}
+
+    def build(self) -> "TarIndex":
+        """Scan the archive (once) and index its members"""
+        lg.debug(f'Indexing {self.path}')
+        self.members = {}
+        if is_gzip(self.path):
+            with open_gzip(self.path) as f:
+                with tarfile.open(fileobj=f, mode='r|') as tar:
+                    for member in tar:
+                        self.members[member.name] = member
+        else:
+            with tarfile.open(self.path, 'r|*') as tar:
+                for member in tar:
+                    self.members[member.name] = member
+        return self
+
+    def load(self) -> bool:
+        """Load the index from disk. Return False if missing or stale"""
+        try:
+            with open(self.indexpath, 'rt') as f:
+                obj = json.load(f)
+        except (OSError, ValueError):
+            return False
+        if obj.get('version') != self.VERSION:
+            return False
+        if obj.get('archive') != self._stamp():
+            lg.debug(f'Index of {self.path} is stale')
+            return False
+        self.members = {}
+        for values in obj['members']:
+            member = tarfile.TarInfo()
+            for field, value in zip(self.FIELDS, values):
+                setattr(member, field, value)
+            member.type = member.type.encode('latin-1')
+            self.members[member.name] = member
+        return True
+
+    def save(self) -> None:
+        """Save the index to disk"""
+        obj = {
+            'version': self.VERSION,
+            'archive': self._stamp(),
+            'members': [
+                [
+                    getattr(member, field) if field != 'type' else
+                    member.type.decode('latin-1')
+                    for field in self.FIELDS
+                ]
+                for member in self.members.values()
+            ],
+        }
+        tmppath = self.indexpath.with_name(self.indexpath.name + '.tmp')
+        try:
+            with open(tmppath, 'wt') as f:
+                json.dump(obj, f)
+            tmppath.replace(self.indexpath)
+        except OSError as e:
+            lg.warning(f'Could not save index of {self.path}: {e}')
+            tmppath.unlink(missing_ok=True)
+
+    # ------------------------------------------------------------------
+    #   Queries
+    # ------------------------------------------------------------------
+    def __contains__(self, name: str) -> bool:
+        return str(name) in self.members
+
+    def __len__(self) -> int:
+        return len(self.members)
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.members)
+
+    def getnames(self) -> list[str]:
+        """Names of all members, in archive order"""
+        return list(self.members.keys())
+
+    def getmembers(self) -> list[tarfile.TarInfo]:
+        """Headers of all members, in archive order"""
+        return list(self.members.values())
+
+    def getmember(self, name: str) -> tarfile.TarInfo:
+        """Header of a member"""
+        try:
+            return self.members[str(name)]
+        except KeyError:
+            raise KeyError(f'filename {name!r} not found') from None
+
+    def open(self, mode: str = 'r:*') -> tarfile.TarFile:
+        """
+        Open the archive for random access.
+
+        The member list of the returned `TarFile` is filled from the
+        index, so that `getnames`, `getmembers`, `extractfile(name)`
+        and iteration never scan the archive, and `getmember` is
+        answered by the index.
+
+        Gzip-compressed and uncompressed archives are read through a
+        `ThreadLocalFile`, so that members can be extracted by
+        concurrent threads. Gzip-compressed archives (`mode` in
+        `{'r:*', 'r:gz'}`) are read through a `SeekableGzipFile`.
+        """
+        if mode in ('r:*', 'r:gz') and is_gzip(self.path):
+            opener = partial(open_gzip, self.path)
+        elif mode in ('r', 'r:') or (
+            mode == 'r:*' and not _is_compressed(self.path)
+        ):
+            opener = partial(open, self.path, 'rb')
+        else:
+            opener = None
+        if opener:
+            fileobj = ThreadLocalFile(opener, name=str(self.path))
+            tar = tarfile.open(fileobj=fileobj, mode='r:')
+            # the file object is ours: close it with the archive
+            tar._extfileobj = False
+        else:
+            tar = tarfile.open(self.path, mode)
+        tar.members = self.getmembers()
+        tar._loaded = True
+        tar.getmember = self.getmember
+        return tar
+
+
+def _is_compressed(path: str | Path) -> bool:
+    """Whether a file starts with a gzip, bzip2 or xz magic number"""
+    with open(path, 'rb') as f:
+        magic = f.read(6)
+    return magic.startswith((b'\x1f\x8b', b'BZh', b'\xfd7zXZ'))
+
+
+class ThreadLocalFile(io.RawIOBase):
+    """
+    A read-only file whose position is local to each thread.
+
+    Each thread reads through its own file object, opened lazily, so
+    that the members of an archive can be extracted by concurrent
+    threads. `tarfile` always seeks to the data of a member before
+    reading it, so it does not need a position that is shared across
+    threads.
+    """
+
+    def __init__(self, opener: Callable[[], IO[bytes]], name: str = None):
+        """
+        Parameters
+        ----------
+        opener : callable() -> file
+            Function that opens a new file object
+        name : str
+            Name of the file
+        """
+        super().__init__()
+        self.opener = opener
+        self.name = name
+        self._local = threading.local()
+        self._files = []
+        self._lock = threading.Lock()
+
+    @property
+    def file(self) -> IO[bytes]:
+        """File object of the current thread"""
+        file = getattr(self._local, 'file', None)
+        if file is None:
+            file = self._local.file = self.opener()
+            with self._lock:
+                self._files.append(file)
+        return file
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def readinto(self, b) -> int:
+        return self.file.readinto(b)
+
+    def read(self, size: int = -1) -> bytes:
+        return self.file.read(size)
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        return self.file.seek(offset, whence)
+
+    def tell(self) -> int:
+        return self.file.tell()
+
+    def close(self):
+        if self.closed:
+            return
+        with self._lock:
+            for file in self._files:
+                file.close()
+            self._files = []
+        super().close()
@@ -47,15 +47,37 @@ def make_affine(shape, voxel_size=1, orient='RAS', center='(x-1)/2'):
     return aff
 
 
-def relabel(inp, lookup):
+# Largest label range for which a dense lookup array is used
+DENSE_LUT_MAX = 1 << 20
+
+# Number of voxels relabelled at once
+RELABEL_CHUNK = 1 << 22
+
+
+def relabel(inp, lookup, out=None, chunk_size=RELABEL_CHUNK):
     """Relabel a label volume
 
+    Labels are mapped with a lookup array (one pass over the volume,
+    whatever the number of labels):
+    * for 8- and 16-bit volumes, the lookup array covers all values
+      of the data type;
+    * otherwise, it covers the range of source labels, unless this
+      range is too large, in which case labels are looked up in a
+      sorted list (`np.searchsorted`).
+
+    The volume is processed chunk by chunk, so that memory-mapped
+    volumes are never loaded entirely in memory.
+
     Parameters
     ----------
     inp : np.ndarray[integer]
         Input label volume
     lookup : dict[int, int or list[int]]
-        Lookup table
+        Lookup table. Labels that are not in the table are set to zero.
+    out : np.ndarray[integer], optional
+        Output volume. Can be `inp` itself (in-place relabelling).
+    chunk_size : int
+        Number of voxels processed at once
 
     Returns
     -------
@@ -63,11 +85,87 @@ def relabel(inp, lookup):
         Relabeled volume
 
     """
-    out = np.zeros_like(inp)
+    inp = np.asanyarray(inp)
+    if out is None:
+        out = np.empty_like(inp)
+    elif out.shape != inp.shape:
+        raise ValueError('Input and output volumes must have the same shape')
+
+    # Map source labels to destination labels
+    mapping = {}
     for dst, src in lookup.items():
         if hasattr(src, '__iter__'):
             for src1 in src:
-                out[inp == src1] = dst
+                mapping[src1] = dst
         else:
-            out[inp == src] = dst
+            mapping[src] = dst
+    if inp.dtype.kind in 'iu':
+        # labels that cannot be represented never match
+        info = np.iinfo(inp.dtype)
+        mapping = {
+            src: dst for src, dst in mapping.items()
+            if info.min <= src <= info.max
+        }
+    src = np.asarray(list(mapping.keys()), dtype=inp.dtype)
+    dst = np.asarray(list(mapping.values()), dtype=out.dtype)
+    kernel = _relabel_kernel(inp.dtype, src, dst)
+
+    if inp.ndim == 0:
+        out[()] = kernel(inp[()][None])[0]
+        return out
+
+    # Process slabs along the slowest-varying axis
+    axis = inp.ndim - 1 if inp.flags.f_contiguous else 0
+    slab = max(1, inp.size // max(1, inp.shape[axis]))
+    step = max(1, chunk_size // slab)
+    index = [slice(None)] * inp.ndim
+    for start in range(0, inp.shape[axis], step):
+        index[axis] = slice(start, start + step)
+        out[tuple(index)] = kernel(np.asarray(inp[tuple(index)]))
     return out
+
+
+def _relabel_kernel(dtype, src, dst):
+    """Return a function that relabels an array"""
+    dtype = np.dtype(dtype)
+
+    # Small integers: lookup array over the full range of the data type
+    if dtype.kind in 'iub' and dtype.itemsize <= 2:
+        if dtype.kind == 'b':
+            src, dtype = src.astype('u1'), np.dtype('u1')
+        udtype = np.dtype(f'u{dtype.itemsize}')
+        lut = np.zeros(1 << (8 * dtype.itemsize), dtype=dst.dtype)
+        lut[src.view(udtype)] = dst
+
+        def kernel(x):
+            return np.take(lut, x.view(udtype))
+
+        return kernel
+
+    if len(src) == 0:
+        return lambda x: np.zeros(x.shape, dtype=dst.dtype)
+
+    # Integers with a compact label range: dense lookup array
+    if dtype.kind in 'iu':
+        lo, hi = int(src.min()), int(src.max())
+        if hi - lo < DENSE_LUT_MAX:
+            lut = np.zeros(hi - lo + 1, dtype=dst.dtype)
+            lut[src.astype(np.int64) - lo] = dst
+
+            def kernel(x):
+                outside = (x < lo) | (x > hi)
+                y = np.take(lut, x.astype(np.int64) - lo, mode='clip')
+                y[outside] = 0
+                return y
+
+            return kernel
+
+    # Other cases: binary search in the sorted list of labels
+    order = np.argsort(src)
+    src, dst = src[order], dst[order]
+
+    def kernel(x):
+        pos = np.searchsorted(src, x).clip(max=len(src) - 1)
+        return np.where(src[pos] == x, dst[pos], 0).astype(dst.dtype)
+
+    return kernel
@@ -1,13 +1,21 @@
 import os
+import json
+import time
+import sqlite3
+import threading
 import requests
 import getpass
 import fnmatch
+from concurrent.futures import ThreadPoolExecutor
+from logging import getLogger
 from pathlib import Path
-from typing import Iterator, Iterable, Literal
+from typing import Iterator, Iterable, Literal, NamedTuple, Callable
 
 from braindataprep.download import Downloader
 from braindataprep.download import DownloadManager
+from braindataprep.download import new_session
 
+lg = getLogger(__name__)
 
 sessions = {}
 default_server = 'https://www.nitrc.org/ir/'
@@ -56,6 +64,107 @@ def get_credentials(user=None, password=None):
     return user, password
 
 
+class ListingCache:
+    """
+    On-disk (SQLite) cache of XNAT listings, keyed by request URL.
+
+    Records younger than `ttl` are trusted. Older records are
+    revalidated with a conditional request (`If-None-Match` /
+    `If-Modified-Since`) when the server provided an `ETag` or a
+    `Last-Modified` header, and refetched otherwise.
+
+    ```python
+    with XNAT(cache=ListingCache('.bdp/xnat.sqlite', ttl=86400)) as xnat:
+        xnat.get_subjects('OASIS3')
+    ```
+    """
+
+    # Default time-to-live of a record, in seconds
+    DEFAULT_TTL: float = 7 * 24 * 60 * 60
+
+    class Record(NamedTuple):
+        data: object            # Decoded JSON
+        fresh: bool             # Whether the record can be trusted
+        etag: str | None        # ETag header
+        modified: str | None    # Last-Modified header
+
+    def __init__(
+        self,
+        path: str | Path,
+        ttl: float | None = DEFAULT_TTL,
+        refresh: bool = False,
+    ):
+        """
+        Parameters
+        ----------
+        path : str | Path
+            Path to the SQLite database
+        ttl : float | None
+            Time-to-live of a record, in seconds. If None, never expire.
+        refresh : bool
+            Consider all records stale (they are revalidated or refetched)
+        """
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.ttl = ttl
+        self.refresh = refresh
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(str(self.path), check_same_thread=False)
+        with self._lock, self._db:
+            self._db.execute('PRAGMA journal_mode=WAL')
+            self._db.execute(
+                'CREATE TABLE IF NOT EXISTS listings ('
+                'url TEXT PRIMARY KEY, time REAL, '
+                'etag TEXT, modified TEXT, data TEXT)'
+            )
+
+    def get(self, url: str) -> Record | None:
+        """Return the record of a URL, if any"""
+        with self._lock:
+            row = self._db.execute(
+                'SELECT time, etag, modified, data FROM listings '
+                'WHERE url = ?', (url,)
+            ).fetchone()
+        if row is None:
+            return None
+        stamp, etag, modified, data = row
+        fresh = not self.refresh and (
+            self.ttl is None or time.time() - stamp < self.ttl
+        )
+        return self.Record(json.loads(data), fresh, etag, modified)
+
+    def set(
+        self,
+        url: str,
+        data: object,
+        etag: str | None = None,
+        modified: str | None = None,
+    ) -> None:
+        """Save (or replace) the record of a URL"""
+        with self._lock, self._db:
+            self._db.execute(
+                'INSERT OR REPLACE INTO listings VALUES (?, ?, ?, ?, ?)',
+                (url, time.time(), etag, modified, json.dumps(data))
+            )
+
+    def touch(self, url: str) -> None:
+        """Mark a record as fresh (it was successfully revalidated)"""
+        with self._lock, self._db:
+            self._db.execute(
+                'UPDATE listings SET time = ? WHERE url = ?',
+                (time.time(), url)
+            )
+
+    def clear(self) -> None:
+        """Delete all records"""
+        with self._lock, self._db:
+            self._db.execute('DELETE FROM listings')
+
+    def close(self) -> None:
+        with self._lock:
+            self._db.close()
+
+
 class XNAT:
 
     # TODO:
@@ -69,14 +178,56 @@ class XNAT:
         server: str | None = None,
         open: bool = False,
         keep_open: bool = True,
+        cache: str | Path | ListingCache | None = None,
+        jobs: int = 1,
+        delay: float = 0,
+        bulk: bool = False,
     ):
+        """
+        Parameters
+        ----------
+        user : str
+            NITRC username
+        password : str
+            NITRC password
+        key : str
+            Key of this instance in the registry of sessions
+        server : str
+            URL of the XNAT server
+        open : bool
+            Open the session
+        keep_open : bool
+            Keep the session open
+        cache : str | Path | ListingCache
+            Cache of listings (or path to its SQLite database)
+        jobs : int
+            Number of listing requests sent in parallel when crawling
+            the catalogue (`get_all_*`)
+        delay : float
+            Minimum delay between two requests, in seconds
+        bulk : bool
+            Answer experiment/scan/assessor listings from project-level
+            catalogues (a handful of requests) instead of one request
+            per subject or experiment.
+        """
         sessions[key] = self
+        if cache is not None and not isinstance(cache, ListingCache):
+            cache = ListingCache(cache)
+        self.cache = cache
         self.credentials = get_credentials(user, password)
         self.server = server or default_server
         while self.server[-1] == '/':
             self.server = self.server[:-1]
         self.session = None
         self.jsessionid = None
+        self.jobs = max(1, jobs or 1)
+        self.delay = delay
+        self._login_lock = threading.Lock()
+        self._delay_lock = threading.Lock()
+        self._last_request = 0
+        self.bulk = bulk
+        self._catalogues = {}
+        self._catalogue_lock = threading.Lock()
         self._keep_open = None
         self._keep_open_default = keep_open
         if open:
@@ -117,30 +268,96 @@ class XNAT:
         r = session.post(f'{self.server}/data/JSESSION', auth=self.credentials)
         return r.content
 
-    def login(self) -> None:
-        jsessionid = self.session.get(f'{self.server}/data/JSESSION')
-        if jsessionid != self.jsessionid:
-            self.jsessionid = self.auth(self.session)
+    def login(self, force: bool = False) -> None:
+        # The lock ensures that concurrent requests do not all
+        # (re)authenticate at once.
+        jsessionid = self.jsessionid
+        with self._login_lock:
+            if self.jsessionid is None or (
+                force and self.jsessionid == jsessionid
+            ):
+                self.jsessionid = self.auth(self.session)
 
     def logout(self) -> None:
         if self.is_open:
             self.session.delete(f'{self.server}/data/JSESSION')
             self.jsessionid = None
 
-    def get(self, *args, **kwargs) -> requests.Response:
+    def _wait(self) -> None:
+        # Politeness delay between two requests
+        if not self.delay:
+            return
+        with self._delay_lock:
+            wait = self._last_request + self.delay - time.time()
+            if wait > 0:
+                time.sleep(wait)
+            self._last_request = time.time()
+
+    def _request(self, method: str, *args, **kwargs) -> requests.Response:
         self.login()
-        return self.session.get(*args, **kwargs)
+        self._wait()
+        r = self.session.request(method, *args, **kwargs)
+        if r.status_code in (401, 403):
+            # Session has probably expired: login again and retry
+            self.login(force=True)
+            r = self.session.request(method, *args, **kwargs)
+        return r
+
+    def get(self, *args, **kwargs) -> requests.Response:
+        return self._request('GET', *args, **kwargs)
 
     def head(self, *args, **kwargs) -> requests.Response:
-        self.login()
-        return self.session.head(*args, **kwargs)
+        return self._request('HEAD', *args, **kwargs)
+
+    def map(self, func: Callable, *iterables) -> Iterator:
+        """
+        Apply a (listing) function to all elements of the input
+        iterables, with up to `self.jobs` calls running in parallel.
+        Results are yielded in order.
+        """
+        if self.jobs == 1:
+            yield from map(func, *iterables)
+            return
+        with ThreadPoolExecutor(self.jobs) as pool:
+            yield from pool.map(func, *iterables)
+
+    def get_json(self, url: str) -> dict | list | None:
+        """
+        GET a JSON document, through the listing cache if any.
+        Returns None if the request failed.
+        """
+        if self.cache is None:
+            data = self.get(url)
+            return data.json() if data else None
+
+        record = self.cache.get(url)
+        if record and record.fresh:
+            return record.data
+
+        headers = {}
+        if record and record.etag:
+            headers['If-None-Match'] = record.etag
+        if record and record.modified:
+            headers['If-Modified-Since'] = record.modified
+        data = self.get(url, headers=headers)
+        if record and data.status_code == 304:
+            lg.debug(f'Listing revalidated: {url}')
+            self.cache.touch(url)
+            return record.data
+        if not data:
+            return None
+        etag = data.headers.get('ETag', None)
+        modified = data.headers.get('Last-Modified', None)
+        data = data.json()
+        self.cache.set(url, data, etag, modified)
+        return data
 
     def open(self, keep_open: bool | None = None):
         if keep_open is not None:
             self.keep_open = keep_open
         if self.is_open:
             return self
-        self.session = requests.Session()
+        self.session = new_session()
         self.login()
         return self
 
@@ -162,6 +379,96 @@ class XNAT:
         delattr(self, '_was_open')
         return self
 
+    # Columns requested from the project-level experiments endpoint,
+    # for each type of catalogue (in addition to experiment and subject
+    # labels), and the keys under which they are returned.
+    CATALOGUE_COLUMNS: dict[str, dict[str, str]] = {
+        'experiment': {},
+        'scan': {
+            'ID': 'xnat:imageScanData/ID',
+            'type': 'xnat:imageScanData/type',
+        },
+        'assessor': {
+            'label': 'xnat:imageAssessorData/label',
+        },
+    }
+
+    def get_catalogue(
+        self,
+        project: str,
+        type: Literal['experiment', 'scan', 'assessor'] = 'scan',
+    ) -> dict[str, dict[str, list[dict]]] | None:
+        """
+        Fetch the catalogue of a whole project in a single request,
+        using the project-level experiments endpoint with `columns=`.
+
+        Catalogues are kept in memory (and in the listing cache, if any).
+
+        Parameters
+        ----------
+        project : str
+            XNAT project name (e.g. "OASIS3")
+        type : {'experiment', 'scan', 'assessor'}
+            Type of element to list
+
+        Returns
+        -------
+        catalogue : dict[str, dict[str, list[dict]]] | None
+            Nested dictionary `{subject: {experiment: [info]}}`, where
+            `info` contains the keys "ID" and "type" for scans,
+            and "label" for assessors.
+            None if the server does not return the requested columns.
+        """
+        key = (project, type)
+        with self._catalogue_lock:
+            if key not in self._catalogues:
+                self._catalogues[key] = self._fetch_catalogue(project, type)
+            return self._catalogues[key]
+
+    def _fetch_catalogue(
+        self, project: str, type: str
+    ) -> dict[str, dict[str, list[dict]]] | None:
+        columns = self.CATALOGUE_COLUMNS[type]
+        url = (f'{self.server}/data/archive/projects/{project}/'
+               f'experiments/?format=json&columns=' +
+               ','.join(['label', 'subject_label', *columns.values()]))
+        data = self.get_json(url)
+        if not data:
+            lg.warning(f'Could not fetch {type} catalogue of {project}')
+            return None
+
+        catalogue = {}
+        for row in data['ResultSet']['Result']:
+            # column names are not always returned with the same case
+            row = {k.lower(): v for k, v in row.items()}
+            if any(c.lower() not in row for c in columns.values()):
+                lg.warning(
+                    f'Server did not return {type} columns: '
+                    f'fallback to per-experiment listings'
+                )
+                return None
+            experiments = catalogue.setdefault(row['subject_label'], {})
+            elements = experiments.setdefault(row['label'], [])
+            info = {k: row[c.lower()] for k, c in columns.items()}
+            # experiments without any element have empty columns
+            if info and all(info.values()) and info not in elements:
+                elements.append(info)
+        return catalogue
+
+    def _get_catalogue_entry(
+        self,
+        project: str,
+        subject: str | None,
+        type: str,
+        bulk: bool | None = None,
+    ) -> dict[str, list[dict]] | None:
+        if not (self.bulk if bulk is None else bulk) or not subject:
+            return None
+        catalogue = self.get_catalogue(project, type)
+        if catalogue is None:
+            return None
+        return catalogue.get(subject, {})
+
     def get_subjects(self, project: str) -> list[str]:
         """
         Parameters
@@ -175,7 +482,7 @@ class XNAT:
             XNAT subject label (e.g. "OAS30001")
         """
         url = f'{self.server}/data/archive/projects/{project}/subjects/'
-        data = self.get(url).json()
+        data = self.get_json(url)
         data = data['ResultSet']['Result']
         return [elem['label'] for elem in data]
 
@@ -205,7 +512,8 @@ class XNAT:
     def get_experiments(
         self,
         project: str,
-        subject: str | None = None
+        subject: str | None = None,
+        bulk: bool | None = None,
     ) -> list[str]:
         """
         Parameters
@@ -214,19 +522,24 @@ class XNAT:
             XNAT project name (e.g. "OASIS3")
         subject : str, optional
             XNAT subject label to restrict the search to (e.g. "OAS30001")
+        bulk : bool, default=self.bulk
+            Answer from the project-level catalogue
 
         Returns
         -------
         experiments : list[str]
             XNAT experiments label (e.g. "OAS30001_MR_d3746")
         """
+        entry = self._get_catalogue_entry(project, subject, 'experiment', bulk)
+        if entry is not None:
+            return list(entry.keys())
         if subject is not None:
             subject = f'/subjects/{subject}'
         else:
             subject = ''
         url = (f'{self.server}/data/archive/projects/{project}{subject}/'
                f'experiments/?format=json')
-        data = self.get(url).json()['ResultSet']['Result']
+        data = self.get_json(url)['ResultSet']['Result']
         return [elem['label'] for elem in data]
 
     def get_all_experiments(
@@ -258,9 +571,10 @@ class XNAT:
 
         out = []
         subjects = self.get_all_subjects(project, subjects)
-        for subject in subjects:
-            proj, sub = subject.split('/')
-            exp = filter_list(self.get_experiments(proj, sub), experiments)
+        subjects = [subject.split('/') for subject in subjects]
+        listings = self.map(lambda x: self.get_experiments(*x), subjects)
+        for (proj, sub), exp in zip(subjects, listings):
+            exp = filter_list(exp, experiments)
             out.extend(map(lambda x: f'{proj}/{sub}/{x}', exp))
         return out
 
@@ -269,7 +583,8 @@ class XNAT:
         project: str,
         subject: str,
         experiment: str,
-        return_info: bool = False
+        return_info: bool = False,
+        bulk: bool | None = None,
     ) -> list[str]:
         """
         Parameters
@@ -282,6 +597,8 @@ class XNAT:
         experiment : str
             XNAT experiment label to restrict the search to
             (e.g. "OAS30001_MR_d3746")
+        bulk : bool, default=self.bulk
+            Answer from the project-level catalogue
 
         Returns
         -------
@@ -290,13 +607,20 @@ class XNAT:
         """
         if not subject:
             subject = self.get_subject(project, experiment)
+        entry = self._get_catalogue_entry(project, subject, 'assessor', bulk)
+        if entry is not None:
+            data = entry.get(experiment, [])
+            if return_info:
+                return data
+            else:
+                return [elem['label'] for elem in data]
         url = (f'{self.server}/data/archive/projects/{project}/'
                f'subjects/{subject}/experiments/{experiment}/'
                f'assessors/?format=json')
-        data = self.get(url)
+        data = self.get_json(url)
         if not data:
             return []
-        data = data.json()['ResultSet']['Result']
+        data = data['ResultSet']['Result']
         if return_info:
             return data
         else:
@@ -308,6 +632,7 @@ class XNAT:
         subjects: str | Iterable[str] | None = None,
         experiments: str | Iterable[str] | None = None,
         assessors: str | Iterable[str] | None = None,
+        bulk: bool | None = None,
         **kwargs
     ) -> list[str]:
         """
@@ -323,6 +648,9 @@ class XNAT:
             to restrict the search to (e.g. "OAS30001_MR_d3746")
         assessor(s) : [list of] str
             Selection pattern
+        bulk : bool, default=self.bulk
+            Fetch the whole project catalogue in a single request,
+            and filter it locally.
 
         Returns
         -------
@@ -334,13 +662,19 @@ class XNAT:
         experiments = experiments or kwargs.pop('experiment', None)
         assessors = assessors or kwargs.pop('assessor', None)
 
+        if self.bulk if bulk is None else bulk:
+            out = self._filter_catalogue(
+                project, 'assessor', 'label', subjects, experiments, assessors
+            )
+            if out is not None:
+                return out
+
         out = []
         experiments = self.get_all_experiments(project, subjects, experiments)
-        for experiment in experiments:
-            proj, sub, exp = experiment.split('/')
-            subassess = filter_list(
-                self.get_assessors(proj, sub, exp), assessors
-            )
+        experiments = [experiment.split('/') for experiment in experiments]
+        listings = self.map(lambda x: self.get_assessors(*x), experiments)
+        for (proj, sub, exp), subassess in zip(experiments, listings):
+            subassess = filter_list(subassess, assessors)
             out.extend(map(lambda x: f'{proj}/{sub}/{exp}/{x}', subassess))
         return out
 
@@ -350,7 +684,8 @@ class XNAT:
         subject: str,
         experiment: str,
         assessor: str | None = None,
-        return_info=False
+        return_info=False,
+        bulk: bool | None = None,
     ) -> list[str]:
         """
         Parameters
@@ -363,6 +698,9 @@ class XNAT:
         experiment : str
             XNAT experiment label to restrict the search to
             (e.g. "OAS30001_MR_d3746")
+        bulk : bool, default=self.bulk
+            Answer from the project-level catalogue
+            (not used for the scans of an assessor)
 
         Returns
         -------
@@ -371,6 +709,14 @@ class XNAT:
         """
         if not subject:
             subject = self.get_subject(project, experiment)
+        if not assessor:
+            entry = self._get_catalogue_entry(project, subject, 'scan', bulk)
+            if entry is not None:
+                data = entry.get(experiment, [])
+                if return_info:
+                    return data
+                else:
+                    return [elem['ID'] for elem in data]
         if assessor:
             assessor = f'assessors/{assessor}/'
         else:
@@ -378,10 +724,10 @@ class XNAT:
         url = (f'{self.server}/data/archive/projects/{project}/'
                f'subjects/{subject}/experiments/{experiment}/{assessor}'
                f'scans/?format=json')
-        data = self.get(url)
+        data = self.get_json(url)
         if not data:
             return []
-        data = data.json()['ResultSet']['Result']
+        data = data['ResultSet']['Result']
         if return_info:
             return data
         else:
@@ -393,6 +739,7 @@ class XNAT:
         subjects: str | Iterable[str] | None = None,
         experiments: str | Iterable[str] | None = None,
         scans: str | Iterable[str] | None = None,
+        bulk: bool | None = None,
         **kwargs
     ) -> list[str]:
         """
@@ -408,6 +755,9 @@ class XNAT:
             to restrict the search to (e.g. "OAS30001_MR_d3746")
         scan(s) : [list of] str
             Selection pattern
+        bulk : bool, default=self.bulk
+            Fetch the whole project catalogue in a single request,
+            and filter it locally.
 
         Returns
         -------
@@ -419,24 +769,50 @@ class XNAT:
         experiments = experiments or kwargs.pop('experiment', None)
         scans = scans or kwargs.pop('scan', None)
 
+        if self.bulk if bulk is None else bulk:
+            out = self._filter_catalogue(
+                project, 'scan', 'ID', subjects, experiments, scans
+            )
+            if out is not None:
+                return out
+
         out = []
         experiments = self.get_all_experiments(
             project, subjects, experiments
         )
-        for experiment in experiments:
-            proj, sub, exp = experiment.split('/')
-            subscans = filter_list(
-                self.get_scans(proj, sub, exp), scans
-            )
+        experiments = [experiment.split('/') for experiment in experiments]
+        listings = self.map(lambda x: self.get_scans(*x), experiments)
+        for (proj, sub, exp), subscans in zip(experiments, listings):
+            subscans = filter_list(subscans, scans)
             out.extend(map(
                 lambda x: f'{proj}/{sub}/{exp}/{x}', subscans
             ))
         return out
 
+    def _filter_catalogue(
+        self,
+        project: str,
+        type: str,
+        key: str,
+        subjects: str | Iterable[str] | None,
+        experiments: str | Iterable[str] | None,
+        elements: str | Iterable[str] | None,
+    ) -> list[str] | None:
+        catalogue = self.get_catalogue(project, type)
+        if catalogue is None:
+            return None
+        out = []
+        for sub in filter_list(list(catalogue.keys()), subjects):
+            for exp in filter_list(list(catalogue[sub].keys()), experiments):
+                elems = [elem[key] for elem in catalogue[sub][exp]]
+                elems = filter_list(elems, elements)
+                out.extend(map(lambda x: f'{project}/{sub}/{exp}/{x}', elems))
+        return out
+
     def get_subject(self, project: str, experiment: str):
         url = (f'{self.server}/data/archive/projects/'
                f'{project}/experiments/{experiment}/?format=json')
-        data = self.session.get(url).json()
+        data = self.get_json(url)
         return data['items'][0]['data_fields']['subject_ID']
 
     def get_downloader(
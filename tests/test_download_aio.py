@@ -0,0 +1,183 @@
+"""
+Tests of the asynchronous download engine, against a local HTTP server
+that honours (or ignores) `Range` and `HEAD` requests.
+"""
+import hashlib
+import os
+import subprocess
+import sys
+import threading
+import time
+from email.utils import formatdate
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from braindataprep.download import Downloader, DownloadManager
+
+pytest.importorskip('aiohttp')
+
+DATA = os.urandom(3 * 1024 * 1024 + 123)
+MD5 = hashlib.md5(DATA).hexdigest()
+
+
+class RangeHandler(BaseHTTPRequestHandler):
+    """Serve `DATA` at any path, with `Range` support"""
+
+    # Set to False to behave like a server that ignores `Range`
+    accept_ranges = True
+    # Delay (in seconds) between two blocks of 64 KiB, per path
+    delay = {}
+    # Requests received by the server: (method, range header)
+    requests = []
+
+    def log_message(self, *args):
+        pass
+
+    def _headers(self):
+        self.requests.append((self.command, self.headers.get('Range')))
+        start, stop = 0, len(DATA)
+        rng = self.headers.get('Range')
+        if rng and self.accept_ranges:
+            first, last = rng.split('=')[1].split('-')
+            start = int(first)
+            stop = min(int(last) + 1, len(DATA)) if last else len(DATA)
+            self.send_response(206)
+            self.send_header(
+                'Content-Range', f'bytes {start}-{stop-1}/{len(DATA)}'
+            )
+        else:
+            self.send_response(200)
+        self.send_header('Content-Length', str(stop - start))
+        self.send_header('Last-Modified', formatdate(0, usegmt=True))
+        self.end_headers()
+        return start, stop
+
+    def do_HEAD(self):
+        self._headers()
+
+    def do_GET(self):
+        start, stop = self._headers()
+        delay = self.delay.get(self.path, 0)
+        if not delay:
+            self.wfile.write(DATA[start:stop])
+            return
+        try:
+            for offset in range(start, stop, 1 << 16):
+                time.sleep(delay)
+                self.wfile.write(DATA[offset:min(offset + (1 << 16), stop)])
+        except ConnectionError:
+            pass
+
+
+@pytest.fixture
+def server():
+    """Start a local server. Yield (handler class, base URL)"""
+    handler = type('Handler', (RangeHandler,), {'requests': [], 'delay': {}})
+    httpd = ThreadingHTTPServer(('127.0.0.1', 0), handler)
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    try:
+        yield handler, f'http://127.0.0.1:{httpd.server_port}'
+    finally:
+        httpd.shutdown()
+        httpd.server_close()
+
+
+def is_locked(path):
+    """Whether another process holds the download lock of a file"""
+    code = (
+        'import sys, fasteners; '
+        'lock = fasteners.InterProcessLock(sys.argv[1]); '
+        'sys.exit(0 if lock.acquire(blocking=False) else 1)'
+    )
+    lockname = path.with_name(path.name + '.lock')
+    return subprocess.run([sys.executable, '-c', code, lockname]).returncode
+
+
+def download(url, dst, **kwargs):
+    downloader = Downloader(
+        url, dst, engine='async', digests={'md5': MD5}, **kwargs
+    )
+    return list(downloader)
+
+
+def test_full_download(server, tmp_path):
+    handler, url = server
+    dst = tmp_path / 'file.bin'
+    statuses = download(f'{url}/file.bin', dst)
+    assert dst.read_bytes() == DATA
+    assert statuses[-1]['status'] == 'done'
+    assert not dst.with_name('file.bin.download').exists()
+
+
+def test_resumed_download(server, tmp_path):
+    handler, url = server
+    dst = tmp_path / 'file.bin'
+    offset = 1024 * 1024
+    dst.with_name('file.bin.download').write_bytes(DATA[:offset])
+    dst.with_name('file.bin.checksum').write_text(MD5)
+    statuses = download(f'{url}/file.bin', dst)
+    assert dst.read_bytes() == DATA
+    assert statuses[-1]['status'] == 'done'
+    assert ('GET', f'bytes={offset}-') in handler.requests
+
+
+def test_server_ignores_range(server, tmp_path):
+    handler, url = server
+    handler.accept_ranges = False
+    dst = tmp_path / 'file.bin'
+    offset = 1024 * 1024
+    dst.with_name('file.bin.download').write_bytes(DATA[:offset])
+    dst.with_name('file.bin.checksum').write_text(MD5)
+    statuses = download(f'{url}/file.bin', dst)
+    # The server sends the full file: the first bytes are skipped
+    assert dst.read_bytes() == DATA
+    assert statuses[-1]['status'] == 'done'
+
+
+def test_manager_shares_loop(server, tmp_path):
+    handler, url = server
+    downloaders = [
+        Downloader(
+            f'{url}/file{i}.bin', tmp_path / f'file{i}.bin',
+            engine='async', digests={'md5': MD5},
+        )
+        for i in range(4)
+    ]
+    manager = DownloadManager(downloaders, workers=4)
+    statuses = [
+        status for _, status in
+        manager.iter_tasks(((str(i), d) for i, d in enumerate(downloaders)),
+                           manager.guard)
+    ]
+    assert not any(status.get('status') == 'error' for status in statuses)
+    for i in range(4):
+        assert (tmp_path / f'file{i}.bin').read_bytes() == DATA
+
+
+def test_manager_abort_unlocks(server, tmp_path):
+    handler, url = server
+    # The threaded download is slow to stop, so that the async one
+    # receives more statuses once the run is aborted
+    handler.delay = {'/file0.bin': 0.5, '/file1.bin': 0.01}
+    downloaders = [
+        Downloader(
+            f'{url}/file{i}.bin', tmp_path / f'file{i}.bin',
+            engine=engine, digests={'md5': MD5}, chunk_size=1 << 16,
+        )
+        for i, engine in enumerate(['requests', 'async'])
+    ]
+    manager = DownloadManager(downloaders, workers=2)
+    tasks = manager.iter_tasks(
+        ((str(i), d) for i, d in enumerate(downloaders)), manager.guard
+    )
+    for path, status in tasks:
+        if path == '1' and status.get('done', 0) > 1 << 18:
+            break
+    tasks.close()
+    for i in range(2):
+        dst = tmp_path / f'file{i}.bin'
+        assert not dst.exists()
+        assert dst.with_name(f'file{i}.bin.download').exists()
+        assert not is_locked(dst)
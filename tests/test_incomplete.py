@@ -0,0 +1,90 @@
+"""
+Tests of resumed downloads, and of the hash state that they save.
+"""
+import hashlib
+import json
+import os
+
+import pytest
+
+from braindataprep.digests import ResumableHash
+from braindataprep.download import incomplete
+from braindataprep.download import IncompleteFile
+
+DATA = os.urandom(1024 * 1024 + 17)
+MD5 = hashlib.md5(DATA).hexdigest()
+
+
+class Interrupted(Exception):
+    pass
+
+
+def interrupt(path, size, chunk_size=4096):
+    """Write the first `size` bytes of `DATA`, then fail"""
+    with pytest.raises(Interrupted):
+        with IncompleteFile(path, checksum=MD5, checkalgo='md5') as f:
+            for start in range(0, size, chunk_size):
+                f.append(DATA[start:min(start + chunk_size, size)])
+            raise Interrupted
+
+
+def resume(path, monkeypatch):
+    """Write the rest of `DATA`; return the digest and hashed offset"""
+    hashers = []
+
+    class SpyHasher(incomplete.CatchUpHasher):
+        def __init__(self, *args, **kwargs):
+            super().__init__(*args, **kwargs)
+            hashers.append(self.position)
+
+    monkeypatch.setattr(incomplete, 'CatchUpHasher', SpyHasher)
+    with IncompleteFile(path, checksum=MD5, checkalgo='md5') as f:
+        f.append(DATA[f.offset:])
+    return f.digest, hashers[0]
+
+
+@pytest.mark.skipif(
+    not ResumableHash.available('md5'), reason='no resumable md5'
+)
+def test_resume_from_saved_state(tmp_path, monkeypatch):
+    path = tmp_path / 'file.bin'
+    interrupt(path, 300000)
+    state = json.loads(path.with_name('file.bin.hashstate').read_text())
+    assert state['offset'] == 300000
+    digest, position = resume(path, monkeypatch)
+    assert position == 300000
+    assert digest == MD5
+    assert path.read_bytes() == DATA
+    assert not path.with_name('file.bin.hashstate').exists()
+
+
+@pytest.mark.skipif(
+    not ResumableHash.available('md5'), reason='no resumable md5'
+)
+def test_resume_from_checkpoint(tmp_path, monkeypatch):
+    monkeypatch.setattr(IncompleteFile, 'CHECKPOINT_SIZE', 100000)
+    path = tmp_path / 'file.bin'
+    hashstate = path.with_name('file.bin.hashstate')
+    with pytest.raises(Interrupted):
+        with IncompleteFile(path, checksum=MD5, checkalgo='md5') as f:
+            for start in range(0, 250000, 4096):
+                f.append(DATA[start:start + 4096])
+            checkpoint = hashstate.read_text()
+            raise Interrupted
+    # Pretend that the process was killed: the bytes written after the
+    # last checkpoint are hashed again
+    hashstate.write_text(checkpoint)
+    offset = json.loads(checkpoint)['offset']
+    assert 150000 < offset < 252000
+    digest, position = resume(path, monkeypatch)
+    assert position == offset
+    assert digest == MD5
+
+
+def test_resume_without_state(tmp_path, monkeypatch):
+    path = tmp_path / 'file.bin'
+    interrupt(path, 300000)
+    path.with_name('file.bin.hashstate').unlink(missing_ok=True)
+    digest, position = resume(path, monkeypatch)
+    assert position == 0
+    assert digest == MD5
@@ -0,0 +1,52 @@
+"""
+Tests of the OASIS-III bidsifier, on a small fake source tree.
+"""
+import io
+import tarfile
+
+import pytest
+
+from braindataprep.datasets.OASIS.III.bidsifier import Bidsifier
+
+SUBS = (1, 2, 3)
+SES = 'd0042'
+
+
+def make_archive(path, id):
+    """Write a fake `anat` archive with two T1w runs and their sidecars"""
+    prefix = f'OAS3{id:04d}_MR_{SES}/anat1/BIDS'
+    with tarfile.open(path, 'w:gz') as tar:
+        for run in (1, 2):
+            base = f'sub-OAS3{id:04d}_sess-{SES}_run-0{run}_T1w'
+            for ext, data in (
+                ('.nii.gz', bytes([id, run]) * 4096),
+                ('.json', b'{"Modality": "MR"}'),
+            ):
+                info = tarfile.TarInfo(f'{prefix}/{base}{ext}')
+                info.size = len(data)
+                tar.addfile(info, io.BytesIO(data))
+
+
+@pytest.fixture
+def root(tmp_path):
+    for id in SUBS:
+        folder = tmp_path / 'sourcedata' / f'OAS3{id:04d}_MR_{SES}'
+        folder.mkdir(parents=True)
+        make_archive(folder / 'anat1.tar.gz', id)
+    return tmp_path
+
+
+@pytest.mark.parametrize('jobs', [1, 4])
+def test_make_raw(root, jobs):
+    bids = Bidsifier(root, subs=SUBS, jobs=jobs)
+    bids.init()
+    statuses = list(bids.make_raw('T1w'))
+    assert not [s for s in statuses if s.get('status') == 'error']
+    assert bids.nb_errors == 0
+    for id in SUBS:
+        anat = root / 'rawdata' / f'sub-{id:04d}' / f'ses-{SES}' / 'anat'
+        for run in (1, 2):
+            base = anat / f'sub-{id:04d}_ses-{SES}_run-0{run}_T1w'
+            nii = base.with_name(base.name + '.nii.gz')
+            assert nii.read_bytes() == bytes([id, run]) * 4096
+            assert base.with_name(base.name + '.json').exists()